@@ -3,6 +3,15 @@ set -e
 if [ "${1:-}" = "render" ]; then
     shift
     exec renderknecht "$@"
+elif [ "${1:-}" = "worker" ]; then
+    shift
+    exec renderknecht worker "$@"
+elif [ "${1:-}" = "warmup" ]; then
+    shift
+    exec renderknecht warmup "$@"
+elif [ "${1:-}" = "loadtest" ]; then
+    shift
+    exec renderknecht loadtest "$@"
 else
     exec flask --app web run --host=0.0.0.0
 fi
@@ -1,13 +1,34 @@
 import argparse
 import logging
+import signal
 import subprocess
 import sys
 
+from . import loadtest, warmup
+from .queue import worker
 from .renderers import pandoc
+from .util import scratch
+from .util.pandoc_wrapper import OUTPUT_FORMATS
+
+
+def _exit_on_sigterm(signum: int, frame: object) -> None:
+    del frame  # unused
+    # raising SystemExit unwinds the render, so its scratch directory is removed
+    sys.exit(128 + signum)
 
 
 def main() -> None:
     logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:2] == ["worker"]:
+        worker.main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["warmup"]:
+        warmup.main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["loadtest"]:
+        loadtest.main(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(description="Render Markdown using Pandoc.")
     parser.add_argument(
         "markdown",
@@ -15,17 +36,37 @@ def main() -> None:
         type=str,
         help="Markdown content to render. If not provided, input will be read from stdin.",
     )
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="pdf",
+        help="Output format. 'html' renders a fast standalone preview without LaTeX.",
+    )
+    parser.add_argument(
+        "--draft",
+        action="store_true",
+        help="Render a quick draft PDF: single LaTeX pass, no title page or TOC, image placeholders.",
+    )
     args = parser.parse_args()
 
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    scratch.sweep_stale()
+
     markdown_content = args.markdown if args.markdown else sys.stdin.read()
 
     try:
-        result = pandoc.render_markdown(markdown_content, [])
+        result = pandoc.render_markdown(markdown_content, args.format, draft=args.draft)
         sys.stdout.buffer.write(result)
     except subprocess.CalledProcessError as e:
         logging.error(f"Subprocess error: {e}")
         sys.stderr.buffer.write(e.stderr)
         sys.exit(e.returncode)
+    except subprocess.TimeoutExpired as e:
+        logging.error(f"Rendering timed out after {e.timeout:g} seconds")
+        sys.exit(124)
+    except scratch.ScratchSpaceError as e:
+        logging.error(str(e))
+        sys.exit(1)
 
 
 if __name__ == "__main__":
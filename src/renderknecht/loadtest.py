@@ -0,0 +1,507 @@
+"""Load test of the web service.
+
+Starts the web service (and, optionally, render workers on a queue) against
+a stub HedgeDoc serving a corpus of pads, sends it a mix of requests from a
+number of concurrent clients and reports throughput, latency percentiles,
+error rates and the peak memory of every process.  pandoc can be replaced by
+a stub that answers after a delay growing with the size of the document, to
+measure the service itself rather than LaTeX.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import dataclasses
+import json
+import logging
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections.abc import Generator, Sequence
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import httpx
+
+ENDPOINTS = {
+    "pdf": "/pdf/{}",
+    "preview": "/preview/{}",
+    "hugo": "/hugo/{}",
+    "bundle": "/hugo/{}/bundle",
+}
+
+_STARTUP_TIMEOUT = 300.0
+_RSS_INTERVAL = 0.1
+
+# Stands in for pandoc: answers after a delay growing with the size of its input.
+_STUB_PANDOC = r"""
+import sys, time
+
+arguments = sys.argv[1:]
+to = arguments[arguments.index("-t") + 1] if "-t" in arguments else "html5"
+source = sys.stdin.buffer.read()
+time.sleep({seconds!r} + len(source) / 1024 * {seconds_per_kb!r})
+if to == "pdf":
+    sys.stdout.buffer.write(b"%PDF-1.4\n% renderknecht load test\n%%EOF\n")
+elif to == "latex":
+    sys.stdout.buffer.write(b"\\documentclass{{article}}\\begin{{document}}\\end{{document}}\n")
+else:
+    sys.stdout.buffer.write(b"<!DOCTYPE html><html><body>" + str(len(source)).encode() + b"</body></html>\n")
+"""
+
+_PARAGRAPH = (
+    "Renderknecht renders HedgeDoc pads to PDF with pandoc and LaTeX. This paragraph "
+    "only exists to give the document some weight, with *emphasis*, **strong text**, "
+    "`code` and a footnote.[^note] Inline math such as $e^{i\\pi} + 1 = 0$ is typeset too.\n"
+)
+
+
+class LoadTestError(Exception):
+    """Raised when the service under test cannot be started."""
+
+
+def synthetic_corpus(pads: int, sections: int) -> dict[str, str]:
+    """Return pads of growing size, with one up to ``sections`` sections."""
+    corpus = {}
+    for index in range(pads):
+        body = []
+        for section in range(1 + index % sections):
+            body.append(f"# Section {section + 1}\n\n{_PARAGRAPH}\n{_PARAGRAPH}")
+            body.append("| Column | Value |\n|--------|-------|\n| a      | 1     |\n| b      | 2     |\n")
+            body.append("- first item\n- second item\n  - nested item\n")
+        body.append("[^note]: A footnote.\n")
+        corpus[f"pad-{index}"] = f"---\ntitle: Load test pad {index}\n---\n\n" + "\n".join(body)
+    return corpus
+
+
+def load_corpus(directory: Path) -> dict[str, str]:
+    """Return the Markdown files of a directory as pads, named by their stem."""
+    corpus = {path.stem: path.read_text(encoding="utf-8") for path in sorted(directory.glob("*.md"))}
+    if not corpus:
+        raise LoadTestError(f"No Markdown files in {directory}")
+    return corpus
+
+
+class StubHedgeDoc:
+    """Serves the pads of a corpus through the parts of the HedgeDoc API renderknecht uses.
+
+    Besides the pads of the corpus, ``unique-<n>`` is a variant of a corpus
+    pad that differs from all others, so that it is never served from a cache.
+    """
+
+    def __init__(self, corpus: dict[str, str]) -> None:
+        self.corpus = corpus
+        self._names = list(corpus)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self._thread = threading.Thread(target=self.server.serve_forever, name="stub-hedgedoc", daemon=True)
+
+    def markdown(self, pad_id: str) -> str | None:
+        if pad_id.startswith("unique-") and pad_id[7:].isdigit():
+            number = int(pad_id[7:])
+            return f"{self.corpus[self._names[number % len(self._names)]]}\n<!-- {pad_id} -->\n"
+        return self.corpus.get(pad_id)
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:  # noqa: N802 (http.server API)
+                _, pad_id, *action = self.path.split("?")[0].split("/")
+                markdown = stub.markdown(pad_id)
+                if markdown is None or action not in (["download"], ["info"]):
+                    return self._send(404, "text/plain", b"Not found")
+                if action == ["download"]:
+                    return self._send(200, "text/markdown", markdown.encode())
+                info = {"title": pad_id, "createtime": 0, "updatetime": 0}
+                return self._send(200, "application/json", json.dumps(info).encode())
+
+            def _send(self, status: int, content_type: str, body: bytes) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: object) -> None:  # noqa: A002 (http.server API)
+                pass
+
+        return Handler
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def install_stub_pandoc(directory: Path, seconds: float, seconds_per_kb: float) -> Path:
+    """Write a stub ``pandoc`` executable to ``directory``, to be put first on PATH."""
+    directory.mkdir(parents=True, exist_ok=True)
+    script = directory / "pandoc"
+    source = _STUB_PANDOC.format(seconds=seconds, seconds_per_kb=seconds_per_kb)
+    script.write_text(f"#!{sys.executable}\n{source}")
+    script.chmod(0o755)
+    return script
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    """Parse a request mix such as ``pdf=8,hugo=2`` into weights per endpoint.
+
+    :raises ValueError: for unknown endpoints or invalid weights.
+    """
+    mix = {}
+    for part in value.split(","):
+        endpoint, _, weight = part.strip().partition("=")
+        if endpoint not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint {endpoint!r}; expected one of {', '.join(ENDPOINTS)}")
+        mix[endpoint] = float(weight or 1)
+        if mix[endpoint] < 0:
+            raise ValueError(f"Negative weight for {endpoint}")
+    if not sum(mix.values()):
+        raise ValueError("The request mix is empty")
+    return mix
+
+
+def plan(
+    pads: Sequence[str], mix: dict[str, float], unique: float, count: int, rng: random.Random
+) -> list[tuple[str, str]]:
+    """Return ``count`` requests as (endpoint, pad ID).
+
+    A share of ``unique`` requests asks for a pad no other request asks for;
+    the others ask for pads of the corpus, so they repeat.
+    """
+    endpoints = rng.choices(list(mix), weights=list(mix.values()), k=count)
+    requests = []
+    for number, endpoint in enumerate(endpoints):
+        pad_id = f"unique-{number}" if rng.random() < unique else rng.choice(pads)
+        requests.append((endpoint, pad_id))
+    return requests
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _descendants(pid: int) -> list[int]:
+    pids = [pid]
+    for children in Path(f"/proc/{pid}/task").glob("*/children"):
+        with contextlib.suppress(OSError):
+            for child in children.read_text().split():
+                pids += _descendants(int(child))
+    return pids
+
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def tree_rss(pid: int) -> int | None:
+    """Return the resident memory of a process and all its descendants in bytes (Linux only)."""
+    if not Path(f"/proc/{pid}/statm").exists():
+        return None
+    total = 0
+    for member in _descendants(pid):
+        with contextlib.suppress(OSError, IndexError, ValueError):
+            total += int(Path(f"/proc/{member}/statm").read_text().split()[1]) * _PAGE_SIZE
+    return total
+
+
+class Service:
+    """The web service and its render workers, started as separate processes.
+
+    While running, the resident memory of every process, including the
+    pandoc and LaTeX processes it runs, is sampled to find its peak.
+
+    :param env: Environment of the processes.
+    :param render_workers: Number of ``renderknecht worker`` processes; 0
+        renders in the web service.
+    :param log_dir: Where the output of the processes is written.
+    """
+
+    def __init__(self, env: dict[str, str], render_workers: int, log_dir: Path) -> None:
+        self.env = dict(env)
+        self.render_workers = render_workers
+        self.log_dir = log_dir
+        self.url = ""
+        self.processes: dict[str, subprocess.Popen] = {}
+        self.peak_rss: dict[str, int] = {}
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+
+    def _spawn(self, name: str, command: list[str]) -> None:
+        with open(self.log_dir / f"{name}.log", "wb") as log:
+            self.processes[name] = subprocess.Popen(
+                command, env=self.env, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT
+            )
+
+    def _sample(self) -> None:
+        while not self._stop.wait(_RSS_INTERVAL):
+            for name, proc in self.processes.items():
+                rss = tree_rss(proc.pid)
+                if rss is not None:
+                    self.peak_rss[name] = max(self.peak_rss.get(name, 0), rss)
+
+    def _log_tail(self, name: str) -> str:
+        return (self.log_dir / f"{name}.log").read_text(errors="replace")[-2000:]
+
+    def start(self, timeout: float = _STARTUP_TIMEOUT) -> None:
+        """Start the processes and wait until the web service reports ready.
+
+        :raises LoadTestError: if a process exits or the service is not ready in time.
+        """
+        if self.render_workers:
+            self.env["RENDERKNECHT_QUEUE"] = f"sqlite:///{self.log_dir / 'queue.db'}"
+        for number in range(self.render_workers):
+            self._spawn(f"worker-{number + 1}", [sys.executable, "-m", "renderknecht.cli", "worker"])
+        port = _free_port()
+        self.url = f"http://127.0.0.1:{port}"
+        self._spawn(
+            "web", [sys.executable, "-m", "flask", "--app", "renderknecht.web", "run", "--port", str(port)]
+        )
+        self._sampler.start()
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            for name, proc in self.processes.items():
+                if proc.poll() is not None:
+                    raise LoadTestError(f"{name} exited with code {proc.returncode}:\n{self._log_tail(name)}")
+            with contextlib.suppress(httpx.HTTPError):
+                if httpx.get(f"{self.url}/readyz", timeout=5.0).status_code == 200:
+                    return
+            time.sleep(0.2)
+        raise LoadTestError(f"The web service did not become ready within {timeout:g} s")
+
+    def stop(self) -> None:
+        self._stop.set()
+        for proc in self.processes.values():
+            proc.terminate()
+        for proc in self.processes.values():
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+
+
+@dataclasses.dataclass
+class Result:
+    """Outcome of a single request; ``status`` 0 means it failed without a response."""
+
+    endpoint: str
+    status: int
+    seconds: float
+
+    @property
+    def failed(self) -> bool:
+        return not 200 <= self.status < 400
+
+
+def drive(url: str, requests: Sequence[tuple[str, str]], concurrency: int, timeout: float) -> list[Result]:
+    """Send requests from ``concurrency`` clients, each sending its next request once the last one finished."""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    with httpx.Client(base_url=url, timeout=timeout, limits=limits) as client:
+
+        def send(request: tuple[str, str]) -> Result:
+            endpoint, pad_id = request
+            started = time.monotonic()
+            try:
+                response = client.get(ENDPOINTS[endpoint].format(pad_id))
+                response.read()
+                status = response.status_code
+            except httpx.HTTPError:
+                status = 0
+            return Result(endpoint, status, time.monotonic() - started)
+
+        with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+            return list(executor.map(send, requests))
+
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    """Return the nearest-rank percentile of ``values``, e.g. ``fraction=0.95`` for p95; NaN without values."""
+    if not values:
+        return math.nan
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(results: Sequence[Result], seconds: float) -> dict[str, dict[str, float]]:
+    """Return throughput, error rate and latency percentiles per endpoint and for all requests.
+
+    Without any completed request, the ``all`` row reports no requests, no
+    errors and NaN latencies.
+    """
+    groups: dict[str, list[Result]] = collections.defaultdict(list)
+    for result in results:
+        groups[result.endpoint].append(result)
+    groups = {**dict(sorted(groups.items())), "all": list(results)}
+    summary = {}
+    for endpoint, group in groups.items():
+        latencies = [result.seconds for result in group]
+        errors = sum(result.failed for result in group)
+        summary[endpoint] = {
+            "requests": len(group),
+            "errors": errors,
+            "error_rate": errors / len(group) if group else 0.0,
+            "throughput": len(group) / seconds if seconds > 0 else 0.0,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+        }
+    return summary
+
+
+def format_report(summary: dict[str, dict[str, float]], peak_rss: dict[str, int], seconds: float) -> str:
+    lines = [
+        f"{'endpoint':<10} {'requests':>8} {'errors':>7} {'req/s':>8} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8}"
+    ]
+    for endpoint, row in summary.items():
+        lines.append(
+            f"{endpoint:<10} {row['requests']:>8} {row['error_rate']:>7.1%} {row['throughput']:>8.2f} "
+            f"{row['p50']:>8.3f} {row['p95']:>8.3f} {row['p99']:>8.3f}"
+        )
+    lines.append(f"\nDuration: {seconds:.1f} s\n\nPeak RSS (including pandoc and LaTeX):")
+    lines += [f"  {name:<10} {rss / 1024 / 1024:>8.1f} MiB" for name, rss in peak_rss.items()]
+    return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def _hedgedoc(corpus: dict[str, str]) -> Generator[StubHedgeDoc]:
+    stub = StubHedgeDoc(corpus)
+    stub.start()
+    try:
+        yield stub
+    finally:
+        stub.stop()
+
+
+def run(
+    corpus: dict[str, str],
+    mix: dict[str, float],
+    requests: int,
+    concurrency: int,
+    unique: float = 0.0,
+    render_workers: int = 0,
+    stub_pandoc: tuple[float, float] | None = (0.2, 0.01),
+    timeout: float = 600.0,
+    seed: int | None = None,
+) -> dict:
+    """Load-test the web service and return the report.
+
+    The processes inherit the environment of this process, so the service is
+    configured as usual (render cache, pandoc server, limits, ...); only
+    HEDGEDOC_URL points to the stub.
+
+    :param stub_pandoc: Seconds a stub pandoc takes per render and per KiB of
+        Markdown; None runs the real pandoc.
+    :returns: ``summary`` (see :func:`summarize`), ``peak_rss`` in bytes per process and ``seconds``.
+    """
+    planned = plan(list(corpus), mix, unique, requests, random.Random(seed))  # noqa: S311 (not for security)
+    with tempfile.TemporaryDirectory(prefix="renderknecht-loadtest-") as tmp, _hedgedoc(corpus) as hedgedoc:
+        env = {**os.environ, "HEDGEDOC_URL": hedgedoc.url}
+        if stub_pandoc is not None:
+            install_stub_pandoc(Path(tmp) / "bin", *stub_pandoc)
+            env["PATH"] = f"{Path(tmp) / 'bin'}{os.pathsep}{env.get('PATH', '')}"
+            # the stub stands in for the pandoc executable only
+            env.pop("RENDERKNECHT_PANDOC_SERVER", None)
+        service = Service(env, render_workers, Path(tmp))
+        try:
+            service.start()
+            started = time.monotonic()
+            results = drive(service.url, planned, concurrency, timeout)
+            seconds = time.monotonic() - started
+        finally:
+            service.stop()
+    return {"summary": summarize(results, seconds), "peak_rss": service.peak_rss, "seconds": seconds}
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="renderknecht loadtest",
+        description="Measure throughput, latency and memory of the web service against a stub HedgeDoc.",
+    )
+    parser.add_argument(
+        "--corpus", type=Path, help="Directory of Markdown files served as pads (default: synthetic)"
+    )
+    parser.add_argument(
+        "--pads", type=int, default=20, help="Number of synthetic pads (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--sections",
+        type=int,
+        default=10,
+        help="Sections of the largest synthetic pad (default: %(default)s)",
+    )
+    parser.add_argument("--requests", type=int, default=200, help="Requests to send (default: %(default)s)")
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="Concurrent clients (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default="pdf=1",
+        help=f"Weights of the endpoints ({', '.join(ENDPOINTS)}), e.g. pdf=8,hugo=2 (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--unique",
+        type=float,
+        default=0.0,
+        help="Share of requests for pads no other request asks for (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--render-workers",
+        type=int,
+        default=0,
+        help="Render on this many queue workers instead of in the web service (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--real-pandoc", action="store_true", help="Render with pandoc and LaTeX instead of a stub"
+    )
+    parser.add_argument(
+        "--stub-seconds",
+        type=float,
+        nargs=2,
+        default=(0.2, 0.01),
+        metavar=("PER_RENDER", "PER_KIB"),
+        help="Time the stub pandoc takes per render and per KiB of Markdown (default: 0.2 0.01)",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=600.0, help="Timeout of a request (default: %(default)s)"
+    )
+    parser.add_argument("--seed", type=int, help="Seed of the request mix")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+    # one line per request would drown the report
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    try:
+        corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.pads, args.sections)
+        report = run(
+            corpus,
+            args.mix,
+            args.requests,
+            args.concurrency,
+            unique=args.unique,
+            render_workers=args.render_workers,
+            stub_pandoc=None if args.real_pandoc else tuple(args.stub_seconds),
+            timeout=args.timeout,
+            seed=args.seed,
+        )
+    except LoadTestError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(format_report(report["summary"], report["peak_rss"], report["seconds"]))
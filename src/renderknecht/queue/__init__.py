@@ -0,0 +1,58 @@
+"""Queue between the web front-end and render workers.
+
+Without RENDERKNECHT_QUEUE, the front-end renders in its request threads.
+With it, renders are submitted as jobs and rendered by ``renderknecht worker``
+processes, which may run in any number of containers:
+
+- ``sqlite:///path/to/queue.db``: SQLite database and result files on a
+  volume shared by the front-end and the workers of a single host.
+- ``redis://host:port/db``: Redis server shared by workers on any host;
+  needs the optional ``redis`` dependency (``renderknecht[redis]``).
+"""
+
+import os
+
+from .base import (
+    MAX_ATTEMPTS,
+    Job,
+    JobQueue,
+    JobStatus,
+    QueueError,
+    WorkerLostError,
+    describe_error,
+    raise_error,
+)
+from .sqlite_queue import SQLiteQueue, open_sqlite_queue
+
+__all__ = [
+    "MAX_ATTEMPTS",
+    "Job",
+    "JobQueue",
+    "JobStatus",
+    "QueueError",
+    "SQLiteQueue",
+    "WorkerLostError",
+    "describe_error",
+    "open_queue",
+    "raise_error",
+]
+
+
+def open_queue(url: str | None = None) -> JobQueue | None:
+    """Open the job queue at ``url``, defaulting to RENDERKNECHT_QUEUE.
+
+    :returns: The queue, or None when renders run in-process.
+    :raises QueueError: if the URL is not supported.
+    """
+    url = url if url is not None else os.environ.get("RENDERKNECHT_QUEUE", "")
+    if not url:
+        return None
+    if url.startswith("sqlite://"):
+        return open_sqlite_queue(url)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            from .redis_queue import open_redis_queue
+        except ImportError as e:
+            raise QueueError("the redis queue needs the redis package: install renderknecht[redis]") from e
+        return open_redis_queue(url)
+    raise QueueError(f"unsupported queue URL: {url}")
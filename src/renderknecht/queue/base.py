@@ -0,0 +1,219 @@
+import abc
+import dataclasses
+import enum
+import subprocess
+import time
+import uuid
+from collections.abc import Callable
+from typing import NoReturn
+
+from ..util import process, scratch
+
+_POLL_INTERVAL = 0.1
+
+# renders of a job whose worker died are retried this often before the job fails
+MAX_ATTEMPTS = 3
+
+
+class QueueError(RuntimeError):
+    """Raised when the job queue cannot be reached or is misconfigured."""
+
+
+class WorkerLostError(RuntimeError):
+    """Raised for a job whose workers kept dying while rendering it."""
+
+
+class JobStatus(enum.StrEnum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    @property
+    def finished(self) -> bool:
+        return self in (JobStatus.DONE, JobStatus.FAILED, JobStatus.CANCELLED)
+
+
+@dataclasses.dataclass
+class Job:
+    """A render of a Markdown document, as handed from the front-end to a worker."""
+
+    markdown: str
+    output_format: str = "pdf"
+    draft: bool = False
+    id: str = dataclasses.field(default_factory=lambda: uuid.uuid4().hex)
+    status: JobStatus = JobStatus.QUEUED
+    worker: str | None = None
+    attempts: int = 0
+    error: dict | None = None
+    created: float = dataclasses.field(default_factory=time.time)
+
+
+def describe_error(e: BaseException) -> dict:
+    """Serialize a render error, so that :func:`raise_error` can raise it again in the front-end."""
+    if isinstance(e, subprocess.TimeoutExpired):
+        return {"type": "timeout", "command": str(e.cmd), "timeout": e.timeout}
+    if isinstance(e, subprocess.CalledProcessError):
+        return {
+            "type": "process",
+            "command": str(e.cmd),
+            "returncode": e.returncode,
+            "stdout": (e.stdout or b"").decode(errors="replace"),
+            "stderr": (e.stderr or b"").decode(errors="replace"),
+        }
+    if isinstance(e, process.RenderCancelledError):
+        return {"type": "cancelled", "message": str(e)}
+    if isinstance(e, scratch.ScratchSpaceError):
+        return {"type": "scratch", "message": str(e)}
+    return {"type": "error", "message": f"{type(e).__name__}: {e}"}
+
+
+def raise_error(error: dict) -> NoReturn:
+    """Raise the exception described by ``error``, see :func:`describe_error`."""
+    match error.get("type"):
+        case "timeout":
+            raise subprocess.TimeoutExpired(error["command"], error["timeout"])
+        case "process":
+            raise subprocess.CalledProcessError(
+                error["returncode"], error["command"], error["stdout"].encode(), error["stderr"].encode()
+            )
+        case "cancelled":
+            raise process.RenderCancelledError(error["message"])
+        case "scratch":
+            raise scratch.ScratchSpaceError(error["message"])
+        case "worker-lost":
+            raise WorkerLostError(error["message"])
+        case _:
+            raise RuntimeError(error.get("message", "render failed"))
+
+
+class JobQueue(abc.ABC):
+    """Queue of render jobs, shared by the front-end and any number of workers.
+
+    Besides the jobs, a queue keeps their results and the registry of live
+    workers: workers send heartbeats while they are alive, and the jobs of
+    workers that stopped sending them are handed to other workers again.
+    """
+
+    @abc.abstractmethod
+    def submit(self, job: Job) -> str:
+        """Enqueue ``job`` and return its id."""
+
+    @abc.abstractmethod
+    def claim(self, worker_id: str, timeout: float = 0.0) -> Job | None:
+        """Take the next queued job, waiting up to ``timeout`` seconds for one."""
+
+    @abc.abstractmethod
+    def complete(self, job_id: str, result: bytes) -> None:
+        """Store the result of a job and mark it as done."""
+
+    @abc.abstractmethod
+    def fail(self, job_id: str, error: dict) -> None:
+        """Mark a job as failed with an error from :func:`describe_error`."""
+
+    @abc.abstractmethod
+    def cancel(self, job_id: str) -> None:
+        """Cancel a job; a worker rendering it stops at its next heartbeat."""
+
+    @abc.abstractmethod
+    def get(self, job_id: str) -> Job | None:
+        """Return a job, or None if it is unknown or was discarded."""
+
+    @abc.abstractmethod
+    def result(self, job_id: str) -> bytes | None:
+        """Return the result of a finished job."""
+
+    @abc.abstractmethod
+    def discard(self, job_id: str) -> None:
+        """Remove a job and its result."""
+
+    @abc.abstractmethod
+    def register_worker(self, worker_id: str) -> None:
+        """Add a worker to the registry."""
+
+    @abc.abstractmethod
+    def heartbeat(self, worker_id: str) -> None:
+        """Record that a worker is alive."""
+
+    @abc.abstractmethod
+    def unregister_worker(self, worker_id: str) -> None:
+        """Remove a worker from the registry, re-queueing the job it was rendering."""
+
+    @abc.abstractmethod
+    def workers(self) -> dict[str, float]:
+        """Return the registered workers with the time of their last heartbeat."""
+
+    @abc.abstractmethod
+    def requeue_stale(self, max_age: float) -> list[str]:
+        """Re-queue the jobs of workers without a heartbeat for ``max_age`` seconds.
+
+        Jobs that were already attempted :data:`MAX_ATTEMPTS` times fail
+        instead, so a document crashing its workers cannot take down one
+        worker after the other.
+
+        :returns: The ids of the re-queued jobs.
+        """
+
+    @abc.abstractmethod
+    def purge(self, max_age: float) -> int:
+        """Remove finished jobs older than ``max_age`` seconds that nobody fetched.
+
+        :returns: The number of removed jobs.
+        """
+
+    def close(self) -> None:  # noqa: B027 (optional to override)
+        """Release the connections of the queue."""
+
+    def wait(
+        self, job_id: str, timeout: float | None = None, cancelled: Callable[[], bool] | None = None
+    ) -> Job:
+        """Wait for a job to finish.
+
+        :raises subprocess.TimeoutExpired: if the job did not finish within ``timeout`` seconds.
+        :raises process.RenderCancelledError: once ``cancelled`` returns True.
+        :raises QueueError: if the job disappeared.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None:
+                raise QueueError(f"job {job_id} disappeared")
+            if job.status.finished:
+                return job
+            if cancelled is not None and cancelled():
+                raise process.RenderCancelledError(f"job {job_id} cancelled")
+            if deadline is not None and time.monotonic() > deadline:
+                raise subprocess.TimeoutExpired(f"job {job_id}", timeout or 0)
+            time.sleep(_POLL_INTERVAL)
+
+    def render(
+        self,
+        markdown: str,
+        output_format: str = "pdf",
+        draft: bool = False,
+        cancelled: Callable[[], bool] | None = None,
+    ) -> bytes:
+        """Render a document on a worker, like :func:`renderers.pandoc.render_markdown` does in-process.
+
+        The job is cancelled when the wait times out or ``cancelled`` returns
+        True, and errors of the worker are raised as the exceptions the
+        render raised there.
+        """
+        job_id = self.submit(Job(markdown, output_format, draft))
+        timeout = process.Limits.from_env().timeout
+        try:
+            # the worker enforces the render timeout; leave it time to report it
+            job = self.wait(job_id, None if timeout is None else timeout + 30, cancelled)
+        except BaseException:
+            self.cancel(job_id)
+            raise
+        try:
+            if job.status is JobStatus.DONE:
+                result = self.result(job_id)
+                if result is None:
+                    raise QueueError(f"result of job {job_id} is missing")
+                return result
+            raise_error(job.error or {"type": "cancelled", "message": f"job {job_id} cancelled"})
+        finally:
+            self.discard(job_id)
@@ -0,0 +1,214 @@
+import json
+import math
+import time
+
+import redis
+
+from .base import MAX_ATTEMPTS, Job, JobQueue, JobStatus
+
+_PREFIX = "renderknecht:"
+_QUEUE = f"{_PREFIX}queue"
+_WORKERS = f"{_PREFIX}workers"
+_FINISHED = f"{_PREFIX}finished"
+
+
+def _job_key(job_id: str) -> str:
+    return f"{_PREFIX}job:{job_id}"
+
+
+def _result_key(job_id: str) -> str:
+    return f"{_PREFIX}result:{job_id}"
+
+
+def _processing_key(worker_id: str) -> str:
+    return f"{_PREFIX}processing:{worker_id}"
+
+
+# the client does not decode responses, as results are binary; redis-py types them as bytes | str
+def _text(value: bytes | str) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _bytes(value: bytes | str) -> bytes:
+    return value.encode() if isinstance(value, str) else value
+
+
+class RedisQueue(JobQueue):
+    """Job queue in Redis, for workers spread over several hosts.
+
+    Queued job ids live in a list; claiming a job atomically moves its id to
+    a list of the claiming worker (``BLMOVE``), so a job is never lost
+    between a worker taking it and the worker dying.  Requires Redis 6.2.
+
+    :param client: Connection to the Redis server.
+    """
+
+    def __init__(self, client: redis.Redis) -> None:
+        self._redis = client
+
+    def submit(self, job: Job) -> str:
+        pipe = self._redis.pipeline()
+        pipe.hset(
+            _job_key(job.id),
+            mapping={
+                "markdown": job.markdown,
+                "output_format": job.output_format,
+                "draft": int(job.draft),
+                "status": JobStatus.QUEUED.value,
+                "attempts": 0,
+                "created": job.created,
+            },
+        )
+        pipe.lpush(_QUEUE, job.id)
+        pipe.execute()
+        return job.id
+
+    def claim(self, worker_id: str, timeout: float = 0.0) -> Job | None:
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                # redis-py types the timeout of BLMOVE as whole seconds
+                claimed = self._redis.blmove(
+                    _QUEUE, _processing_key(worker_id), math.ceil(remaining), "RIGHT", "LEFT"
+                )
+            else:
+                claimed = self._redis.lmove(_QUEUE, _processing_key(worker_id), "RIGHT", "LEFT")
+            if claimed is None:
+                return None
+            job_id = _text(claimed)
+            status = self._redis.hget(_job_key(job_id), "status")
+            if status is None or _text(status) != JobStatus.QUEUED.value:
+                # cancelled (or discarded) while waiting in the queue
+                self._redis.lrem(_processing_key(worker_id), 0, job_id)
+                continue
+            pipe = self._redis.pipeline()
+            pipe.hset(_job_key(job_id), mapping={"status": JobStatus.RUNNING.value, "worker": worker_id})
+            pipe.hincrby(_job_key(job_id), "attempts", 1)
+            pipe.execute()
+            job = self.get(job_id)
+            if job is not None:
+                return job
+
+    def _finish(self, job_id: str, status: JobStatus, error: dict | None = None) -> None:
+        current, worker = self._redis.hmget(_job_key(job_id), "status", "worker")
+        if current is None or _text(current) == JobStatus.CANCELLED.value:
+            return
+        pipe = self._redis.pipeline()
+        pipe.hset(
+            _job_key(job_id), mapping={"status": status.value, "error": json.dumps(error) if error else ""}
+        )
+        if worker:
+            pipe.lrem(_processing_key(_text(worker)), 0, job_id)
+        pipe.zadd(_FINISHED, {job_id: time.time()})
+        pipe.execute()
+
+    def complete(self, job_id: str, result: bytes) -> None:
+        self._redis.set(_result_key(job_id), result)
+        self._finish(job_id, JobStatus.DONE)
+
+    def fail(self, job_id: str, error: dict) -> None:
+        self._finish(job_id, JobStatus.FAILED, error)
+
+    def cancel(self, job_id: str) -> None:
+        status, worker = self._redis.hmget(_job_key(job_id), "status", "worker")
+        if status is None or _text(status) not in (JobStatus.QUEUED.value, JobStatus.RUNNING.value):
+            return
+        pipe = self._redis.pipeline()
+        pipe.hset(_job_key(job_id), "status", JobStatus.CANCELLED.value)
+        pipe.lrem(_QUEUE, 0, job_id)
+        if worker:
+            # _finish() leaves cancelled jobs alone, so the id would stay in the worker's list
+            pipe.lrem(_processing_key(_text(worker)), 0, job_id)
+        pipe.zadd(_FINISHED, {job_id: time.time()})
+        pipe.execute()
+
+    def get(self, job_id: str) -> Job | None:
+        fields = {_text(key): _text(value) for key, value in self._redis.hgetall(_job_key(job_id)).items()}
+        if not fields:
+            return None
+        return Job(
+            markdown=fields["markdown"],
+            output_format=fields["output_format"],
+            draft=fields["draft"] == "1",
+            id=job_id,
+            status=JobStatus(fields["status"]),
+            worker=fields.get("worker") or None,
+            attempts=int(fields["attempts"]),
+            error=json.loads(fields["error"]) if fields.get("error") else None,
+            created=float(fields["created"]),
+        )
+
+    def result(self, job_id: str) -> bytes | None:
+        result = self._redis.get(_result_key(job_id))
+        return None if result is None else _bytes(result)
+
+    def discard(self, job_id: str) -> None:
+        pipe = self._redis.pipeline()
+        pipe.delete(_job_key(job_id), _result_key(job_id))
+        pipe.zrem(_FINISHED, job_id)
+        pipe.execute()
+
+    def register_worker(self, worker_id: str) -> None:
+        self.heartbeat(worker_id)
+
+    def heartbeat(self, worker_id: str) -> None:
+        self._redis.hset(_WORKERS, worker_id, time.time())
+
+    def unregister_worker(self, worker_id: str) -> None:
+        self._requeue(worker_id)
+        self._redis.hdel(_WORKERS, worker_id)
+
+    def workers(self) -> dict[str, float]:
+        return {_text(key): float(value) for key, value in self._redis.hgetall(_WORKERS).items()}
+
+    def _requeue(self, worker_id: str) -> list[str]:
+        requeued = []
+        # RPOP without a count returns a single id, or None once the list is empty
+        while isinstance(popped := self._redis.rpop(_processing_key(worker_id)), bytes | str):
+            job_id = _text(popped)
+            job = self.get(job_id)
+            if job is None or job.status is not JobStatus.RUNNING:
+                continue
+            if job.attempts >= MAX_ATTEMPTS:
+                error = {"type": "worker-lost", "message": f"workers died {job.attempts} times rendering"}
+                self._finish(job_id, JobStatus.FAILED, error)
+                continue
+            pipe = self._redis.pipeline()
+            pipe.hset(_job_key(job_id), mapping={"status": JobStatus.QUEUED.value, "worker": ""})
+            # the job has waited longest; it is claimed next
+            pipe.rpush(_QUEUE, job_id)
+            pipe.execute()
+            requeued.append(job_id)
+        return requeued
+
+    def requeue_stale(self, max_age: float) -> list[str]:
+        cutoff = time.time() - max_age
+        workers = self.workers()
+        dead = [worker_id for worker_id, heartbeat in workers.items() if heartbeat < cutoff]
+        # processing lists of workers that vanished from the registry entirely count as stale, too
+        for key in self._redis.scan_iter(match=_processing_key("*")):
+            worker_id = _text(key).removeprefix(_processing_key(""))
+            if worker_id not in workers:
+                dead.append(worker_id)
+        requeued = []
+        for worker_id in dead:
+            requeued += self._requeue(worker_id)
+            self._redis.hdel(_WORKERS, worker_id)
+        return requeued
+
+    def purge(self, max_age: float) -> int:
+        finished = self._redis.zrangebyscore(_FINISHED, "-inf", time.time() - max_age)
+        # without scores, the range holds ids only
+        job_ids = [_text(job_id) for job_id in finished if isinstance(job_id, bytes | str)]
+        for job_id in job_ids:
+            self.discard(job_id)
+        return len(job_ids)
+
+    def close(self) -> None:
+        self._redis.close()
+
+
+def open_redis_queue(url: str) -> RedisQueue:
+    """Open the queue of a ``redis://host:port/db`` URL."""
+    return RedisQueue(redis.Redis.from_url(url))
@@ -0,0 +1,254 @@
+import contextlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections.abc import Generator
+from pathlib import Path
+
+from .base import MAX_ATTEMPTS, Job, JobQueue, JobStatus
+
+_POLL_INTERVAL = 0.2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    markdown TEXT NOT NULL,
+    output_format TEXT NOT NULL,
+    draft INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    heartbeat REAL NOT NULL
+);
+"""
+
+
+class SQLiteQueue(JobQueue):
+    """Job queue in an SQLite database, for workers on a single host.
+
+    The database may be shared by any number of processes (or containers
+    sharing a volume); results are stored as files next to it, so that large
+    PDFs do not hold the database lock while they are written.
+
+    :param path: The database file.
+    :param result_dir: Directory for the results; defaults to ``<path>.results``.
+    """
+
+    def __init__(self, path: Path, result_dir: Path | None = None) -> None:
+        self.path = path
+        self.result_dir = result_dir or path.with_name(f"{path.name}.results")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.result_dir.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+            with self._connections_lock:
+                self._connections.append(db)
+        return db
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Generator[sqlite3.Connection]:
+        db = self._connection()
+        # take the write lock up front, so that two workers cannot claim the same job
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _result_path(self, job_id: str) -> Path:
+        return self.result_dir / job_id
+
+    @staticmethod
+    def _job(row: sqlite3.Row) -> Job:
+        return Job(
+            markdown=row["markdown"],
+            output_format=row["output_format"],
+            draft=bool(row["draft"]),
+            id=row["id"],
+            status=JobStatus(row["status"]),
+            worker=row["worker"],
+            attempts=row["attempts"],
+            error=json.loads(row["error"]) if row["error"] else None,
+            created=row["created"],
+        )
+
+    def submit(self, job: Job) -> str:
+        with self._transaction() as db:
+            db.execute(
+                "INSERT INTO jobs (id, markdown, output_format, draft, status, attempts, created, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job.id,
+                    job.markdown,
+                    job.output_format,
+                    job.draft,
+                    JobStatus.QUEUED,
+                    0,
+                    job.created,
+                    time.time(),
+                ),
+            )
+        return job.id
+
+    def claim(self, worker_id: str, timeout: float = 0.0) -> Job | None:
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._transaction() as db:
+                row = db.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created LIMIT 1", (JobStatus.QUEUED,)
+                ).fetchone()
+                if row is not None:
+                    db.execute(
+                        "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                        (JobStatus.RUNNING, worker_id, time.time(), row["id"]),
+                    )
+                    job = self._job(row)
+                    job.status, job.worker, job.attempts = JobStatus.RUNNING, worker_id, job.attempts + 1
+                    return job
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(_POLL_INTERVAL)
+
+    def _finish(self, job_id: str, status: JobStatus, error: dict | None = None) -> None:
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ? AND status != ?",
+                (status, json.dumps(error) if error else None, time.time(), job_id, JobStatus.CANCELLED),
+            )
+
+    def complete(self, job_id: str, result: bytes) -> None:
+        # write to a temporary file first; readers must never see a partial result
+        with tempfile.NamedTemporaryFile(dir=self.result_dir, prefix=f".{job_id}-", delete=False) as f:
+            f.write(result)
+        Path(f.name).replace(self._result_path(job_id))
+        self._finish(job_id, JobStatus.DONE)
+
+    def fail(self, job_id: str, error: dict) -> None:
+        self._finish(job_id, JobStatus.FAILED, error)
+
+    def cancel(self, job_id: str) -> None:
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, updated = ? WHERE id = ? AND status IN (?, ?)",
+                (JobStatus.CANCELLED, time.time(), job_id, JobStatus.QUEUED, JobStatus.RUNNING),
+            )
+
+    def get(self, job_id: str) -> Job | None:
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return None if row is None else self._job(row)
+
+    def result(self, job_id: str) -> bytes | None:
+        try:
+            return self._result_path(job_id).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def discard(self, job_id: str) -> None:
+        with self._transaction() as db:
+            db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        self._result_path(job_id).unlink(missing_ok=True)
+
+    def register_worker(self, worker_id: str) -> None:
+        self.heartbeat(worker_id)
+
+    def heartbeat(self, worker_id: str) -> None:
+        with self._transaction() as db:
+            db.execute(
+                "INSERT INTO workers (id, heartbeat) VALUES (?, ?)"
+                " ON CONFLICT (id) DO UPDATE SET heartbeat = excluded.heartbeat",
+                (worker_id, time.time()),
+            )
+
+    def unregister_worker(self, worker_id: str) -> None:
+        with self._transaction() as db:
+            self._requeue(db, [worker_id])
+            db.execute("DELETE FROM workers WHERE id = ?", (worker_id,))
+
+    def workers(self) -> dict[str, float]:
+        rows = self._connection().execute("SELECT id, heartbeat FROM workers").fetchall()
+        return {row["id"]: row["heartbeat"] for row in rows}
+
+    @staticmethod
+    def _requeue(db: sqlite3.Connection, worker_ids: list[str]) -> list[str]:
+        requeued = []
+        for worker_id in worker_ids:
+            rows = db.execute(
+                "SELECT id, attempts FROM jobs WHERE worker = ? AND status = ?",
+                (worker_id, JobStatus.RUNNING),
+            ).fetchall()
+            for row in rows:
+                if row["attempts"] >= MAX_ATTEMPTS:
+                    error = {
+                        "type": "worker-lost",
+                        "message": f"workers died {row['attempts']} times rendering",
+                    }
+                    db.execute(
+                        "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ?",
+                        (JobStatus.FAILED, json.dumps(error), time.time(), row["id"]),
+                    )
+                else:
+                    db.execute(
+                        "UPDATE jobs SET status = ?, worker = NULL, updated = ? WHERE id = ?",
+                        (JobStatus.QUEUED, time.time(), row["id"]),
+                    )
+                    requeued.append(row["id"])
+        return requeued
+
+    def requeue_stale(self, max_age: float) -> list[str]:
+        cutoff = time.time() - max_age
+        with self._transaction() as db:
+            dead = [row["id"] for row in db.execute("SELECT id FROM workers WHERE heartbeat < ?", (cutoff,))]
+            # jobs of workers that vanished from the registry entirely count as stale, too
+            orphaned = db.execute(
+                "SELECT DISTINCT worker FROM jobs WHERE status = ? AND worker NOT IN (SELECT id FROM workers)",
+                (JobStatus.RUNNING,),
+            ).fetchall()
+            requeued = self._requeue(db, dead + [row["worker"] for row in orphaned])
+            db.executemany("DELETE FROM workers WHERE id = ?", [(worker_id,) for worker_id in dead])
+        return requeued
+
+    def purge(self, max_age: float) -> int:
+        cutoff = time.time() - max_age
+        with self._transaction() as db:
+            rows = db.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated < ? RETURNING id",
+                (JobStatus.DONE, JobStatus.FAILED, JobStatus.CANCELLED, cutoff),
+            ).fetchall()
+        for row in rows:
+            self._result_path(row["id"]).unlink(missing_ok=True)
+        return len(rows)
+
+    def close(self) -> None:
+        with self._connections_lock:
+            for db in self._connections:
+                db.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+def open_sqlite_queue(url: str) -> SQLiteQueue:
+    """Open the queue of a ``sqlite:///path/to/queue.db`` URL."""
+    path = url.removeprefix("sqlite://")
+    return SQLiteQueue(Path(os.path.expanduser(path)))
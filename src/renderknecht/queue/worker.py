@@ -0,0 +1,133 @@
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+
+from .. import warmup
+from ..renderers import pandoc
+from ..util import pdf, process, scratch
+from ..util import yaml as util_yaml
+from . import open_queue
+from .base import Job, JobQueue, JobStatus, describe_error
+
+_HEARTBEAT_INTERVAL = 5.0
+# a worker is considered dead after missing this many heartbeats
+_MISSED_HEARTBEATS = 6
+# finished jobs whose front-end went away are removed after an hour
+_KEEP_FINISHED = 60 * 60
+
+
+class Worker:
+    """Renders the jobs of a queue, one at a time.
+
+    While it runs, the worker sends heartbeats, so that its job is re-queued
+    if it dies, and checks whether its current job was cancelled, in which
+    case the render is killed.  Every worker also re-queues the jobs of dead
+    workers, so no coordinator process is needed.
+
+    :param queue: The queue to take jobs from.
+    :param worker_id: Unique name of the worker; defaults to host name, PID and a random suffix.
+    :param heartbeat_interval: Seconds between heartbeats.
+    """
+
+    def __init__(
+        self, queue: JobQueue, worker_id: str | None = None, heartbeat_interval: float = _HEARTBEAT_INTERVAL
+    ) -> None:
+        self.queue = queue
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.heartbeat_interval = heartbeat_interval
+        self.stop = threading.Event()
+        self._job: Job | None = None
+        self._cancelled = threading.Event()
+
+    def _heartbeat(self) -> None:
+        while not self.stop.wait(self.heartbeat_interval):
+            try:
+                self.queue.heartbeat(self.worker_id)
+                job = self._job
+                current = self.queue.get(job.id) if job is not None else None
+                if current is not None and current.status is JobStatus.CANCELLED:
+                    self._cancelled.set()
+                self.queue.requeue_stale(self.heartbeat_interval * _MISSED_HEARTBEATS)
+                self.queue.purge(_KEEP_FINISHED)
+            except Exception:
+                logging.exception("heartbeat of worker %s failed", self.worker_id)
+
+    def process(self, job: Job) -> None:
+        """Render ``job`` and store its result or error in the queue."""
+        self._job = job
+        self._cancelled.clear()
+        started = time.monotonic()
+        try:
+            supervisor = process.Supervisor(cancelled=self._cancelled.is_set)
+            result = pandoc.render_markdown(
+                job.markdown, job.output_format, draft=job.draft, supervisor=supervisor
+            )
+        except Exception as e:
+            logging.warning("job %s failed: %s", job.id, e)
+            self.queue.fail(job.id, describe_error(e))
+        else:
+            logging.info("job %s rendered in %.1fs", job.id, time.monotonic() - started)
+            self.queue.complete(job.id, result)
+        finally:
+            self._job = None
+
+    def run(self) -> None:
+        """Process jobs until :attr:`stop` is set."""
+        self.queue.register_worker(self.worker_id)
+        heartbeat = threading.Thread(target=self._heartbeat, name="heartbeat", daemon=True)
+        heartbeat.start()
+        logging.info("worker %s started", self.worker_id)
+        try:
+            while not self.stop.is_set():
+                job = self.queue.claim(self.worker_id, timeout=1.0)
+                if job is not None:
+                    self.process(job)
+        finally:
+            self.stop.set()
+            heartbeat.join()
+            self.queue.unregister_worker(self.worker_id)
+            logging.info("worker %s stopped", self.worker_id)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="renderknecht worker", description="Render the jobs submitted to the render queue."
+    )
+    parser.add_argument(
+        "--queue",
+        default=os.environ.get("RENDERKNECHT_QUEUE", ""),
+        help="Queue URL (sqlite:///path or redis://host:port/db); defaults to RENDERKNECHT_QUEUE.",
+    )
+    parser.add_argument("--id", help="Unique worker name; defaults to host name and PID.")
+    args = parser.parse_args(argv)
+
+    queue = open_queue(args.queue)
+    if queue is None:
+        parser.error("no queue configured; pass --queue or set RENDERKNECHT_QUEUE")
+    try:
+        pdf.Optimization.from_env()
+    except ValueError as e:
+        parser.error(str(e))
+    util_yaml.configure()
+    scratch.sweep_stale()
+
+    if warmup.enabled():
+        warmup.warm_up()
+    worker = Worker(queue, args.id)
+
+    def stop(signum: int, frame: object) -> None:
+        del signum, frame  # unused
+        # finish the current job; a worker killed anyway has its job re-queued
+        worker.stop.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        worker.run()
+    finally:
+        queue.close()
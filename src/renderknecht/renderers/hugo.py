@@ -1,14 +1,27 @@
 import copy
+import hashlib
+import logging
 import re
+from collections.abc import Callable
+from pathlib import Path
 
+import httpx
 import yaml
 from yaml import SafeLoader
 
+from ..util import hedgedoc
 from ..util import yaml as util_yaml
+from . import pandoc
 
 CSLReferences = list | None
 References = dict
 
+# the content of a bundle file, or the file to copy
+BundleFile = bytes | Path
+FindUpload = Callable[[str], BundleFile | None]
+
+_UPLOAD_PATTERN = re.compile(r"(?:https?://[^/\s)\"']+)?/uploads/([\w.-]+)")
+
 
 def transform_references(references: CSLReferences) -> References:
     if not references:
@@ -56,10 +69,11 @@ def transform_markdown_tables(markdown: str) -> str:
         new_table_format = f'{{{{< table title="{caption}" >}}}}\n{table_content}\n{{{{< /table >}}}}'
         return new_table_format
 
-    # Regex to match the markdown table with the caption
+    # Regex to match the markdown table with the caption; line by line, as spanning lines
+    # backtracks catastrophically on documents with many tables without captions
     table_with_caption_pattern = re.compile(
-        r"((\|.+?\|\n(\|\:?.*?\|\n)+).*?\nTable:\s*(.*?))(?=\n|$)",
-        re.DOTALL | re.MULTILINE,
+        r"^((\|.*\|\n(\|:?.*\|\n)+)[ \t]*\nTable:[ \t]*(.*?))(?=\n|$)",
+        re.MULTILINE,
     )
 
     # Replace the matched pattern using the defined function
@@ -92,3 +106,67 @@ def prepare_markdown(hedgedoc_markdown: str) -> str:
         f"{add_more_section(yaml_metadata)}"
         f"{transform_markdown_tables(inline_references(md_str, references))}"
     )
+
+
+def bundle_diagrams(markdown: str) -> tuple[str, dict[str, BundleFile]]:
+    """Replace diagram blocks with images of pre-rendered SVGs.
+
+    Diagrams are rendered through :func:`pandoc.render_diagram`, so the
+    diagram cache is shared with PDF renders.
+
+    :returns: The Markdown and the SVGs by file name.
+    """
+    files: dict[str, BundleFile] = {}
+
+    def replace(match: re.Match) -> str:
+        svg = pandoc.render_diagram(match.group(1), match.group(6)).encode()
+        name = f"{match.group(1)}-{hashlib.sha256(svg).hexdigest()[:12]}.svg"
+        files[name] = svg
+        formatting = f"{{ {match.group(5)} }}" if match.group(5) else ""
+        return f"\n![{match.group(3) or ''}]({name}){formatting}"
+
+    return pandoc.DIAGRAM_PATTERN.sub(replace, markdown), files
+
+
+def find_upload(name: str, client: hedgedoc.HedgeDocClient | None = None) -> BundleFile | None:
+    """Return a HedgeDoc upload from the mounted uploads volume, or else downloaded from HedgeDoc."""
+    local = pandoc.uploads_dir() / name
+    if local.is_file():
+        return local
+    if client is None:
+        return None
+    try:
+        return client.upload(name)
+    except httpx.HTTPError as e:
+        logging.warning("Could not fetch upload %s: %s", name, e)
+        return None
+
+
+def bundle_uploads(markdown: str, find: FindUpload) -> tuple[str, dict[str, BundleFile]]:
+    """Rewrite links to HedgeDoc uploads to files next to ``index.md``.
+
+    Uploads that cannot be found keep their original link.
+
+    :returns: The Markdown and the uploads by file name.
+    """
+    files: dict[str, BundleFile] = {}
+
+    def replace(match: re.Match) -> str:
+        name = match.group(1)
+        if name not in files and (content := find(name)) is not None:
+            files[name] = content
+        return name if name in files else match.group(0)
+
+    return _UPLOAD_PATTERN.sub(replace, markdown), files
+
+
+def prepare_bundle(hedgedoc_markdown: str, find: FindUpload) -> dict[str, BundleFile]:
+    """Prepare a self-contained Hugo page bundle of a pad.
+
+    :returns: The files of the bundle by name: ``index.md`` as prepared by
+        :func:`prepare_markdown`, the diagrams as SVGs and the uploads the
+        pad refers to, all linked relatively.
+    """
+    markdown, diagrams = bundle_diagrams(hedgedoc_markdown)
+    markdown, uploads = bundle_uploads(markdown, find)
+    return {"index.md": prepare_markdown(markdown).encode(), **diagrams, **uploads}
@@ -1,15 +1,17 @@
 import base64
+import collections
+import contextlib
 import copy
 import datetime
+import hashlib
 import importlib.resources
 import logging
 import os
 import re
 import string
-import subprocess
 import tempfile
+import threading
 from collections.abc import Callable
-from io import FileIO
 from pathlib import Path
 from zlib import compress
 
@@ -18,8 +20,10 @@ import yaml
 from graphviz import Source
 from yaml import SafeLoader
 
+from ..util import bibliography, image_cache, latex, metrics, pandoc_server, plantuml, process, scratch
+from ..util import pdf as util_pdf
 from ..util import yaml as util_yaml
-from ..util.pandoc_wrapper import determine_pandoc_arguments
+from ..util.pandoc_wrapper import determine_pandoc_arguments, determine_pandoc_server_parameters
 
 _RESOURCES = importlib.resources.files("renderknecht") / "resources"
 
@@ -63,6 +67,11 @@ _CREATOR = (
 )
 
 
+def uploads_dir() -> Path:
+    """Return the directory the HedgeDoc uploads volume is mounted at."""
+    return _UPLOADS_DIR
+
+
 def embed_images(markdown: str) -> str:
     """Rewrite HedgeDoc upload URLs to local filesystem paths.
 
@@ -81,7 +90,25 @@ def embed_images(markdown: str) -> str:
     return re.sub(r"https?://[^/]+/uploads/", f"{_UPLOADS_DIR}/", markdown)
 
 
-def render_graphviz(markup: str) -> str:
+def mirror_remote_images(markdown: str, directory: Path) -> str:
+    """Rewrite the remaining remote image URLs to files of the image cache, linked into ``directory``.
+
+    Without RENDERKNECHT_IMAGE_CACHE, remote images are left to pandoc.
+
+    :param markdown: Markdown text to process.
+    :param directory: Scratch directory of the render.
+    :returns: Markdown with remote image URLs replaced by local file paths.
+    """
+    cache = image_cache.shared_cache()
+    if cache is None:
+        return markdown
+    return image_cache.mirror_images(markdown, cache, directory)
+
+
+def render_graphviz(markup: str, supervisor: process.Supervisor | None = None) -> str:
+    # dot runs in-process of the graphviz package; the render is only checked before
+    if supervisor is not None:
+        supervisor.check("dot")
     return Source(markup).pipe(format="svg").decode("utf-8")
 
 
@@ -90,46 +117,91 @@ BASE64_ALPHABET = string.ascii_uppercase + string.ascii_lowercase + string.digit
 BASE64_TO_PLANTUML = bytes.maketrans(BASE64_ALPHABET.encode("utf-8"), PLANTUML_ALPHABET.encode("utf-8"))
 
 
-def render_plantuml(markup: str) -> str:
+_PLANTUML_DEFAULT_SERVER = "http://plantuml:8080"
+
+
+def render_plantuml_server(markup: str, server: str) -> str:
     # see: https://github.com/dougn/python-plantuml/blob/master/plantuml.py
     zlibbed_str = compress(markup.encode("utf-8"))
     compressed_string = zlibbed_str[2:-4]
     encoded = base64.b64encode(compressed_string).translate(BASE64_TO_PLANTUML).decode("utf-8")
-    response = httpx.get(f"http://plantuml:8080/svg/{encoded}")
+    response = httpx.get(f"{server.rstrip('/')}/svg/{encoded}")
     response.raise_for_status()
     return response.text
 
 
-Renderer = Callable[[str], str]
+def render_plantuml(markup: str, supervisor: process.Supervisor | None = None) -> str:
+    """Render PlantUML markup to SVG.
+
+    Uses the PlantUML server at ``PLANTUML_SERVER`` when that variable is set.
+    Otherwise, diagrams are streamed through a local PlantUML kept warm in pipe
+    mode (see :mod:`renderknecht.util.plantuml`), within the time limit of the
+    render supervised by ``supervisor``; without a local PlantUML, the
+    ``plantuml`` service of the container stack is used.
+    """
+    server = os.environ.get("PLANTUML_SERVER")
+    if server is None and (pipe := plantuml.shared_pipe()) is not None:
+        return pipe.render(markup, supervisor)
+    return render_plantuml_server(markup, server or _PLANTUML_DEFAULT_SERVER)
+
+
+Renderer = Callable[[str, process.Supervisor | None], str]
 TOOLS: dict[str, Renderer] = {
     "graphviz": render_graphviz,
     "plantuml": render_plantuml,
 }
 
-TemporaryFiles = list[FileIO]
+
+_DIAGRAM_CACHE_SIZE = int(os.environ.get("RENDERKNECHT_DIAGRAM_CACHE_SIZE", "256"))
+_DIAGRAM_CACHE: collections.OrderedDict[tuple[str, str], str] = collections.OrderedDict()
+_DIAGRAM_CACHE_LOCK = threading.Lock()
 
 
-def embed_diagrams(markdown: str, tmp_files: TemporaryFiles) -> str:
+def render_diagram(tool: str, markup: str, supervisor: process.Supervisor | None = None) -> str:
+    """Render a diagram to SVG, memoizing the result by tool and markup.
+
+    The cache is shared by all renders (PDF, HTML previews) of the process, so
+    unchanged diagrams are rendered only once while a document is edited.
+    ``supervisor`` is not part of the key; it bounds the render of a diagram
+    that is not cached yet.
+    """
+    key = (tool, markup)
+    with _DIAGRAM_CACHE_LOCK:
+        if key in _DIAGRAM_CACHE:
+            _DIAGRAM_CACHE.move_to_end(key)
+            return _DIAGRAM_CACHE[key]
+    svg = TOOLS[tool](markup, supervisor)
+    with _DIAGRAM_CACHE_LOCK:
+        _DIAGRAM_CACHE[key] = svg
+        while len(_DIAGRAM_CACHE) > _DIAGRAM_CACHE_SIZE:
+            _DIAGRAM_CACHE.popitem(last=False)
+    return svg
+
+
+# ```graphviz [caption|formatting] ...```; groups 1: tool, 3: caption, 5: formatting, 6: markup
+DIAGRAM_PATTERN = re.compile(r"```\s*(graphviz|plantuml)(\s+\[(.*?)(\|(.*?))?\])?\n(.*?)```", re.DOTALL)
+
+
+def embed_diagrams(markdown: str, directory: Path, supervisor: process.Supervisor | None = None) -> str:
+    """Replace diagram blocks with images of their SVGs, written to ``directory``."""
+
     def replace(match: re.Match) -> str:
         tool = match.group(1)
         block_content = match.group(6)
         caption = match.group(3) if match.group(3) else ""
         formatting = f"{{ {match.group(5)} }}" if match.group(5) else ""
-        with tempfile.NamedTemporaryFile(delete=False, mode="w", suffix=".svg") as tmp_file:
-            tmp_files.append(tmp_file)  # type: ignore
-            tmp_file.write(TOOLS[tool](block_content))
+        with tempfile.NamedTemporaryFile(delete=False, mode="w", suffix=".svg", dir=directory) as tmp_file:
+            tmp_file.write(render_diagram(tool, block_content, supervisor))
             return f"""
 ![{caption}]({tmp_file.name}){formatting}"""
 
-    return re.sub(
-        r"```\s*(graphviz|plantuml)(\s+\[(.*?)(\|(.*?))?\])?\n(.*?)```",
-        replace,
-        markdown,
-        flags=re.DOTALL,
-    )
+    return DIAGRAM_PATTERN.sub(replace, markdown)
 
 
-def augment_yaml_preamble(hedgedoc_markdown: str) -> tuple[str, util_yaml.YAMLMetadata]:
+def augment_yaml_preamble(
+    hedgedoc_markdown: str,
+    directory: Path | None = None,
+) -> tuple[str, util_yaml.YAMLMetadata]:
     augmented_metadata = {}
 
     def replace(match: re.Match) -> str:
@@ -183,6 +255,8 @@ def augment_yaml_preamble(hedgedoc_markdown: str) -> tuple[str, util_yaml.YAMLMe
         )
         augmented_metadata.setdefault("header-includes", []).append(creator_block)
 
+        augmented_metadata = bibliography.filter_references(augmented_metadata, hedgedoc_markdown, directory)
+
         return f"---\n{yaml.dump(augmented_metadata, default_flow_style=False, indent=2)}---"
 
     return re.sub(
@@ -199,10 +273,15 @@ def append_references(markdown: str, yaml_metadata: util_yaml.YAMLMetadata) -> s
     return markdown
 
 
-def prepare_markdown(hedgedoc_markdown: str, tmp_files: list[FileIO]) -> tuple[str, util_yaml.YAMLMetadata]:
-    enriched_markdown, yaml_metadata = augment_yaml_preamble(hedgedoc_markdown)
-    enriched_markdown = embed_diagrams(enriched_markdown, tmp_files)
+def prepare_markdown(
+    hedgedoc_markdown: str,
+    directory: Path,
+    supervisor: process.Supervisor | None = None,
+) -> tuple[str, util_yaml.YAMLMetadata]:
+    enriched_markdown, yaml_metadata = augment_yaml_preamble(hedgedoc_markdown, directory)
+    enriched_markdown = embed_diagrams(enriched_markdown, directory, supervisor)
     enriched_markdown = embed_images(enriched_markdown)
+    enriched_markdown = mirror_remote_images(enriched_markdown, directory)
     enriched_markdown = append_references(enriched_markdown, yaml_metadata)
 
     return (
@@ -211,17 +290,243 @@ def prepare_markdown(hedgedoc_markdown: str, tmp_files: list[FileIO]) -> tuple[s
     )
 
 
-def render_markdown(markdown: str, tmp_files: list[FileIO]) -> bytes:
-    markdown, metadata = prepare_markdown(markdown, tmp_files)
+_FENCED_DIV_PATTERN = re.compile(r"^[ \t>]*:{3,}[ \t]*(?:\{([^}]*)\}|([^\s:{}]+))", re.MULTILINE)
+_HTML_DIV_PATTERN = re.compile(r"<div\b([^>]*)>", re.IGNORECASE)
+# class="a b", class='a b' or class=a, in HTML tags and in the attributes of fenced divs
+_CLASS_ATTRIBUTE_PATTERN = re.compile(
+    r"(?<![\w-])class\s*=\s*(?:\"([^\"]*)\"|'([^']*)'|([^\s\"'>}]+))", re.IGNORECASE
+)
 
-    command = determine_pandoc_arguments(metadata)
-    process = subprocess.Popen(
-        command,
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    stdout, stderr = process.communicate(input=markdown.encode())
-    if process.returncode != 0:
-        raise subprocess.CalledProcessError(process.returncode, " ".join(command), stdout, stderr)
-    return stdout
+
+def _class_attributes(attributes: str) -> set[str]:
+    return {
+        name
+        for match in _CLASS_ATTRIBUTE_PATTERN.finditer(attributes)
+        for name in "".join(group or "" for group in match.groups()).split()
+    }
+
+
+def uses_latex_environments(markdown: str, yaml_metadata: util_yaml.YAMLMetadata) -> bool:
+    """Tell whether any div of the document is mapped by ``pandoc-latex-environment``.
+
+    The check is conservative: divs inside code blocks count as well.
+    """
+    environments = (yaml_metadata or {}).get("pandoc-latex-environment")
+    if not isinstance(environments, dict):
+        return False
+    definitions = [frozenset(classes) for classes in environments.values() if isinstance(classes, list)]
+
+    div_classes: list[set[str]] = []
+    for match in _FENCED_DIV_PATTERN.finditer(markdown):
+        if match.group(1) is not None:
+            attributes = match.group(1)
+            classes = {token[1:] for token in attributes.split() if token.startswith(".")}
+            div_classes.append(classes | _class_attributes(attributes))
+        else:
+            div_classes.append({match.group(2)})
+    for match in _HTML_DIV_PATTERN.finditer(markdown):
+        div_classes.append(_class_attributes(match.group(1)))
+
+    return any(classes >= definition for classes in div_classes for definition in definitions)
+
+
+_REMOTE_IMAGE_PATTERN = re.compile(
+    r"!\[[^\]]*\]\(\s*<?https?://|<img\b[^>]*\bsrc\s*=\s*[\"']?https?://", re.IGNORECASE
+)
+
+
+def renders_in_parallel(metadata: util_yaml.YAMLMetadata) -> bool:
+    """Tell whether a document opted in to compiling its chapters in parallel (``pandoc-options: [parallel]``)."""
+    return "parallel" in (metadata or {}).get("pandoc-options", [])
+
+
+_CONVERSIONS = metrics.REGISTRY.counter(
+    "renderknecht_pdf_conversions",
+    "Markdown to LaTeX conversions of PDFs by backend (server, pandoc) and why the server was not used",
+)
+
+
+def _server_fallback_reason(
+    markdown: str, metadata: util_yaml.YAMLMetadata, latex_environments: bool
+) -> str | None:
+    # the pandoc server runs no filters (neither crossref nor the LaTeX environment filter) and fetches no URLs
+    if _REMOTE_IMAGE_PATTERN.search(markdown):
+        return "remote-images"
+    if "crossref" in (metadata or {}).get("pandoc-options", []):
+        return "crossref"
+    if latex_environments:
+        return "latex-environments"
+    return None
+
+
+def _render_pdf_with_server(
+    markdown: str,
+    metadata: util_yaml.YAMLMetadata,
+    work_dir: scratch.ScratchDir,
+    draft: bool,
+    latex_environments: bool,
+    supervisor: process.Supervisor,
+) -> bytes | None:
+    """Render a PDF through the pandoc server, with LaTeX as a separate stage.
+
+    Returns None when no pandoc server is configured, or when the document
+    needs something only the pandoc executable can do (filters, remote images);
+    the caller then falls back to running pandoc.  Which backend converted a
+    document, and why the server did not, is counted in the metrics.
+    """
+    server = pandoc_server.shared_server()
+    if server is None:
+        _CONVERSIONS.inc(backend="pandoc", reason="disabled")
+        return None
+    if reason := _server_fallback_reason(markdown, metadata, latex_environments):
+        _CONVERSIONS.inc(backend="pandoc", reason=reason)
+        return None
+    request = determine_pandoc_server_parameters(metadata, draft=draft, latex_environments=latex_environments)
+    if request is None:
+        # e.g. the template or a bibliography cannot be sent
+        _CONVERSIONS.inc(backend="pandoc", reason="unsupported")
+        return None
+
+    parameters, files = request
+    try:
+        tex = server.convert(markdown, parameters, files, timeout=supervisor.remaining())
+    except pandoc_server.PandocServerError as e:
+        logging.warning("pandoc server failed, running pandoc instead: %s", e)
+        _CONVERSIONS.inc(backend="pandoc", reason="error")
+        return None
+    _CONVERSIONS.inc(backend="server")
+    latex_dir = work_dir.path / "latex"
+    tex_bytes = latex.convert_svg_images(tex.encode(), latex_dir, supervisor)
+    if not draft and renders_in_parallel(metadata):
+        return latex.run_latex_parallel(tex_bytes, work_dir=latex_dir, supervisor=supervisor)
+    return latex.run_latex(tex_bytes, passes=1 if draft else 3, work_dir=latex_dir, supervisor=supervisor)
+
+
+# targets of Markdown images and <img> tags; URLs are filtered out later
+_IMAGE_TARGET_PATTERN = re.compile(
+    r"!\[[^\]]*\]\(\s*<?([^\s)>]+)|<img\b[^>]*\bsrc\s*=\s*[\"']?([^\s\"'>]+)", re.IGNORECASE
+)
+
+
+def _work_dir_path(name: str) -> Path:
+    # relative paths are looked up in WORK_DIR, like pandoc's --resource-path
+    path = Path(name)
+    if not path.is_absolute() and (work_dir := os.environ.get("WORK_DIR")):
+        return Path(work_dir) / path
+    return path
+
+
+def referenced_files(markdown: str) -> set[Path]:
+    """Return the local files a document refers to: bibliographies, its title page logo and images.
+
+    Remote images and HedgeDoc uploads are left out; uploads never change.
+    """
+    paths: set[Path] = set()
+    metadata = None
+    if match := re.match(r"^---\s*(.*?)---", markdown, re.DOTALL):
+        with contextlib.suppress(yaml.YAMLError):
+            metadata = yaml.load(f"---\n{match.group(1)}", Loader=SafeLoader)
+    if isinstance(metadata, dict):
+        bibliography = metadata.get("bibliography") or []
+        for file in [bibliography] if isinstance(bibliography, str) else bibliography:
+            paths.add(_work_dir_path(str(file)))
+        if isinstance(logo := metadata.get("titlepage-logo"), str):
+            paths.add(Path(logo))
+            if resolved := _resolve_resource("", logo):
+                paths.add(resolved)
+    for match in _IMAGE_TARGET_PATTERN.finditer(markdown):
+        target = match.group(1) or match.group(2)
+        if "://" not in target and not target.startswith("data:"):
+            paths.add(_work_dir_path(target))
+    return paths
+
+
+def render_cache_key(markdown: str, output_format: str = "pdf", draft: bool = False) -> str:
+    """Return the key of a render in the render cache.
+
+    Besides the document, the key covers the renderknecht version, the
+    preamble and authors, the PDF post-processing in effect and the size and
+    modification time of the local files the document refers to (see
+    :func:`referenced_files`), so changing either invalidates cached renders.
+    Documents dated ``today`` get a new key every day.
+    """
+    digest = hashlib.sha256()
+    optimization = repr(util_pdf.Optimization.from_env())
+    for part in (_CREATOR, output_format, "draft" if draft else "final", optimization):
+        digest.update(part.encode() + b"\0")
+    for env_var, filename in (("PREAMBLE_YAML", "preamble.yaml"), ("AUTHORS_YAML", "authors.yaml")):
+        path = _resolve_resource(env_var, filename) or _resource_path(filename)
+        with contextlib.suppress(OSError):
+            content = path.read_bytes()
+            digest.update(content + b"\0")
+            if b"today" in content.lower():
+                digest.update(datetime.date.today().isoformat().encode())
+    for path in sorted(referenced_files(markdown)):
+        try:
+            stat = path.stat()
+            digest.update(f"{path}\0{stat.st_mtime_ns}\0{stat.st_size}\0".encode())
+        except OSError:
+            digest.update(f"{path}\0missing\0".encode())
+    if "today" in markdown.lower():
+        digest.update(datetime.date.today().isoformat().encode())
+    digest.update(markdown.encode())
+    return digest.hexdigest()
+
+
+def render_markdown(
+    markdown: str,
+    output_format: str = "pdf",
+    draft: bool = False,
+    supervisor: process.Supervisor | None = None,
+) -> bytes:
+    """Render HedgeDoc Markdown to ``output_format``.
+
+    All intermediate files (diagrams, LaTeX sources and outputs) are kept in a
+    scratch directory of this render, which is removed when the render ends.
+    pandoc and LaTeX run under ``supervisor``, which enforces the time and
+    resource limits of the render and kills its processes when it is cancelled.
+    Final PDFs are post-processed as configured by RENDERKNECHT_PDF_OPTIMIZE.
+
+    :raises subprocess.TimeoutExpired: if the render exceeds its time limit.
+    :raises process.RenderCancelledError: if the render is cancelled.
+    """
+    supervisor = supervisor or process.Supervisor()
+    with scratch.scratch_dir() as work_dir:
+        supervisor.checks.append(work_dir.check)
+        markdown, metadata = prepare_markdown(markdown, work_dir.path, supervisor)
+        supervisor.check()
+
+        latex_environments = uses_latex_environments(markdown, metadata)
+        if output_format == "pdf":
+            pdf = _render_pdf_with_server(markdown, metadata, work_dir, draft, latex_environments, supervisor)
+            if pdf is not None:
+                work_dir.check()
+                return pdf if draft else util_pdf.postprocess(pdf)
+
+        parallel = output_format == "pdf" and not draft and renders_in_parallel(metadata)
+        command = determine_pandoc_arguments(
+            metadata,
+            output_format,
+            draft=draft,
+            latex_environments=latex_environments,
+            emit_latex=parallel,
+        )
+        if parallel:
+            # pandoc downloads remote images itself only when it runs LaTeX
+            command += ["--extract-media", str(work_dir.path / "media")]
+        # pandoc runs LaTeX in a temporary directory of its own
+        env = {**os.environ, "TMPDIR": str(work_dir.path)}
+        output = supervisor.run(command, input=markdown.encode(), env=env).stdout
+        if draft and output_format == "pdf":
+            # pandoc emitted LaTeX; a single pass is enough to check the layout
+            output = latex.run_latex(
+                output, passes=1, work_dir=work_dir.path / "latex", supervisor=supervisor
+            )
+        elif parallel:
+            latex_dir = work_dir.path / "latex"
+            output = latex.convert_svg_images(output, latex_dir, supervisor)
+            output = latex.run_latex_parallel(output, work_dir=latex_dir, supervisor=supervisor)
+        work_dir.check()
+        if output_format == "pdf" and not draft:
+            output = util_pdf.postprocess(output)
+        return output
@@ -0,0 +1,114 @@
+--[[
+Wraps divs in LaTeX environments, as configured by the
+`pandoc-latex-environment` metadata field, e.g.
+
+  pandoc-latex-environment:
+    info-box: [info]
+
+A div is wrapped in the first environment (in key order) whose classes it
+carries.  This is a port of the pandoc-latex-environment Python filter
+(https://github.com/chdemko/pandoc-latex-environment), which produces the
+same output, but runs inside pandoc.
+]]
+
+local environments = {}
+local names = {}
+
+local function is_latex()
+  return FORMAT == 'latex' or FORMAT == 'beamer'
+end
+
+local function is_text_block(block)
+  return block ~= nil and (block.t == 'Para' or block.t == 'Plain')
+end
+
+local function Meta(meta)
+  local mapping = meta['pandoc-latex-environment']
+  if pandoc.utils.type(mapping) ~= 'table' then
+    return nil
+  end
+  for name, definition in pairs(mapping) do
+    if pandoc.utils.type(definition) == 'List' then
+      local classes = {}
+      for _, class in ipairs(definition) do
+        classes[#classes + 1] = pandoc.utils.stringify(class)
+      end
+      environments[name] = classes
+      names[#names + 1] = name
+    end
+  end
+  table.sort(names)
+  return nil
+end
+
+local function has_classes(div, classes)
+  for _, class in ipairs(classes) do
+    if not div.classes:includes(class) then
+      return false
+    end
+  end
+  return true
+end
+
+local function latex_title(div)
+  local title = div.attributes.title
+  if title == nil then
+    return ''
+  end
+  local escaped = title:gsub('[{}%%]', function(c) return '\\' .. c end)
+  local converted = pandoc.write(pandoc.read(escaped, 'markdown'), 'latex')
+  return '{' .. converted:gsub('\n+$', '') .. '}'
+end
+
+local function wrap(div, environment, title, identifier)
+  local label = identifier ~= '' and ('\n\\label{' .. identifier .. '}') or ''
+  local begin_env = '\\begin{' .. environment .. '}' .. title .. label
+  local end_env = '\\end{' .. environment .. '}'
+
+  if #div.content == 0 then
+    return div
+  end
+
+  local first = div.content[1]
+  while first ~= nil and first.t == 'Div' do
+    first = first.content[1]
+  end
+  local last = div.content[#div.content]
+  while last ~= nil and last.t == 'Div' do
+    last = last.content[#last.content]
+  end
+
+  if is_text_block(first) then
+    first.content:insert(1, pandoc.RawInline('tex', begin_env .. '\n'))
+    if is_text_block(last) then
+      last.content:insert(pandoc.RawInline('tex', '\n' .. end_env))
+      return div
+    end
+    return { div, pandoc.RawBlock('tex', end_env) }
+  end
+  if is_text_block(last) then
+    last.content:insert(pandoc.RawInline('tex', '\n' .. end_env))
+    return { pandoc.RawBlock('tex', begin_env), div }
+  end
+  return { pandoc.RawBlock('tex', begin_env), div, pandoc.RawBlock('tex', end_env) }
+end
+
+local function Div(div)
+  if not is_latex() then
+    return nil
+  end
+  for _, name in ipairs(names) do
+    if has_classes(div, environments[name]) then
+      local title = latex_title(div)
+      local identifier = div.identifier
+      div.identifier = ''
+      return wrap(div, name, title, identifier)
+    end
+  end
+  return nil
+end
+
+return {
+  { Meta = Meta },
+  { Div = Div },
+}
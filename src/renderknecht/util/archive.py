@@ -0,0 +1,85 @@
+import io
+import tarfile
+import time
+import zipfile
+from collections.abc import Buffer, Iterable, Iterator
+from pathlib import Path
+
+ArchiveMember = tuple[str, bytes | Path]
+
+FORMATS = {
+    "tar": "application/x-tar",
+    "tgz": "application/gzip",
+    "zip": "application/zip",
+}
+
+
+class ChunkPipe(io.RawIOBase):
+    """Unseekable file collecting what an archive writer writes, to be sent chunk by chunk.
+
+    zipfile and tarfile (in stream mode) both write to unseekable files, so
+    an archive can be streamed to a client while it is being built.
+    """
+
+    def __init__(self) -> None:
+        self._chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b: Buffer, /) -> int:
+        data = bytes(b)
+        self._chunks.append(data)
+        return len(data)
+
+    def drain(self) -> bytes:
+        """Return and forget everything written since the last call."""
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _compression(name: str) -> int:
+    # images and PDFs are compressed already
+    if name.endswith((".pdf", ".png", ".jpg", ".jpeg", ".gif", ".webp")):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def stream_zip(members: Iterable[ArchiveMember]) -> Iterator[bytes]:
+    """Stream a ZIP archive of ``members``, given as (name, content or file) pairs."""
+    pipe = ChunkPipe()
+    with zipfile.ZipFile(pipe, "w") as archive:
+        for name, content in members:
+            if isinstance(content, Path):
+                archive.write(content, name, compress_type=_compression(name))
+            else:
+                archive.writestr(name, content, compress_type=_compression(name))
+            yield pipe.drain()
+    yield pipe.drain()
+
+
+def stream_tar(members: Iterable[ArchiveMember], compress: bool = False) -> Iterator[bytes]:
+    """Stream a tar archive (gzip-compressed with ``compress``) of ``members``."""
+    pipe = ChunkPipe()
+    with (
+        tarfile.open(fileobj=pipe, mode="w|gz") if compress else tarfile.open(fileobj=pipe, mode="w|")
+    ) as archive:
+        for name, content in members:
+            if isinstance(content, Path):
+                archive.add(content, name, recursive=False)
+            else:
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                info.mtime = int(time.time())
+                info.mode = 0o644
+                archive.addfile(info, io.BytesIO(content))
+            yield pipe.drain()
+    yield pipe.drain()
+
+
+def stream_archive(members: Iterable[ArchiveMember], archive_format: str) -> Iterator[bytes]:
+    """Stream an archive in one of :data:`FORMATS`."""
+    if archive_format == "zip":
+        return stream_zip(members)
+    return stream_tar(members, compress=archive_format == "tgz")
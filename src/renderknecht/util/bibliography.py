@@ -0,0 +1,127 @@
+import copy
+import json
+import logging
+import os
+import re
+import subprocess
+import threading
+from pathlib import Path
+
+import yaml
+from yaml import SafeLoader
+
+# see: https://pandoc.org/MANUAL.html#citation-syntax
+_CITATION_PATTERN = re.compile(r"(?<![\w@])@(?:\{([^}]+)\}|(\w(?:[\w:.#$%&\-+?<>~/]*\w)?))")
+
+_BIBTEX_FORMATS = {".bib": "biblatex", ".bibtex": "bibtex"}
+
+CSLEntries = list[dict]
+
+_CACHE: dict[Path, tuple[tuple[int, int], CSLEntries]] = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def cited_keys(text: str) -> set[str]:
+    """Return the citation keys used in ``text``.
+
+    The scan is conservative: anything that looks like a citation counts,
+    including e-mail-like strings preceded by whitespace and code.
+    """
+    return {match.group(1) or match.group(2) for match in _CITATION_PATTERN.finditer(text)}
+
+
+def _resolve(path: str) -> Path:
+    candidate = Path(path)
+    if not candidate.is_absolute() and (work_dir := os.environ.get("WORK_DIR")):
+        candidate = Path(work_dir) / candidate
+    return candidate
+
+
+def _parse(path: Path) -> CSLEntries:
+    suffix = path.suffix.lower()
+    if suffix == ".json":
+        return json.loads(path.read_text(encoding="utf-8"))
+    if suffix in (".yaml", ".yml"):
+        data = yaml.load(path.read_text(encoding="utf-8"), Loader=SafeLoader)
+        return data.get("references", []) if isinstance(data, dict) else data
+    if suffix in _BIBTEX_FORMATS:
+        process = subprocess.run(
+            ["pandoc", "-f", _BIBTEX_FORMATS[suffix], "-t", "csljson", str(path)],  # noqa: S607
+            capture_output=True,
+            check=True,
+        )
+        return json.loads(process.stdout)
+    raise ValueError(f"Unsupported bibliography format: {path}")
+
+
+def load_bibliography(path: Path) -> CSLEntries:
+    """Load a bibliography file as CSL entries.
+
+    CSL-JSON and CSL-YAML are read directly, BibTeX/BibLaTeX is converted by
+    pandoc.  Parsed files are cached until their modification time or size
+    changes.
+
+    :raises ValueError: for unsupported formats.
+    :raises OSError: if the file cannot be read.
+    :raises subprocess.CalledProcessError: if pandoc cannot convert the file.
+    """
+    stat = path.stat()
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _CACHE_LOCK:
+        cached = _CACHE.get(path)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    entries = _parse(path)
+    with _CACHE_LOCK:
+        _CACHE[path] = (signature, entries)
+    return entries
+
+
+def filter_references(yaml_metadata: dict, markdown: str, directory: Path | None = None) -> dict:
+    """Reduce the bibliography of a document to the entries it cites.
+
+    Inline ``references`` are filtered in place.  When ``directory`` is given,
+    the cited entries of external ``bibliography`` files are written to a
+    CSL-JSON file there, which replaces the original files.  Files that cannot
+    be loaded are passed on to pandoc unchanged.  Nothing is filtered when the
+    document uses ``nocite: @*``.
+
+    :param yaml_metadata: Metadata of the document.
+    :param markdown: The document, used to find the cited keys.
+    :param directory: Scratch directory for the filtered bibliography.
+    :returns: The metadata with reduced bibliographies.
+    """
+    if not yaml_metadata or ("references" not in yaml_metadata and "bibliography" not in yaml_metadata):
+        return yaml_metadata
+
+    nocite = str(yaml_metadata.get("nocite", ""))
+    if "@*" in nocite:
+        return yaml_metadata
+    keys = cited_keys(markdown) | cited_keys(nocite)
+
+    result = copy.copy(yaml_metadata)
+    if isinstance(references := result.get("references"), list):
+        result["references"] = [
+            reference
+            for reference in references
+            if not isinstance(reference, dict) or reference.get("id") in keys
+        ]
+
+    if directory is None or not (bibliography := result.get("bibliography")):
+        return result
+
+    files = [bibliography] if isinstance(bibliography, str) else list(bibliography)
+    remaining: list[str] = []
+    entries: CSLEntries = []
+    for file in files:
+        try:
+            entries += [entry for entry in load_bibliography(_resolve(file)) if entry.get("id") in keys]
+        except (OSError, ValueError, subprocess.CalledProcessError) as e:
+            logging.warning("Not filtering bibliography %s: %s", file, e)
+            remaining.append(file)
+
+    filtered = directory / "bibliography.json"
+    filtered.write_text(json.dumps(entries), encoding="utf-8")
+    result["bibliography"] = [str(filtered), *remaining]
+    return result
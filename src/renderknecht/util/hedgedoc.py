@@ -0,0 +1,73 @@
+import datetime
+import os
+
+import httpx
+
+_DEFAULT_URL = "http://app:3000"
+
+
+def base_url() -> str:
+    """Return the base URL of HedgeDoc, from HEDGEDOC_URL (default: the compose service)."""
+    return os.environ.get("HEDGEDOC_URL", _DEFAULT_URL).rstrip("/")
+
+
+def parse_time(value: str | int | float) -> float:
+    """Convert a HedgeDoc timestamp (ISO 8601 string or milliseconds) to seconds since the epoch."""
+    if isinstance(value, int | float):
+        return value / 1000
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+class HedgeDocClient:
+    """Client of the HedgeDoc 1.x HTTP API.
+
+    :param url: Base URL of HedgeDoc; defaults to :func:`base_url`.
+    :param cookie: Session cookie (``connect.sid``) of a HedgeDoc user, needed
+        for the history; defaults to HEDGEDOC_COOKIE.
+    """
+
+    def __init__(self, url: str | None = None, cookie: str | None = None) -> None:
+        cookie = cookie if cookie is not None else os.environ.get("HEDGEDOC_COOKIE", "")
+        self._client = httpx.Client(
+            base_url=url or base_url(),
+            cookies={"connect.sid": cookie} if cookie else None,
+            timeout=30.0,
+        )
+        self.authenticated = bool(cookie)
+
+    def download(self, pad_id: str) -> str:
+        """Return the Markdown of a pad.
+
+        :raises httpx.HTTPStatusError: if HedgeDoc refuses the request.
+        """
+        response = self._client.get(f"/{pad_id}/download")
+        response.raise_for_status()
+        return response.text
+
+    def info(self, pad_id: str) -> dict:
+        """Return the metadata of a pad (title, description, createtime, updatetime, ...)."""
+        response = self._client.get(f"/{pad_id}/info")
+        response.raise_for_status()
+        return response.json()
+
+    def upload(self, name: str) -> bytes:
+        """Return an uploaded file, e.g. an image."""
+        response = self._client.get(f"/uploads/{name}")
+        response.raise_for_status()
+        return response.content
+
+    def history(self) -> list[dict]:
+        """Return the history of the authenticated user, most recently visited pad first.
+
+        :returns: The history entries (``id``, ``text``, ``time``, ``tags``, ``pinned``);
+            empty without a session cookie.
+        """
+        if not self.authenticated:
+            return []
+        response = self._client.get("/history")
+        response.raise_for_status()
+        entries = response.json().get("history", [])
+        return sorted(entries, key=lambda entry: parse_time(entry.get("time", 0)), reverse=True)
+
+    def close(self) -> None:
+        self._client.close()
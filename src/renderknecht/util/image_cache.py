@@ -0,0 +1,353 @@
+"""Local mirror of remote images referenced by documents.
+
+pandoc downloads remote images one after the other on every render, and a
+render fails (or loses its images) whenever one of the hosts is slow or
+down.  The mirror fetches all remote images of a document at once with a
+pooled client and keeps them in a content-addressed cache, revalidating
+them with their ETag/Last-Modified once Cache-Control or Expires says they
+are stale.
+"""
+
+import concurrent.futures
+import email.utils
+import fnmatch
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections.abc import Iterable, Sequence
+from pathlib import Path
+
+import httpx
+
+from . import metrics
+from .render_cache import RenderCache
+
+_DEFAULT_SIZE = 256 * 1024 * 1024
+_DEFAULT_IMAGE_SIZE = 16 * 1024 * 1024
+# how long responses without Cache-Control or Expires are fresh
+_DEFAULT_FRESHNESS = 3600.0
+_CONCURRENCY = 8
+
+_MARKDOWN_IMAGE_PATTERN = re.compile(r"!(\[[^\]]*\]\(\s*<?)(https?://[^\s)>]+)")
+_HTML_IMAGE_PATTERN = re.compile(r"<img\b[^>]*>", re.IGNORECASE)
+_SRC_PATTERN = re.compile(r"(\bsrc\s*=\s*[\"']?)(https?://[^\s\"'>]+)", re.IGNORECASE)
+_ALT_PATTERN = re.compile(r"\balt\s*=\s*(?:\"([^\"]*)\"|'([^']*)')", re.IGNORECASE)
+
+_REQUESTS = metrics.REGISTRY.counter(
+    "renderknecht_image_cache_requests", "Remote images looked up in the image cache, by result"
+)
+
+
+class ImageCacheError(Exception):
+    """Raised when a remote image cannot be mirrored."""
+
+
+def _cache_control(value: str) -> dict[str, str]:
+    directives = {}
+    for directive in value.split(","):
+        name, _, argument = directive.strip().partition("=")
+        directives[name.lower()] = argument.strip('"')
+    return directives
+
+
+def expires(headers: httpx.Headers, now: float) -> float:
+    """Return when a response stops being fresh, from its Cache-Control or Expires header.
+
+    ``no-cache`` and ``no-store`` responses are stale right away, so they are
+    fetched again for the next render.
+    """
+    directives = _cache_control(headers.get("Cache-Control", ""))
+    if "no-cache" in directives or "no-store" in directives:
+        return now
+    if "max-age" in directives:
+        try:
+            return now + int(directives["max-age"]) - int(headers.get("Age", 0))
+        except ValueError:
+            return now
+    if "Expires" in headers:
+        try:
+            return email.utils.parsedate_to_datetime(headers["Expires"]).timestamp()
+        except (TypeError, ValueError):
+            return now
+    return now + _DEFAULT_FRESHNESS
+
+
+def _extension(content_type: str, url: str) -> str:
+    media_type = content_type.partition(";")[0].strip().lower()
+    if media_type.startswith("image/") or media_type == "application/pdf":
+        return mimetypes.guess_extension(media_type) or ""
+    guessed, _ = mimetypes.guess_type(httpx.URL(url).path)
+    if media_type in ("", "application/octet-stream") and guessed and guessed.startswith("image/"):
+        return Path(httpx.URL(url).path).suffix.lower()
+    raise ImageCacheError(f"not an image ({media_type})")
+
+
+class ImageCache:
+    """Content-addressed cache of remote images in a directory, shared by all processes using it.
+
+    Images are stored once per content under ``objects/``, named by their
+    SHA-256 and the extension of their media type, which LaTeX needs.  For
+    every URL, ``urls/`` records the image it returned and how to revalidate
+    it.
+
+    :param directory: The cache directory.
+    :param max_size: Size limit of the cached images in bytes.
+    :param max_image_size: Size limit of a single image in bytes.
+    :param allow: Host name patterns (``*.example.org``) images may be fetched
+        from; empty allows all hosts.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        max_size: int = _DEFAULT_SIZE,
+        max_image_size: int = _DEFAULT_IMAGE_SIZE,
+        allow: Sequence[str] = (),
+    ) -> None:
+        self.directory = directory
+        self.max_image_size = max_image_size
+        self.allow = tuple(allow)
+        self.objects = RenderCache(directory / "objects", max_size)
+        self._urls = directory / "urls"
+        self._urls.mkdir(parents=True, exist_ok=True)
+        # redirects are checked against the allow list as well
+        self._client = httpx.Client(
+            follow_redirects=True,
+            timeout=30.0,
+            limits=httpx.Limits(max_connections=_CONCURRENCY, max_keepalive_connections=_CONCURRENCY),
+            event_hooks={"request": [self._check_request]},
+            headers={"User-Agent": "renderknecht"},
+        )
+
+    def allowed(self, url: str) -> bool:
+        """Tell whether images may be fetched from the host of ``url``."""
+        host = httpx.URL(url).host
+        return not self.allow or any(fnmatch.fnmatch(host, pattern) for pattern in self.allow)
+
+    def _check_request(self, request: httpx.Request) -> None:
+        if not self.allowed(str(request.url)):
+            raise ImageCacheError(f"host {request.url.host} is not allowed")
+
+    def _entry_path(self, url: str) -> Path:
+        return self._urls / f"{hashlib.sha256(url.encode()).hexdigest()}.json"
+
+    def _entry(self, url: str) -> dict | None:
+        try:
+            entry = json.loads(self._entry_path(url).read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+        if entry["object"] not in self.objects:
+            # the image was evicted
+            self._entry_path(url).unlink(missing_ok=True)
+            return None
+        return entry
+
+    def _store_entry(self, url: str, entry: dict) -> None:
+        with tempfile.NamedTemporaryFile("w", dir=self._urls, prefix=".", delete=False) as f:
+            json.dump(entry, f)
+        Path(f.name).replace(self._entry_path(url))
+
+    def _object(self, entry: dict) -> Path:
+        path = self.objects.path(entry["object"])
+        if path is None:
+            raise ImageCacheError("the image was evicted")
+        return path
+
+    def _read(self, response: httpx.Response) -> bytes:
+        length = response.headers.get("Content-Length", "")
+        if length.isdigit() and int(length) > self.max_image_size:
+            raise ImageCacheError(f"larger than {self.max_image_size} bytes")
+        data = bytearray()
+        for chunk in response.iter_bytes():
+            data += chunk
+            if len(data) > self.max_image_size:
+                raise ImageCacheError(f"larger than {self.max_image_size} bytes")
+        return bytes(data)
+
+    def fetch(self, url: str) -> Path:
+        """Return the cached image of ``url``, fetching or revalidating it first if needed.
+
+        If revalidating a stale image fails, the stale image is returned.
+
+        :raises ImageCacheError: if the image cannot be fetched, is not allowed or too large.
+        """
+        if not self.allowed(url):
+            raise ImageCacheError(f"host {httpx.URL(url).host} is not allowed")
+        entry = self._entry(url)
+        now = time.time()
+        if entry is not None and entry["expires"] > now:
+            _REQUESTS.inc(result="hit")
+            return self._object(entry)
+
+        headers = {}
+        if entry is not None and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry is not None and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            with self._client.stream("GET", url, headers=headers) as response:
+                if response.status_code == 304 and entry is not None:
+                    entry["expires"] = expires(response.headers, now)
+                    self._store_entry(url, entry)
+                    _REQUESTS.inc(result="revalidated")
+                    return self._object(entry)
+                response.raise_for_status()
+                extension = _extension(response.headers.get("Content-Type", ""), url)
+                data = self._read(response)
+        except (httpx.HTTPError, ImageCacheError) as e:
+            if entry is None:
+                raise ImageCacheError(str(e)) from e
+            logging.warning("Cannot revalidate image %s, using the cached one: %s", url, e)
+            _REQUESTS.inc(result="stale")
+            return self._object(entry)
+
+        name = hashlib.sha256(data).hexdigest() + extension
+        if name not in self.objects:
+            self.objects.put(name, data)
+        entry = {
+            "url": url,
+            "object": name,
+            "expires": expires(response.headers, now),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        self._store_entry(url, entry)
+        _REQUESTS.inc(result="miss")
+        return self._object(entry)
+
+    def _try_fetch(self, url: str) -> Path | None:
+        try:
+            return self.fetch(url)
+        except ImageCacheError as e:
+            logging.warning("Cannot mirror image %s: %s", url, e)
+            _REQUESTS.inc(result="failed")
+            return None
+
+    def fetch_all(self, urls: Iterable[str]) -> dict[str, Path]:
+        """Fetch images concurrently.
+
+        :returns: The cached image of every URL that could be mirrored.
+        """
+        unique = list(dict.fromkeys(urls))
+        if not unique:
+            return {}
+        with concurrent.futures.ThreadPoolExecutor(min(_CONCURRENCY, len(unique))) as executor:
+            paths = executor.map(self._try_fetch, unique)
+        return {url: path for url, path in zip(unique, paths, strict=True) if path is not None}
+
+    def close(self) -> None:
+        self._client.close()
+
+
+def remote_images(markdown: str) -> list[str]:
+    """Return the URLs of the remote images in Markdown image links and ``<img>`` tags."""
+    urls = [match.group(2) for match in _MARKDOWN_IMAGE_PATTERN.finditer(markdown)]
+    for tag in _HTML_IMAGE_PATTERN.finditer(markdown):
+        if src := _SRC_PATTERN.search(tag.group(0)):
+            urls.append(src.group(2))
+    return urls
+
+
+def _link_into(path: Path, directory: Path) -> Path:
+    target = directory / path.name
+    if not target.exists():
+        try:
+            os.link(path, target)
+        except OSError:
+            if not path.exists():
+                raise
+            # e.g. the directory is on another file system than the cache
+            shutil.copyfile(path, target)
+    return target
+
+
+def mirror_images(markdown: str, cache: ImageCache, directory: Path) -> str:
+    """Rewrite remote image URLs to copies of their files in the image cache.
+
+    The images are hard-linked (or copied) into ``directory``, the scratch
+    directory of the render, so that evicting them from the cache while the
+    render runs does not take them away from it.  Images that cannot be
+    mirrored (not allowed, too large, unreachable) become plain links, so
+    pandoc does not try to download them either.
+
+    :param markdown: Markdown text to process.
+    :param cache: The image cache.
+    :param directory: Directory to link the images into.
+    :returns: Markdown without remote images.
+    """
+    urls = remote_images(markdown)
+    if not urls:
+        return markdown
+    paths = {}
+    for url, path in cache.fetch_all(urls).items():
+        try:
+            paths[url] = _link_into(path, directory)
+        except OSError as e:
+            # evicted since it was fetched
+            logging.warning("Cannot mirror image %s: %s", url, e)
+            _REQUESTS.inc(result="failed")
+
+    def markdown_image(match: re.Match) -> str:
+        url = match.group(2)
+        if url in paths:
+            return f"!{match.group(1)}{paths[url]}"
+        return f"{match.group(1)}{url}"
+
+    def html_image(match: re.Match) -> str:
+        tag = match.group(0)
+        src = _SRC_PATTERN.search(tag)
+        if src is None:
+            return tag
+        url = src.group(2)
+        if url in paths:
+            return f"{tag[: src.start(2)]}{paths[url]}{tag[src.end(2) :]}"
+        alt = _ALT_PATTERN.search(tag)
+        text = (alt.group(1) or alt.group(2)) if alt else ""
+        return f'<a href="{url}">{text or url}</a>'
+
+    markdown = _MARKDOWN_IMAGE_PATTERN.sub(markdown_image, markdown)
+    return _HTML_IMAGE_PATTERN.sub(html_image, markdown)
+
+
+_SHARED: ImageCache | None = None
+_SHARED_LOCK = threading.Lock()
+
+
+def shared_cache() -> ImageCache | None:
+    """Return the process-wide image cache, or None when remote images are not mirrored.
+
+    The cache is enabled by RENDERKNECHT_IMAGE_CACHE, the cache directory.
+    RENDERKNECHT_IMAGE_CACHE_SIZE limits its size in bytes (default: 256 MiB),
+    RENDERKNECHT_IMAGE_MAX_SIZE the size of a single image (default: 16 MiB)
+    and RENDERKNECHT_IMAGE_ALLOW, a comma-separated list of host name
+    patterns, the hosts images are fetched from (default: all).
+    """
+    global _SHARED
+    directory = os.environ.get("RENDERKNECHT_IMAGE_CACHE", "")
+    if not directory:
+        return None
+    max_size = int(os.environ.get("RENDERKNECHT_IMAGE_CACHE_SIZE", _DEFAULT_SIZE))
+    max_image_size = int(os.environ.get("RENDERKNECHT_IMAGE_MAX_SIZE", _DEFAULT_IMAGE_SIZE))
+    allow = tuple(
+        pattern.strip()
+        for pattern in os.environ.get("RENDERKNECHT_IMAGE_ALLOW", "").split(",")
+        if pattern.strip()
+    )
+    with _SHARED_LOCK:
+        if _SHARED is None or (
+            _SHARED.directory,
+            _SHARED.objects.max_size,
+            _SHARED.max_image_size,
+            _SHARED.allow,
+        ) != (Path(directory), max_size, max_image_size, allow):
+            if _SHARED is not None:
+                _SHARED.close()
+            _SHARED = ImageCache(Path(directory), max_size, max_image_size, allow)
+        return _SHARED
@@ -0,0 +1,342 @@
+import concurrent.futures
+import dataclasses
+import os
+import re
+import shutil
+import tempfile
+from pathlib import Path
+
+from . import pdf
+from .process import Supervisor
+
+_JOB_NAME = "document"
+
+_RERUN_PATTERN = re.compile(rb"Rerun to get|Label\(s\) may have changed|Please \(?re\)?run")
+
+
+def _command(engine: str) -> tuple[list[str], dict[str, str]]:
+    command = [engine, "-interaction=nonstopmode", "-halt-on-error", f"{_JOB_NAME}.tex"]
+    env = dict(os.environ)
+    if resource_dir := os.environ.get("WORK_DIR"):
+        # the trailing separator appends the default search path
+        env["TEXINPUTS"] = f".{os.pathsep}{resource_dir}{os.pathsep}"
+    return command, env
+
+
+def run_latex(
+    tex: bytes,
+    passes: int = 1,
+    engine: str = "pdflatex",
+    work_dir: Path | None = None,
+    supervisor: Supervisor | None = None,
+) -> bytes:
+    """Compile a LaTeX document to PDF.
+
+    The document is compiled in ``work_dir``, which is created if needed and
+    left to the caller to remove.  Without ``work_dir``, a private temporary
+    directory is used and removed afterwards.  LaTeX is rerun, up to
+    ``passes`` times in total, while it reports unresolved references or a
+    changed TOC; with a single pass, both may be incomplete.  Relative image
+    paths are looked up in WORK_DIR, like pandoc's ``--resource-path``.
+
+    :param tex: The complete LaTeX document.
+    :param passes: Maximum number of LaTeX runs.
+    :param engine: LaTeX engine to run.
+    :param work_dir: Directory for the LaTeX sources and outputs.
+    :param supervisor: Supervisor of the render the LaTeX runs belong to.
+    :returns: The resulting PDF.
+    :raises subprocess.CalledProcessError: if a LaTeX run fails.
+    """
+    if work_dir is None:
+        with tempfile.TemporaryDirectory(prefix="renderknecht-latex-") as tmp_dir:
+            return run_latex(tex, passes, engine, Path(tmp_dir), supervisor)
+
+    supervisor = supervisor or Supervisor()
+    command, env = _command(engine)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    (work_dir / f"{_JOB_NAME}.tex").write_bytes(tex)
+    toc = work_dir / f"{_JOB_NAME}.toc"
+    for _ in range(passes):
+        previous_toc = toc.read_bytes() if toc.exists() else None
+        process = supervisor.run(command, cwd=work_dir, env=env)
+        toc_changed = toc.exists() and toc.read_bytes() != previous_toc
+        if not toc_changed and not _RERUN_PATTERN.search(process.stdout):
+            break
+    return (work_dir / f"{_JOB_NAME}.pdf").read_bytes()
+
+
+_INCLUDESVG_PATTERN = re.compile(rb"\\includesvg(\[[^\]]*\])?\{([^}]*)\}")
+
+
+def convert_svg_images(tex: bytes, work_dir: Path, supervisor: Supervisor | None = None) -> bytes:
+    """Convert SVG images of a LaTeX document to PDF, as pandoc does before running LaTeX.
+
+    Every ``\\includesvg`` is replaced by an ``\\includegraphics`` of a PDF
+    converted with ``rsvg-convert`` into ``work_dir``.
+
+    :raises subprocess.CalledProcessError: if an image cannot be converted.
+    """
+    supervisor = supervisor or Supervisor()
+    converted: dict[bytes, Path] = {}
+
+    def replace(match: re.Match) -> bytes:
+        options, source = match.group(1) or b"", match.group(2)
+        if source not in converted:
+            path = Path(source.decode())
+            if not path.is_absolute() and (resource_dir := os.environ.get("WORK_DIR")):
+                path = Path(resource_dir) / path
+            target = work_dir / f"image-{len(converted)}.pdf"
+            supervisor.run(["rsvg-convert", "-f", "pdf", "-o", str(target), str(path)])
+            converted[source] = target
+        return b"\\includegraphics" + options + b"{" + str(converted[source]).encode() + b"}"
+
+    work_dir.mkdir(parents=True, exist_ok=True)
+    return _INCLUDESVG_PATTERN.sub(replace, tex)
+
+
+# top-level headings, as pandoc writes them: \chapter in book classes, \section otherwise
+_HEADING_PATTERNS = {
+    command: re.compile(rb"^(?:\\hypertarget\{[^}]*\}\{%\n)?\\" + command + rb"\*?[\[{]", re.MULTILINE)
+    for command in (b"chapter", b"section")
+}
+_BODY_PAGE_MACRO = b"renderknechtbodypage"
+# the page number the body starts on, written to the main .aux file right after the front matter
+_BODY_PAGE_MARKER = (
+    b"\\clearpage\\immediate\\write\\csname @auxout\\endcsname"
+    b"{\\string\\gdef\\string\\" + _BODY_PAGE_MACRO + b"{\\arabic{page}}}\n"
+)
+_BODY_PAGE_PATTERN = re.compile(rb"\\gdef\\" + _BODY_PAGE_MACRO + rb"\{(\d+)\}")
+_PAGES_PATTERN = re.compile(rb"Output written on .*?\((\d+) pages?")
+# copied into the directory of every chunk
+_AUXILIARY_SUFFIXES = (".tex", ".aux", ".toc", ".lof", ".lot", ".out")
+
+
+@dataclasses.dataclass(frozen=True)
+class SplitDocument:
+    """A LaTeX document split into chunks at its top-level headings.
+
+    :param preamble: Everything before ``\\begin{document}``.
+    :param front: The front matter: title page, TOC and whatever precedes the first heading.
+    :param chunks: The body, in chunks of whole top-level sections.
+    """
+
+    preamble: bytes
+    front: bytes
+    chunks: list[bytes]
+
+    @property
+    def names(self) -> list[str]:
+        return [f"chunk-{number}" for number in range(1, len(self.chunks) + 1)]
+
+    def document(self, include_only: list[str] | None = None) -> bytes:
+        """Return the main document, which ``\\include``\\ s the chunks.
+
+        :param include_only: Chunks to typeset; the others only contribute their
+            auxiliary files (labels, TOC entries, counters).  Defaults to all.
+        """
+        only = (
+            b"\\includeonly{" + ",".join(include_only).encode() + b"}\n" if include_only is not None else b""
+        )
+        includes = b"".join(b"\\include{" + name.encode() + b"}\n" for name in self.names)
+        return (
+            self.preamble
+            + only
+            + b"\\begin{document}"
+            + self.front
+            + _BODY_PAGE_MARKER
+            + includes
+            + b"\\end{document}\n"
+        )
+
+
+def split_document(tex: bytes, max_chunks: int) -> SplitDocument | None:
+    """Split a LaTeX document into at most ``max_chunks`` chunks of about equal size.
+
+    Chunks hold whole top-level sections and are typeset with ``\\include``,
+    so each chunk starts on a new page; within a chunk, sections follow each
+    other as they do in the whole document.  A chunk boundary adds a page break
+    where the document has none, unless its top-level sections start new pages anyway.
+
+    :returns: The split document, or None if it has fewer than two top-level sections.
+    """
+    begin, end = tex.find(b"\\begin{document}"), tex.rfind(b"\\end{document}")
+    if begin < 0 or end < 0 or max_chunks < 2:
+        return None
+    body = tex[begin + len(b"\\begin{document}") : end]
+    command = b"chapter" if _HEADING_PATTERNS[b"chapter"].search(body) else b"section"
+    starts = [match.start() for match in _HEADING_PATTERNS[command].finditer(body)]
+    if len(starts) < 2:
+        return None
+
+    sections = [body[start:stop] for start, stop in zip(starts, [*starts[1:], len(body)], strict=True)]
+    count = min(max_chunks, len(sections))
+    total = sum(len(section) for section in sections)
+    chunks: list[list[bytes]] = [[]]
+    done = 0
+    for section in sections:
+        if chunks[-1] and len(chunks) < count and done >= total * len(chunks) / count:
+            chunks.append([])
+        chunks[-1].append(section)
+        done += len(section)
+    return SplitDocument(
+        preamble=tex[:begin],
+        front=body[: starts[0]],
+        chunks=[b"".join(chunk) for chunk in chunks],
+    )
+
+
+def _brace_groups(text: bytes, position: int, count: int) -> list[tuple[int, int]]:
+    """Return the spans of up to ``count`` consecutive brace groups starting at ``position``."""
+    groups = []
+    while len(groups) < count:
+        while position < len(text) and text[position : position + 1].isspace():
+            position += 1
+        if text[position : position + 1] != b"{":
+            break
+        start, depth = position, 0
+        while position < len(text):
+            char = text[position : position + 1]
+            if char == b"\\":
+                position += 2
+                continue
+            position += 1
+            if char == b"{":
+                depth += 1
+            elif char == b"}":
+                depth -= 1
+                if depth == 0:
+                    break
+        groups.append((start, position))
+    return groups
+
+
+def _shift_argument(text: bytes, pattern: re.Pattern, index: int, shift: int) -> bytes:
+    """Add ``shift`` to the ``index``-th brace group after each match of ``pattern``, if it is a number."""
+    output = bytearray()
+    position = 0
+    for match in pattern.finditer(text):
+        groups = _brace_groups(text, match.end(), index + 1)
+        if len(groups) <= index or groups[index][0] < position:
+            continue
+        start, stop = groups[index]
+        value = text[start + 1 : stop - 1]
+        if value.isdigit():
+            output += text[position : start + 1] + str(int(value) + shift).encode()
+            position = stop - 1
+    return bytes(output + text[position:])
+
+
+_PAGE_REFERENCES = (
+    # \setcounter{page}{n}, saved at the end of every chunk
+    (re.compile(rb"\\setcounter\{page\}"), 0),
+    # \newlabel{name}{{number}{page}...}
+    (re.compile(rb"\\newlabel\{[^{}]*\}\{"), 1),
+    # \contentsline {section}{title}{page}{anchor}
+    (re.compile(rb"\\contentsline\s*"), 2),
+)
+
+
+def shift_pages(text: bytes, shift: int) -> bytes:
+    """Shift the page numbers recorded in auxiliary LaTeX files (.aux, .toc) by ``shift``."""
+    for pattern, index in _PAGE_REFERENCES:
+        text = _shift_argument(text, pattern, index, shift)
+    return text
+
+
+def _body_page(work_dir: Path) -> int | None:
+    aux = work_dir / f"{_JOB_NAME}.aux"
+    match = _BODY_PAGE_PATTERN.search(aux.read_bytes()) if aux.exists() else None
+    return int(match.group(1)) if match else None
+
+
+def parallel_chunks() -> int:
+    """Return how many chunks a document is compiled in at most, from RENDERKNECHT_PARALLEL_CHUNKS (default: CPU count)."""
+    return int(os.environ.get("RENDERKNECHT_PARALLEL_CHUNKS", 0)) or os.cpu_count() or 1
+
+
+def run_latex_parallel(
+    tex: bytes,
+    max_chunks: int | None = None,
+    engine: str = "pdflatex",
+    work_dir: Path | None = None,
+    supervisor: Supervisor | None = None,
+) -> bytes:
+    """Compile a large LaTeX document to PDF in chunks, in parallel.
+
+    The document is split at its top-level headings (see
+    :func:`split_document`).  A shared first pass over the whole document
+    records labels, citations, TOC entries, bookmarks and the counters at
+    the end of every chunk.  The front matter is then typeset with the complete TOC, and if
+    that moves the start of the body, the recorded page numbers are shifted
+    accordingly.  Finally, every chunk is typeset in a process of its own,
+    with continuous page numbering, and the chunks are merged into one PDF
+    with a combined outline.
+
+    Documents with fewer than two top-level headings, or without pikepdf to
+    merge the chunks, are compiled by :func:`run_latex`.
+
+    :param tex: The complete LaTeX document.
+    :param max_chunks: Maximum number of chunks, and LaTeX processes run at once;
+        defaults to :func:`parallel_chunks`.
+    :returns: The resulting PDF.
+    :raises subprocess.CalledProcessError: if a LaTeX run fails.
+    """
+    if work_dir is None:
+        with tempfile.TemporaryDirectory(prefix="renderknecht-latex-") as tmp_dir:
+            return run_latex_parallel(tex, max_chunks, engine, Path(tmp_dir), supervisor)
+
+    split = split_document(tex, max_chunks or parallel_chunks())
+    if split is None or not pdf.available():
+        return run_latex(tex, passes=3, engine=engine, work_dir=work_dir, supervisor=supervisor)
+
+    supervisor = supervisor or Supervisor()
+    command, env = _command(engine)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    for name, chunk in zip(split.names, split.chunks, strict=True):
+        (work_dir / f"{name}.tex").write_bytes(chunk)
+
+    main = work_dir / f"{_JOB_NAME}.tex"
+    main.write_bytes(split.document())
+    supervisor.run(command, cwd=work_dir, env=env)
+    first_body_page = _body_page(work_dir)
+
+    # hyperref writes bookmarks of typeset headings only, so keep those of the whole document
+    outline = work_dir / f"{_JOB_NAME}.out"
+    bookmarks = outline.read_bytes() if outline.exists() else None
+    main.write_bytes(split.document(include_only=[]))
+    front = supervisor.run(command, cwd=work_dir, env=env)
+    if bookmarks is not None:
+        outline.write_bytes(bookmarks)
+    match = _PAGES_PATTERN.search(front.stdout)
+    front_pages = int(match.group(1)) if match else 0
+    body_page = _body_page(work_dir)
+    if first_body_page is not None and body_page is not None and body_page != first_body_page:
+        for path in [work_dir / f"{_JOB_NAME}.toc", *(work_dir / f"{name}.aux" for name in split.names)]:
+            if path.exists():
+                path.write_bytes(shift_pages(path.read_bytes(), body_page - first_body_page))
+
+    def run_chunk(name: str) -> bytes:
+        chunk_dir = work_dir / name
+        chunk_dir.mkdir(exist_ok=True)
+        for path in work_dir.iterdir():
+            if path.is_file() and path.suffix in _AUXILIARY_SUFFIXES:
+                shutil.copyfile(path, chunk_dir / path.name)
+        (chunk_dir / f"{_JOB_NAME}.tex").write_bytes(split.document(include_only=[name]))
+        supervisor.run(command, cwd=chunk_dir, env=env)
+        return (chunk_dir / f"{_JOB_NAME}.pdf").read_bytes()
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=len(split.names), thread_name_prefix="latex"
+    ) as executor:
+        futures = [executor.submit(run_chunk, name) for name in split.names]
+        try:
+            documents = [future.result() for future in futures]
+        except BaseException:
+            # stop the other chunks
+            supervisor.cancel()
+            raise
+
+    # every chunk's PDF starts with the front matter; the first one keeps it
+    page_counts = [pdf.page_count(document) for document in documents]
+    ranges = [range(0 if number == 0 else front_pages, count) for number, count in enumerate(page_counts)]
+    return pdf.merge(documents, ranges)
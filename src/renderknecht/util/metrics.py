@@ -0,0 +1,171 @@
+"""In-process metrics, exposed in the Prometheus text format at ``/metrics``."""
+
+import abc
+import threading
+from collections.abc import Callable
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _labels(labels: dict[str, str]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class Metric(abc.ABC):
+    """A metric with a value per combination of labels."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str) -> None:
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def samples(self) -> list[tuple[str, Labels, float]]:
+        """Return the samples of the metric as (name, labels, value)."""
+
+    def exposition(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        lines += [
+            f"{name}{_format_labels(labels)} {float(value)!r}" for name, labels, value in self.samples()
+        ]
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """A value that only goes up, e.g. the number of renders."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str) -> None:
+        super().__init__(name, description)
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(_labels(labels), 0)
+
+    def samples(self) -> list[tuple[str, Labels, float]]:
+        with self._lock:
+            return [(f"{self.name}_total", labels, value) for labels, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """A value that goes up and down, e.g. the length of a queue."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str) -> None:
+        super().__init__(name, description)
+        self._values: dict[Labels, float] = {}
+        self._functions: dict[Labels, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[_labels(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float], **labels: str) -> None:
+        """Take the value from ``function`` whenever the metrics are collected."""
+        with self._lock:
+            self._functions[_labels(labels)] = function
+
+    def value(self, **labels: str) -> float:
+        key = _labels(labels)
+        if key in self._functions:
+            return self._functions[key]()
+        return self._values.get(key, 0)
+
+    def samples(self) -> list[tuple[str, Labels, float]]:
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        values.update({labels: function() for labels, function in functions.items()})
+        return [(self.name, labels, value) for labels, value in values.items()]
+
+
+class Summary(Metric):
+    """Count and sum of observations, e.g. of render durations."""
+
+    kind = "summary"
+
+    def __init__(self, name: str, description: str) -> None:
+        super().__init__(name, description)
+        self._values: dict[Labels, tuple[int, float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _labels(labels)
+        with self._lock:
+            count, total = self._values.get(key, (0, 0.0))
+            self._values[key] = (count + 1, total + value)
+
+    def count(self, **labels: str) -> int:
+        return self._values.get(_labels(labels), (0, 0.0))[0]
+
+    def sum(self, **labels: str) -> float:
+        return self._values.get(_labels(labels), (0, 0.0))[1]
+
+    def samples(self) -> list[tuple[str, Labels, float]]:
+        with self._lock:
+            values = dict(self._values)
+        samples: list[tuple[str, Labels, float]] = []
+        for labels, (count, total) in values.items():
+            samples += [(f"{self.name}_count", labels, count), (f"{self.name}_sum", labels, total)]
+        return samples
+
+
+class Registry:
+    """The metrics of a process, by name."""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get[M: Metric](self, cls: type[M], name: str, description: str) -> M:
+        with self._lock:
+            metric = self._metrics.setdefault(name, cls(name, description))
+        if not isinstance(metric, cls):
+            raise ValueError(f"metric {name} is a {metric.kind}, not a {cls.kind}")
+        return metric
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self._get(Counter, name, description)
+
+    def gauge(self, name: str, description: str) -> Gauge:
+        return self._get(Gauge, name, description)
+
+    def summary(self, name: str, description: str) -> Summary:
+        return self._get(Summary, name, description)
+
+    def exposition(self) -> str:
+        """Return all metrics in the Prometheus text format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "".join(metric.exposition() for metric in metrics)
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
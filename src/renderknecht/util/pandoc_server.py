@@ -0,0 +1,148 @@
+import atexit
+import base64
+import logging
+import os
+import socket
+import subprocess
+import threading
+import time
+from collections.abc import Mapping
+from pathlib import Path
+
+import httpx
+
+_STARTUP_TIMEOUT = 10.0
+_REQUEST_TIMEOUT = 120.0
+
+
+class PandocServerError(RuntimeError):
+    """Raised when the pandoc server cannot handle a conversion."""
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class PandocServer:
+    """Client of a long-running ``pandoc server``.
+
+    Without ``url``, a local ``pandoc server`` listening on loopback is
+    started lazily and restarted when it dies.  Requests are sent through a
+    pooled HTTP client, so the Haskell runtime, templates and the CSL file are
+    loaded once instead of on every render.
+    """
+
+    def __init__(self, url: str | None = None) -> None:
+        self._url = url or ""
+        self._external = url is not None
+        self._process: subprocess.Popen | None = None
+        self._lock = threading.Lock()
+        self._client = httpx.Client(
+            timeout=_REQUEST_TIMEOUT,
+            limits=httpx.Limits(max_connections=16, max_keepalive_connections=16),
+        )
+
+    def _ensure_started(self) -> str:
+        with self._lock:
+            if self._external or (self._process is not None and self._process.poll() is None):
+                return self._url
+
+            port = _free_port()
+            command = ["pandoc", "server", "--port", str(port), "--timeout", str(int(_REQUEST_TIMEOUT))]
+            logging.info("Starting %s", " ".join(command))
+            self._process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self._url = f"http://127.0.0.1:{port}"
+
+            deadline = time.monotonic() + _STARTUP_TIMEOUT
+            while time.monotonic() < deadline:
+                if self._process.poll() is not None:
+                    break
+                try:
+                    self._client.get(f"{self._url}/version").raise_for_status()
+                    return self._url
+                except httpx.HTTPError:
+                    time.sleep(0.05)
+            self._terminate()
+            raise PandocServerError("pandoc server did not start")
+
+    def convert(
+        self,
+        text: str,
+        parameters: dict,
+        files: Mapping[str, Path] | None = None,
+        timeout: float | None = None,
+    ) -> str:
+        """Convert ``text`` with the given pandoc-server ``parameters``.
+
+        :param text: The document.
+        :param parameters: Conversion options as documented for pandoc-server.
+        :param files: Files pandoc may read (CSL, bibliographies, ...), by the name
+            pandoc knows them under.  The server is sandboxed, so they are sent
+            along with the request.
+        :param timeout: Seconds to wait for the conversion; defaults to two minutes.
+        :returns: The converted document.
+        :raises PandocServerError: if the server is unreachable or the conversion fails.
+        """
+        try:
+            payload = {
+                **parameters,
+                "text": text,
+                "files": {
+                    name: base64.b64encode(path.read_bytes()).decode() for name, path in (files or {}).items()
+                },
+            }
+            response = self._client.post(
+                self._ensure_started(),
+                json=payload,
+                headers={"Accept": "application/json"},
+                timeout=timeout if timeout is not None else _REQUEST_TIMEOUT,
+            )
+        except (OSError, httpx.HTTPError) as e:
+            raise PandocServerError(str(e)) from e
+        if response.status_code != 200:
+            raise PandocServerError(f"pandoc server returned {response.status_code}: {response.text}")
+        result = response.json()
+        if result.get("base64"):
+            return base64.b64decode(result["output"]).decode()
+        return result["output"]
+
+    def _terminate(self) -> None:
+        if self._process is None:
+            return
+        self._process.terminate()
+        try:
+            self._process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        self._process = None
+
+    def close(self) -> None:
+        """Stop the local pandoc server, if one was started."""
+        with self._lock:
+            self._terminate()
+        self._client.close()
+
+
+_SHARED: PandocServer | None = None
+_SHARED_LOCK = threading.Lock()
+
+
+def shared_server() -> PandocServer | None:
+    """Return the process-wide pandoc server, or None when subprocess mode is configured.
+
+    RENDERKNECHT_PANDOC_SERVER selects the backend: ``local`` starts a
+    ``pandoc server`` on loopback, a URL uses an existing one; when unset,
+    every render runs a pandoc process of its own.
+    """
+    global _SHARED
+    setting = os.environ.get("RENDERKNECHT_PANDOC_SERVER", "")
+    if not setting:
+        return None
+    with _SHARED_LOCK:
+        if _SHARED is None:
+            _SHARED = PandocServer(None if setting == "local" else setting.rstrip("/"))
+            atexit.register(_SHARED.close)
+        return _SHARED
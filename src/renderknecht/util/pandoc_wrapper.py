@@ -1,29 +1,69 @@
 import importlib.resources
 import os
+from pathlib import Path
 
 from .yaml import YAMLMetadata
 
 _RESOURCES = importlib.resources.files("renderknecht") / "resources"
 
+_INPUT_FORMAT = "markdown+citations+grid_tables+implicit_figures+table_captions+tex_math_dollars"
 
-def determine_pandoc_arguments(metadata: YAMLMetadata) -> list[str]:
+OUTPUT_FORMATS = ("pdf", "html")
+
+
+def determine_pandoc_arguments(
+    metadata: YAMLMetadata,
+    output_format: str = "pdf",
+    draft: bool = False,
+    latex_environments: bool = True,
+    emit_latex: bool = False,
+) -> list[str]:
+    """Return the pandoc command line for rendering to ``output_format``.
+
+    ``pdf`` renders through LaTeX with the Eisvogel template; ``html`` renders a
+    standalone HTML page with all images inlined, meant for fast previews.
+
+    In ``draft`` mode, pandoc emits LaTeX instead of a PDF, so that the caller
+    can compile it in a single LaTeX pass.  The title page and the TOC are
+    skipped, images are replaced by placeholders and every page is marked as
+    a draft.  With ``emit_latex``, pandoc emits the LaTeX of the final
+    document instead, e.g. to compile it in parallel chunks.
+
+    Divs are mapped to LaTeX environments (see ``pandoc-latex-environment`` in
+    ``preamble.yaml``) by a bundled Lua filter, which is only added when
+    ``latex_environments`` is set.
+    """
     pandoc_options: list = (metadata or {}).get("pandoc-options", [])
 
-    pandoc_args = [
-        "pandoc",
-        "--verbose",
-        "-s",
-        "-f",
-        "markdown+citations+grid_tables+implicit_figures+table_captions+tex_math_dollars",
-        "-t",
-        "pdf",
-        "-s",
-        "--template",
-        "eisvogel",
-        "--syntax-highlighting=idiomatic",
-        "--figure-caption-position=below",
-        "--table-caption-position=below",
-    ]
+    if output_format == "html":
+        pandoc_args = [
+            "pandoc",
+            "-s",
+            "-f",
+            _INPUT_FORMAT,
+            "-t",
+            "html5",
+            "--embed-resources",
+            "--mathml",
+            "--figure-caption-position=below",
+            "--table-caption-position=below",
+        ]
+    else:
+        pandoc_args = [
+            "pandoc",
+            "--verbose",
+            "-s",
+            "-f",
+            _INPUT_FORMAT,
+            "-t",
+            "latex" if draft or emit_latex else "pdf",
+            "-s",
+            "--template",
+            "eisvogel",
+            "--syntax-highlighting=idiomatic",
+            "--figure-caption-position=below",
+            "--table-caption-position=below",
+        ]
 
     if "crossref" in pandoc_options:
         # pandoc-crossref emits lstlisting; -M listings=true makes eisvogel load \usepackage{listings}
@@ -33,17 +73,94 @@ def determine_pandoc_arguments(metadata: YAMLMetadata) -> list[str]:
         "--citeproc",
         "--csl",
         str(_RESOURCES / "ieee.csl"),
-        "--filter",
-        "pandoc-latex-environment",
     ]
 
+    if output_format == "pdf" and latex_environments:
+        pandoc_args += ["--lua-filter", str(_RESOURCES / "latex-environment.lua")]
+
     if work_dir := os.environ.get("WORK_DIR"):
         pandoc_args += ["--resource-path", work_dir]
 
     if "toc" in pandoc_options:
+        pandoc_args += ["--number-sections"]
+        if not draft:
+            pandoc_args += ["--toc"]
+
+    if draft and output_format == "pdf":
         pandoc_args += [
-            "--number-sections",
-            "--toc",
+            "-M",
+            "titlepage=false",
+            "--include-in-header",
+            str(_RESOURCES / "draft.tex"),
         ]
 
     return pandoc_args
+
+
+def _find_template(name: str) -> Path | None:
+    data_dirs = [
+        Path(os.environ.get("XDG_DATA_HOME", Path.home() / ".local" / "share")) / "pandoc",
+        Path.home() / ".pandoc",
+    ]
+    for data_dir in data_dirs:
+        candidate = data_dir / "templates" / f"{name}.latex"
+        if candidate.is_file():
+            return candidate
+    return None
+
+
+def determine_pandoc_server_parameters(
+    metadata: YAMLMetadata,
+    draft: bool = False,
+    latex_environments: bool = True,
+) -> tuple[dict, dict[str, Path]] | None:
+    """Return the pandoc-server request for converting Markdown to Eisvogel LaTeX.
+
+    This is the counterpart of :func:`determine_pandoc_arguments` for PDFs,
+    where LaTeX runs as a separate stage.  The server cannot run filters and
+    only reads the files sent along with the request, so None is returned when
+    the document needs a filter or a file that cannot be sent.
+
+    :returns: The request parameters and the files to send, by the name pandoc uses.
+    """
+    pandoc_options: list = (metadata or {}).get("pandoc-options", [])
+    if "crossref" in pandoc_options or latex_environments:
+        return None
+    template = _find_template("eisvogel")
+    if template is None:
+        return None
+
+    csl = _RESOURCES / "ieee.csl"
+    files = {"ieee.csl": Path(str(csl))}
+    bibliography = (metadata or {}).get("bibliography") or []
+    for file in [bibliography] if isinstance(bibliography, str) else bibliography:
+        path = Path(file)
+        if not path.is_absolute() and (work_dir := os.environ.get("WORK_DIR")):
+            path = Path(work_dir) / path
+        if not path.is_file():
+            return None
+        files[file] = path
+
+    parameters: dict = {
+        "from": _INPUT_FORMAT,
+        "to": "latex",
+        "standalone": True,
+        "template": template.read_text(encoding="utf-8"),
+        "syntax-highlighting": "idiomatic",
+        "figure-caption-position": "below",
+        "table-caption-position": "below",
+        "citeproc": True,
+        "csl": "ieee.csl",
+    }
+
+    if "toc" in pandoc_options:
+        parameters["number-sections"] = True
+        if not draft:
+            parameters["table-of-contents"] = True
+
+    if draft:
+        files["draft.tex"] = Path(str(_RESOURCES / "draft.tex"))
+        parameters["variables"] = {"titlepage": False}
+        parameters["include-in-header"] = ["draft.tex"]
+
+    return parameters, files
@@ -0,0 +1,275 @@
+import dataclasses
+import hashlib
+import importlib.util
+import io
+import logging
+import os
+import time
+from typing import TYPE_CHECKING
+
+from . import metrics
+
+if TYPE_CHECKING:
+    import pikepdf
+
+STEPS = ("compress", "linearize", "deduplicate")
+
+_SIZE = metrics.REGISTRY.summary(
+    "renderknecht_pdf_postprocess_bytes",
+    "Size of PDFs before (stage=input) and after (stage=output) post-processing",
+)
+_SECONDS = metrics.REGISTRY.summary("renderknecht_pdf_postprocess_seconds", "Time spent post-processing PDFs")
+_FAILURES = metrics.REGISTRY.counter(
+    "renderknecht_pdf_postprocess_failures", "PDFs delivered as rendered because post-processing failed"
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class Optimization:
+    """Post-processing steps applied to rendered PDFs.
+
+    :param compress: Compress all streams and pack objects into object streams.
+    :param linearize: Linearize ("fast web view"), so viewers can show the first page early.
+    :param deduplicate: Store identical embedded images and font files once.
+    """
+
+    compress: bool = False
+    linearize: bool = False
+    deduplicate: bool = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.compress or self.linearize or self.deduplicate
+
+    @classmethod
+    def from_env(cls) -> "Optimization":
+        """Read the steps from RENDERKNECHT_PDF_OPTIMIZE: a comma-separated list of :data:`STEPS`, or ``all``.
+
+        :raises ValueError: if a step is unknown.
+        """
+        value = os.environ.get("RENDERKNECHT_PDF_OPTIMIZE", "").strip().lower()
+        steps = {step.strip() for step in value.split(",") if step.strip()}
+        if steps == {"all"}:
+            steps = set(STEPS)
+        if unknown := steps - set(STEPS):
+            raise ValueError(f"unknown PDF post-processing steps: {', '.join(sorted(unknown))}")
+        return cls(**{step: True for step in steps})
+
+
+def available() -> bool:
+    """Tell whether pikepdf, which post-processing and merging need, is installed."""
+    return importlib.util.find_spec("pikepdf") is not None
+
+
+def _font_files(document: "pikepdf.Pdf") -> set[tuple[int, int]]:
+    import pikepdf
+
+    files = set()
+    for obj in document.objects:
+        if isinstance(obj, pikepdf.Dictionary) and obj.get("/Type") == pikepdf.Name.FontDescriptor:
+            for key in ("/FontFile", "/FontFile2", "/FontFile3"):
+                if key in obj and obj[key].is_indirect:
+                    files.add(obj[key].objgen)
+    return files
+
+
+def _relink(container: "pikepdf.Object", replacements: dict, seen: set) -> None:
+    import pikepdf
+
+    if isinstance(container, pikepdf.Array):
+        items = list(enumerate(container))
+    elif isinstance(container, pikepdf.Dictionary | pikepdf.Stream):
+        items = [(key, container[key]) for key in container.keys()]  # noqa: SIM118 (no dict)
+    else:
+        return
+    for key, value in items:
+        if not isinstance(value, pikepdf.Object):
+            continue
+        if value.is_indirect:
+            if value.objgen in replacements:
+                container[key] = replacements[value.objgen]
+        elif id(value) not in seen:
+            seen.add(id(value))
+            _relink(value, replacements, seen)
+
+
+def deduplicate(document: "pikepdf.Pdf") -> int:
+    """Make all references to identical images and font files refer to the same object.
+
+    Documents embedding the same image several times, or PDF figures each
+    carrying a copy of the same font, then store it once.
+
+    :returns: The number of duplicates removed.
+    """
+    import pikepdf
+
+    font_files = _font_files(document)
+    streams = [
+        obj
+        for obj in document.objects
+        if isinstance(obj, pikepdf.Stream)
+        and (obj.get("/Subtype") == pikepdf.Name.Image or obj.objgen in font_files)
+    ]
+    # soft masks before the images referring to them, so that those compare equal once their masks do
+    streams.sort(key=lambda obj: any(isinstance(v, pikepdf.Object) and v.is_indirect for v in obj.values()))
+    canonical: dict[tuple[bytes, bytes], pikepdf.Object] = {}
+    replacements: dict[tuple[int, int], pikepdf.Object] = {}
+    for obj in streams:
+        parameters = pikepdf.Dictionary(
+            {
+                key: replacements.get(value.objgen, value)
+                if isinstance(value, pikepdf.Object) and value.is_indirect
+                else value
+                for key, value in obj.items()
+                if key != "/Length"
+            }
+        )
+        key = (hashlib.sha256(obj.read_raw_bytes()).digest(), parameters.unparse())
+        if key in canonical:
+            replacements[obj.objgen] = canonical[key]
+        else:
+            canonical[key] = obj
+    if replacements:
+        for obj in document.objects:
+            _relink(obj, replacements, set())
+    return len(replacements)
+
+
+def optimize(pdf: bytes, optimization: Optimization) -> bytes:
+    """Apply ``optimization`` to a PDF.
+
+    :raises ImportError: if pikepdf is not installed.
+    :raises pikepdf.PdfError: if the PDF cannot be processed.
+    """
+    import pikepdf
+
+    with pikepdf.open(io.BytesIO(pdf)) as document:
+        if optimization.deduplicate:
+            deduplicate(document)
+        output = io.BytesIO()
+        document.save(
+            output,
+            compress_streams=True,
+            recompress_flate=optimization.compress,
+            object_stream_mode=(
+                pikepdf.ObjectStreamMode.generate
+                if optimization.compress
+                else pikepdf.ObjectStreamMode.preserve
+            ),
+            linearize=optimization.linearize,
+        )
+        return output.getvalue()
+
+
+def postprocess(pdf: bytes, optimization: Optimization | None = None) -> bytes:
+    """Post-process a rendered PDF as configured, defaulting to :meth:`Optimization.from_env`.
+
+    Sizes and durations are recorded in the metrics.  Post-processing never
+    fails a render: if it fails, the PDF is returned as rendered.
+    """
+    optimization = optimization or Optimization.from_env()
+    if not optimization.enabled:
+        return pdf
+    started = time.monotonic()
+    try:
+        output = optimize(pdf, optimization)
+    except ImportError:
+        logging.warning("PDF post-processing needs the pikepdf package: install renderknecht[pdf]")
+        _FAILURES.inc()
+        return pdf
+    except Exception as e:
+        logging.warning("PDF post-processing failed, delivering the PDF as rendered: %s", e)
+        _FAILURES.inc()
+        return pdf
+    seconds = time.monotonic() - started
+    _SECONDS.observe(seconds)
+    _SIZE.observe(len(pdf), stage="input")
+    _SIZE.observe(len(output), stage="output")
+    logging.info("Post-processed PDF in %.2f s: %d -> %d bytes", seconds, len(pdf), len(output))
+    return output
+
+
+def page_count(pdf: bytes) -> int:
+    """Return the number of pages of a PDF.
+
+    :raises ImportError: if pikepdf is not installed.
+    """
+    import pikepdf
+
+    with pikepdf.open(io.BytesIO(pdf)) as document:
+        return len(document.pages)
+
+
+def _named_target(item: "pikepdf.OutlineItem") -> "pikepdf.String | pikepdf.Name | None":
+    import pikepdf
+
+    target = item.destination
+    if target is None and item.action is not None and item.action.get("/S") == pikepdf.Name.GoTo:
+        target = item.action.get("/D")
+    return target if isinstance(target, pikepdf.String | pikepdf.Name) else None
+
+
+def _copy_outline(items: list, copies: list) -> None:
+    import pikepdf
+
+    for item in items:
+        copy = pikepdf.OutlineItem(str(item.title), destination=_named_target(item))
+        copy.is_closed = item.is_closed
+        _copy_outline(item.children, copy.children)
+        copies.append(copy)
+
+
+def merge(documents: list[bytes], page_ranges: list[range]) -> bytes:
+    """Merge pages of PDFs that were compiled from parts of the same LaTeX document.
+
+    Pages are taken from each document by its range, in order.  Named
+    destinations, which links and bookmarks refer to, are taken from the
+    document holding the page they point to.  The outline, page labels and
+    document information are taken from the first document, which is
+    expected to cover the whole document (as LaTeX writes them from the
+    auxiliary files of all parts).
+
+    :raises ImportError: if pikepdf is not installed.
+    """
+    import pikepdf
+
+    merged = pikepdf.new()
+    destinations: dict[str, pikepdf.Array] = {}
+    sources = [pikepdf.open(io.BytesIO(document)) for document in documents]
+    try:
+        for source, pages in zip(sources, page_ranges, strict=True):
+            copies: dict[tuple[int, int], pikepdf.Object] = {}
+            for index in pages:
+                merged.pages.append(source.pages[index])
+                copies[source.pages[index].obj.objgen] = merged.pages[-1].obj
+            if "/Names" not in source.Root or "/Dests" not in source.Root.Names:
+                continue
+            for key, destination in pikepdf.NameTree(source.Root.Names.Dests).items():
+                name = key if isinstance(key, str) else key.decode()
+                target = destination.D if isinstance(destination, pikepdf.Dictionary) else destination
+                page = target[0]
+                if isinstance(page, pikepdf.Object) and page.is_indirect and page.objgen in copies:
+                    destinations[name] = pikepdf.Array([copies[page.objgen], *list(target)[1:]])
+
+        if destinations:
+            tree = pikepdf.NameTree.new(merged)
+            for name, destination in destinations.items():
+                tree[name] = destination
+            merged.Root.Names = pikepdf.Dictionary(Dests=tree.obj)
+        first = sources[0]
+        with first.open_outline() as outline, merged.open_outline() as merged_outline:
+            _copy_outline(outline.root, merged_outline.root)
+        if "/PageLabels" in first.Root:
+            merged.Root.PageLabels = merged.copy_foreign(first.make_indirect(first.Root.PageLabels))
+        if "/PageMode" in first.Root:
+            merged.Root.PageMode = first.Root.PageMode
+        docinfo = merged.copy_foreign(first.make_indirect(first.docinfo))
+        if isinstance(docinfo, pikepdf.Dictionary):
+            merged.docinfo = docinfo
+
+        output = io.BytesIO()
+        merged.save(output)
+        return output.getvalue()
+    finally:
+        for source in sources:
+            source.close()
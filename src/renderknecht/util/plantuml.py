@@ -0,0 +1,170 @@
+import atexit
+import contextlib
+import logging
+import os
+import queue
+import re
+import shlex
+import shutil
+import subprocess
+import threading
+
+from .process import Limits, Supervisor
+
+_DELIMITER = "___RENDERKNECHT_PLANTUML_END___"
+_POLL_INTERVAL = 0.25
+_START_PATTERN = re.compile(r"^\s*@start(\w+)", re.MULTILINE)
+_END_PATTERN = re.compile(r"^\s*@end\w+", re.MULTILINE)
+
+
+def plantuml_command() -> list[str] | None:
+    """Return the command line used to launch a local PlantUML, or None if there is none.
+
+    Priority: PLANTUML_COMMAND (shell-quoted command line)
+              > PLANTUML_JAR (launched via ``java -jar``) > ``plantuml`` on PATH.
+    """
+    if command := os.environ.get("PLANTUML_COMMAND"):
+        return shlex.split(command)
+    if jar := os.environ.get("PLANTUML_JAR"):
+        return ["java", "-Djava.awt.headless=true", "-jar", jar]
+    if executable := shutil.which("plantuml"):
+        return [executable]
+    return None
+
+
+class PlantUMLPipe:
+    """A PlantUML JVM kept warm in ``-pipe`` mode.
+
+    Diagrams are streamed through the stdin of a single long-running process,
+    so JVM startup is paid only once.  Each diagram's SVG is terminated by a
+    delimiter line on stdout, which a reader thread hands over line by line,
+    so that waiting for it is bounded by the time limit of the render.  Access
+    is serialized, as the pipe protocol handles one diagram at a time.  The
+    process is (re)started lazily, so a crashed JVM, or one killed because a
+    diagram took too long, is replaced on the next call.
+    """
+
+    def __init__(self, command: list[str]) -> None:
+        self._command = [*command, "-tsvg", "-charset", "UTF-8", "-pipe", "-pipedelimitor", _DELIMITER]
+        self._lock = threading.Lock()
+        self._process: subprocess.Popen | None = None
+        self._lines: queue.Queue[str | None] = queue.Queue()
+
+    def _ensure_started(self) -> subprocess.Popen:
+        if self._process is None or self._process.poll() is not None:
+            logging.info("Starting PlantUML in pipe mode: %s", " ".join(self._command))
+            self._process = subprocess.Popen(
+                self._command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                # syntax errors are rendered as an error diagram on stdout
+                stderr=subprocess.DEVNULL,
+                text=True,
+                encoding="utf-8",
+            )
+            # every process gets a queue of its own, so no stale lines are read after a restart
+            self._lines = queue.Queue()
+            threading.Thread(
+                target=self._read, args=(self._process, self._lines), name="plantuml-reader", daemon=True
+            ).start()
+        return self._process
+
+    @staticmethod
+    def _read(process: subprocess.Popen, lines: queue.Queue[str | None]) -> None:
+        assert process.stdout is not None
+        for line in process.stdout:
+            lines.put(line)
+        lines.put(None)
+
+    @staticmethod
+    def _poll(supervisor: Supervisor) -> float:
+        """Check the render, and return how long to wait before checking it again."""
+        supervisor.check("plantuml")
+        remaining = supervisor.remaining()
+        return _POLL_INTERVAL if remaining is None else min(_POLL_INTERVAL, max(remaining, 0.0))
+
+    def _readline(self, supervisor: Supervisor) -> str | None:
+        while True:
+            with contextlib.suppress(queue.Empty):
+                return self._lines.get(timeout=self._poll(supervisor))
+
+    def render(self, markup: str, supervisor: Supervisor | None = None) -> str:
+        """Render a single diagram to SVG.
+
+        :param markup: PlantUML source; ``@startuml``/``@enduml`` are added when missing.
+        :param supervisor: Supervisor of the render, whose time limit and cancellation apply
+                           while waiting for the diagram; defaults to the limits from the environment.
+        :returns: The SVG document.
+        :raises RuntimeError: if the PlantUML process terminates unexpectedly.
+        :raises subprocess.TimeoutExpired: if the diagram is not rendered in time.
+        :raises RenderCancelledError: if the render is cancelled.
+        """
+        if (start := _START_PATTERN.search(markup)) is None:
+            markup = f"@startuml\n{markup}\n@enduml"
+        elif not _END_PATTERN.search(markup):
+            # PlantUML would wait for the end of the diagram forever
+            markup = f"{markup.rstrip()}\n@end{start.group(1)}"
+        supervisor = supervisor or Supervisor(Limits.from_env())
+
+        while not self._lock.acquire(timeout=self._poll(supervisor)):
+            pass
+        try:
+            process = self._ensure_started()
+            assert process.stdin is not None
+            try:
+                process.stdin.write(f"{markup.rstrip()}\n")
+                process.stdin.flush()
+            except BrokenPipeError as e:
+                self._terminate()
+                raise RuntimeError("PlantUML pipe closed unexpectedly") from e
+            lines = []
+            try:
+                while (line := self._readline(supervisor)) is not None and line.rstrip("\r\n") != _DELIMITER:
+                    lines.append(line)
+            except BaseException:
+                # the process is still busy with the diagram; only a new one is in a known state
+                self._terminate(kill=True)
+                raise
+            if line is None:
+                self._terminate()
+                raise RuntimeError("PlantUML pipe closed unexpectedly")
+        finally:
+            self._lock.release()
+        return "".join(lines)
+
+    def _terminate(self, kill: bool = False) -> None:
+        if self._process is None:
+            return
+        if kill:
+            self._process.kill()
+        if self._process.stdin:
+            with contextlib.suppress(BrokenPipeError):
+                self._process.stdin.close()
+        try:
+            self._process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        self._process = None
+
+    def close(self) -> None:
+        """Stop the PlantUML process, if running."""
+        with self._lock:
+            self._terminate()
+
+
+_SHARED: PlantUMLPipe | None = None
+_SHARED_LOCK = threading.Lock()
+
+
+def shared_pipe() -> PlantUMLPipe | None:
+    """Return the process-wide PlantUML pipe, or None if no local PlantUML is available."""
+    global _SHARED
+    with _SHARED_LOCK:
+        if _SHARED is None:
+            command = plantuml_command()
+            if command is None:
+                return None
+            _SHARED = PlantUMLPipe(command)
+            atexit.register(_SHARED.close)
+        return _SHARED
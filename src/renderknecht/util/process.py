@@ -0,0 +1,163 @@
+import contextlib
+import dataclasses
+import os
+import resource
+import signal
+import subprocess
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+_POLL_INTERVAL = 0.25
+
+
+class RenderCancelledError(Exception):
+    """Raised when a render is cancelled, e.g. because its client disconnected."""
+
+
+def _env_number(name: str, default: float | None) -> float | None:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return float(value) or None
+
+
+@dataclasses.dataclass(frozen=True)
+class Limits:
+    """Resource limits of a single render.
+
+    :param timeout: Wall-clock seconds for the whole render.
+    :param cpu: CPU seconds for each process of the render.
+    :param memory: Bytes of memory (data segment) for each process of the render.
+    """
+
+    timeout: float | None = 600.0
+    cpu: int | None = None
+    memory: int | None = None
+
+    @classmethod
+    def from_env(cls) -> "Limits":
+        """Read the limits from RENDERKNECHT_RENDER_TIMEOUT, _CPU_LIMIT and _MEMORY_LIMIT; 0 disables a limit."""
+        cpu = _env_number("RENDERKNECHT_RENDER_CPU_LIMIT", None)
+        memory = _env_number("RENDERKNECHT_RENDER_MEMORY_LIMIT", None)
+        return cls(
+            timeout=_env_number("RENDERKNECHT_RENDER_TIMEOUT", cls.timeout),
+            cpu=int(cpu) if cpu else None,
+            memory=int(memory) if memory else None,
+        )
+
+
+class Supervisor:
+    """Runs the processes of a single render within its limits.
+
+    Each process is started in a session of its own, so that the whole
+    process tree (e.g. pandoc and the LaTeX it runs) is killed when the render
+    times out or is cancelled.  CPU and memory limits are set in each process
+    before it executes its command and are inherited by its children, but they
+    hold per process: a render running several processes (e.g. LaTeX chunks in
+    parallel) may use the CPU limit in each of them.  Only the timeout bounds
+    the render as a whole.
+
+    :param limits: Limits of the render; defaults to :meth:`Limits.from_env`.
+    :param cancelled: Polled while processes run; the render is cancelled once it returns True.
+    """
+
+    def __init__(self, limits: Limits | None = None, cancelled: Callable[[], bool] | None = None) -> None:
+        self.limits = limits or Limits.from_env()
+        self.checks: list[Callable[[], None]] = []
+        self._cancelled = cancelled
+        self._cancel_event = threading.Event()
+        self._started = time.monotonic()
+
+    def cancel(self) -> None:
+        """Cancel the render; running processes are killed."""
+        self._cancel_event.set()
+
+    def remaining(self) -> float | None:
+        """Return the seconds left until the render times out, or None without a timeout."""
+        if self.limits.timeout is None:
+            return None
+        return self.limits.timeout - (time.monotonic() - self._started)
+
+    def check(self, command: str = "render") -> None:
+        """Raise if the render must not continue.
+
+        :raises RenderCancelledError: if the render was cancelled.
+        :raises subprocess.TimeoutExpired: if the render ran out of time.
+        """
+        if self._cancel_event.is_set() or (self._cancelled is not None and self._cancelled()):
+            self._cancel_event.set()
+            raise RenderCancelledError(f"{command} cancelled")
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise subprocess.TimeoutExpired(command, self.limits.timeout or 0)
+        for check in self.checks:
+            check()
+
+    def _limit_resources(self) -> Callable[[], None] | None:
+        limits = [
+            (limit, value)
+            for limit, value in (
+                (resource.RLIMIT_CPU, self.limits.cpu),
+                (resource.RLIMIT_DATA, self.limits.memory),
+            )
+            if value is not None
+        ]
+        if not limits:
+            return None
+
+        def preexec() -> None:
+            # runs in the forked child, so it must not take locks (no imports, no logging)
+            for limit, value in limits:
+                resource.setrlimit(limit, (value, value))
+
+        return preexec
+
+    def run(
+        self,
+        command: list[str],
+        input: bytes | None = None,  # noqa: A002 (mirrors subprocess.run)
+        cwd: Path | None = None,
+        env: dict[str, str] | None = None,
+    ) -> subprocess.CompletedProcess:
+        """Run a process of the render to completion.
+
+        :returns: The completed process, with stdout and stderr captured.
+        :raises subprocess.CalledProcessError: if the process fails.
+        :raises subprocess.TimeoutExpired: if the render runs out of time.
+        :raises RenderCancelledError: if the render is cancelled.
+        """
+        self.check(command[0])
+        process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            env=env,
+            start_new_session=True,
+            preexec_fn=self._limit_resources(),
+        )
+        try:
+            while True:
+                try:
+                    stdout, stderr = process.communicate(input=input, timeout=_POLL_INTERVAL)
+                    break
+                except subprocess.TimeoutExpired:
+                    # communicate() keeps writing the input it was given first
+                    input = None  # noqa: A001 (mirrors subprocess.run)
+                    self.check(command[0])
+        except BaseException:
+            self._kill(process)
+            raise
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, " ".join(command), stdout, stderr)
+        return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+    @staticmethod
+    def _kill(process: subprocess.Popen) -> None:
+        with contextlib.suppress(ProcessLookupError, PermissionError):
+            os.killpg(process.pid, signal.SIGKILL)
+        process.kill()
+        process.communicate()
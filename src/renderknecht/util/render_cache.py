@@ -0,0 +1,104 @@
+import contextlib
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+_DEFAULT_SIZE = 1024 * 1024 * 1024
+
+
+class RenderCache:
+    """Cache of rendered documents in a directory, shared by all processes using it.
+
+    Entries are files named by their key.  Reading an entry refreshes its
+    modification time; when the cache grows beyond ``max_size`` bytes, the
+    least recently used entries are removed.
+
+    :param directory: The cache directory.
+    :param max_size: Size limit in bytes.
+    """
+
+    def __init__(self, directory: Path, max_size: int = _DEFAULT_SIZE) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key
+
+    def get(self, key: str) -> bytes | None:
+        """Return the cached document, or None on a miss."""
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        return data
+
+    def path(self, key: str) -> Path | None:
+        """Return the file of a cached entry, refreshing it like :meth:`get`, or None on a miss."""
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def __contains__(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def put(self, key: str, data: bytes) -> None:
+        """Store a document, evicting the least recently used ones if the cache is full."""
+        # write to a temporary file first; readers must never see a partial document
+        with tempfile.NamedTemporaryFile(dir=self.directory, prefix=f".{key}-", delete=False) as f:
+            f.write(data)
+        Path(f.name).replace(self._path(key))
+        self.evict()
+
+    def evict(self) -> int:
+        """Remove the least recently used entries until the cache fits ``max_size``.
+
+        :returns: The number of removed entries.
+        """
+        entries = []
+        for path in self.directory.iterdir():
+            if path.name.startswith("."):
+                continue
+            with contextlib.suppress(OSError):
+                stat = path.stat()
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        if removed:
+            logging.info("Evicted %d documents from the render cache", removed)
+        return removed
+
+
+_SHARED: RenderCache | None = None
+_SHARED_LOCK = threading.Lock()
+
+
+def shared_cache() -> RenderCache | None:
+    """Return the process-wide render cache, or None when it is disabled.
+
+    The cache is enabled by RENDERKNECHT_RENDER_CACHE, the cache directory;
+    RENDERKNECHT_RENDER_CACHE_SIZE limits its size in bytes (default: 1 GiB).
+    """
+    global _SHARED
+    directory = os.environ.get("RENDERKNECHT_RENDER_CACHE", "")
+    if not directory:
+        return None
+    with _SHARED_LOCK:
+        if _SHARED is None or _SHARED.directory != Path(directory):
+            max_size = int(os.environ.get("RENDERKNECHT_RENDER_CACHE_SIZE", _DEFAULT_SIZE))
+            _SHARED = RenderCache(Path(directory), max_size)
+        return _SHARED
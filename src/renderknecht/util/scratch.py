@@ -0,0 +1,125 @@
+import contextlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from collections.abc import Generator
+from pathlib import Path
+
+_PREFIX = "render-"
+_NAME_PATTERN = re.compile(rf"^{_PREFIX}(\d+)-")
+
+_DEFAULT_LIMIT = 512 * 1024 * 1024
+_DEFAULT_MAX_AGE = 24 * 60 * 60
+
+
+class ScratchSpaceError(OSError):
+    """Raised when a render uses more scratch space than allowed."""
+
+
+def scratch_root() -> Path:
+    """Return the directory holding the per-render scratch directories.
+
+    Priority: RENDERKNECHT_SCRATCH_DIR > /dev/shm/renderknecht (tmpfs)
+              > <system temp dir>/renderknecht.
+    """
+    if "RENDERKNECHT_SCRATCH_DIR" in os.environ:
+        return Path(os.environ["RENDERKNECHT_SCRATCH_DIR"])
+    shm = Path("/dev/shm")  # noqa: S108 (tmpfs; every render gets its own mkdtemp directory)
+    if shm.is_dir() and os.access(shm, os.W_OK):
+        return shm / "renderknecht"
+    return Path(tempfile.gettempdir()) / "renderknecht"
+
+
+class ScratchDir:
+    """An isolated working directory of a single render."""
+
+    def __init__(self, path: Path, limit: int) -> None:
+        self.path = path
+        self.limit = limit
+
+    def usage(self) -> int:
+        """Return the number of bytes currently stored in the directory."""
+        total = 0
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                with contextlib.suppress(OSError):
+                    total += (Path(root) / name).lstat().st_size
+        return total
+
+    def check(self) -> None:
+        """Enforce the size limit.
+
+        Renders register this check with their :class:`~renderknecht.util.process.Supervisor`,
+        so that it also runs while pandoc and LaTeX write to the directory.
+
+        :raises ScratchSpaceError: if the directory holds more than ``limit`` bytes.
+        """
+        if self.limit and (usage := self.usage()) > self.limit:
+            raise ScratchSpaceError(f"Render uses {usage} bytes of scratch space; limit is {self.limit}")
+
+
+@contextlib.contextmanager
+def scratch_dir(limit: int | None = None) -> Generator[ScratchDir]:
+    """Create a scratch directory for a single render and remove it afterwards.
+
+    The directory is removed whether the render succeeds, fails or is
+    interrupted.  Its name carries the PID of the owning process, so that
+    :func:`sweep_stale` can tell orphaned directories apart.
+
+    :param limit: Size limit in bytes; defaults to RENDERKNECHT_SCRATCH_LIMIT (512 MiB), 0 disables it.
+    """
+    if limit is None:
+        limit = int(os.environ.get("RENDERKNECHT_SCRATCH_LIMIT", _DEFAULT_LIMIT))
+    root = scratch_root()
+    root.mkdir(parents=True, exist_ok=True)
+    path = Path(tempfile.mkdtemp(prefix=f"{_PREFIX}{os.getpid()}-", dir=root))
+    try:
+        yield ScratchDir(path, limit)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def sweep_stale(max_age: float | None = None) -> int:
+    """Remove scratch directories left behind by crashed or killed renders.
+
+    A directory is stale when its owning process is gone, or when it is older
+    than ``max_age`` seconds (default: RENDERKNECHT_SCRATCH_MAX_AGE, one day).
+
+    :returns: The number of removed directories.
+    """
+    if max_age is None:
+        max_age = float(os.environ.get("RENDERKNECHT_SCRATCH_MAX_AGE", _DEFAULT_MAX_AGE))
+    root = scratch_root()
+    if not root.is_dir():
+        return 0
+
+    removed = 0
+    now = time.time()
+    for entry in root.iterdir():
+        match = _NAME_PATTERN.match(entry.name)
+        if not match or not entry.is_dir():
+            continue
+        try:
+            age = now - entry.stat().st_mtime
+        except OSError:
+            continue
+        pid = int(match.group(1))
+        if (pid != os.getpid() and not _pid_alive(pid)) or age > max_age:
+            shutil.rmtree(entry, ignore_errors=True)
+            removed += 1
+    if removed:
+        logging.info("Removed %d stale scratch directories from %s", removed, root)
+    return removed
@@ -0,0 +1,142 @@
+"""Warm-up of render containers.
+
+The first render of a fresh container is much slower than later ones: TeX
+generates its font maps, PlantUML and the pandoc server start, Python
+imports the rest of renderknecht and the file system cache is cold.
+Rendering a canary document that touches all of these (Eisvogel, citeproc,
+crossref, LaTeX environments, diagrams) pays that price before the first
+user waits for it.
+"""
+
+import argparse
+import importlib.resources
+import logging
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections.abc import Callable
+
+from .renderers import pandoc
+from .util import metrics, pandoc_server, scratch
+from .util import yaml as util_yaml
+
+Render = Callable[[str, str, bool], bytes]
+
+_TRUTHY = ("1", "true", "yes", "on")
+_RETRY_INTERVAL = 30.0
+_FENCED_DIV_PATTERN = re.compile(r"^:::.*?^:::[ \t]*\n", re.MULTILINE | re.DOTALL)
+
+_SECONDS = metrics.REGISTRY.gauge("renderknecht_warmup_seconds", "Time the warm-up of this process took")
+
+
+def enabled() -> bool:
+    """Tell whether services warm up before they report ready, from RENDERKNECHT_WARMUP."""
+    return os.environ.get("RENDERKNECHT_WARMUP", "").lower() in _TRUTHY
+
+
+def canary() -> str:
+    """Return the Markdown of the canary document."""
+    return (importlib.resources.files("renderknecht") / "resources" / "canary.md").read_text(encoding="utf-8")
+
+
+def server_canary() -> str:
+    """Return the canary without what makes pandoc convert it instead of the pandoc server.
+
+    The pandoc server runs no filters, so crossref and the fenced divs the
+    LaTeX environment filter maps to boxes are left out.
+    """
+    markdown = canary().replace("  - crossref\n", "")
+    return _FENCED_DIV_PATTERN.sub("", markdown)
+
+
+def _render(markdown: str, output_format: str, draft: bool) -> bytes:
+    return pandoc.render_markdown(markdown, output_format, draft=draft)
+
+
+def warm_up(render: Render | None = None) -> float:
+    """Render the canary document as PDF and HTML preview.
+
+    Besides the PDF toolchain, this starts the local PlantUML and pandoc
+    server (if configured) and fills the diagram cache.  With
+    RENDERKNECHT_PANDOC_SERVER, :func:`server_canary` is rendered, too, which
+    the pandoc server converts.
+
+    The other caches are left cold on purpose: the render cache is keyed by
+    document and nobody requests the canary, the bibliography cache holds the
+    parsed files users cite (the canary's references are inline), and the
+    image cache mirrors the remote images of users' documents, which the
+    warm-up cannot know and should not fetch.
+
+    :param render: Renders Markdown; defaults to rendering in this process.
+    :returns: The seconds the warm-up took.
+    :raises subprocess.CalledProcessError: if the canary cannot be rendered.
+    """
+    render = render or _render
+    markdown = canary()
+    started = time.monotonic()
+    render(markdown, "pdf", False)
+    if pandoc_server.shared_server() is not None:
+        render(server_canary(), "pdf", False)
+    render(markdown, "html", False)
+    seconds = time.monotonic() - started
+    _SECONDS.set(seconds)
+    logging.info("Warm-up took %.1f s", seconds)
+    return seconds
+
+
+class Readiness:
+    """Readiness of a service, which becomes ready once it has warmed up.
+
+    :param retry_interval: Seconds to wait before warming up again after a failure.
+    """
+
+    def __init__(self, retry_interval: float = _RETRY_INTERVAL) -> None:
+        self.ready = threading.Event()
+        self.seconds: float | None = None
+        self.error: str | None = None
+        self._retry_interval = retry_interval
+        self._thread: threading.Thread | None = None
+
+    def set_ready(self) -> None:
+        self.ready.set()
+
+    def warm_up(self, render: Render | None = None) -> None:
+        """Warm up, retrying until it succeeds, and become ready."""
+        while not self.ready.is_set():
+            try:
+                self.seconds = warm_up(render)
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}"
+                logging.error("Warm-up failed, retrying in %g s: %s", self._retry_interval, self.error)
+                time.sleep(self._retry_interval)
+                continue
+            self.error = None
+            self.ready.set()
+
+    def start(self, render: Render | None = None) -> None:
+        """Warm up in a background thread."""
+        self._thread = threading.Thread(target=self.warm_up, args=(render,), name="warmup", daemon=True)
+        self._thread.start()
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="renderknecht warmup",
+        description="Render a canary document to prime the caches of a new render container.",
+    )
+    parser.parse_args(argv)
+
+    util_yaml.configure()
+    scratch.sweep_stale()
+    try:
+        warm_up()
+    except subprocess.CalledProcessError as e:
+        logging.error("Warm-up failed with exit code %d", e.returncode)
+        sys.stderr.buffer.write(e.stderr or b"")
+        sys.exit(1)
+    except (subprocess.TimeoutExpired, scratch.ScratchSpaceError) as e:
+        logging.error("Warm-up failed: %s", e)
+        sys.exit(1)
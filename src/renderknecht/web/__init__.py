@@ -1,30 +1,152 @@
-import os
+import functools
+import hmac
+import json
+import socket
 import subprocess
+from collections.abc import Callable, Iterator
 
 import flask
 import httpx
 from flask import Flask
 
+from .. import queue, warmup
 from ..renderers import hugo, pandoc
-from ..util import yaml
+from ..util import archive, hedgedoc, metrics, pdf, process, render_cache, scratch, yaml
+from . import bulk, prerender, scheduler
+
+_CONTENT_TYPES = {
+    "pdf": "application/pdf",
+    "html": "text/html; charset=utf-8",
+}
+
+_TRUTHY = ("1", "true", "yes", "on")
+
+
+def _client_disconnected(environ: dict) -> Callable[[], bool] | None:
+    """Return a check whether the client of a request hung up, if the server exposes its socket."""
+    sock = environ.get("gunicorn.socket") or environ.get("werkzeug.socket")
+    if not isinstance(sock, socket.socket):
+        return None
+
+    def disconnected() -> bool:
+        try:
+            # an orderly shutdown reads as EOF; pending data (pipelined requests) does not count
+            return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+        except (BlockingIOError, InterruptedError):
+            return False
+        except OSError:
+            return True
+
+    return disconnected
+
+
+def _client_id(request: flask.Request) -> str:
+    """Return the address of the client of a request, as forwarded by the reverse proxy."""
+    forwarded = request.headers.get("X-Forwarded-For", "")
+    return forwarded.split(",")[0].strip() or request.remote_addr or ""
+
+
+def _json_error(status: int, error: str, message: str, **details: object) -> flask.Response:
+    response = flask.make_response(json.dumps({"error": error, "message": message, **details}), status)
+    response.headers["Content-Type"] = "application/json"
+    return response
 
 
 def create_app() -> Flask:
     app = Flask(__name__)
 
     yaml.configure()
+    scratch.sweep_stale()
+    # a misspelt RENDERKNECHT_PDF_OPTIMIZE fails the start-up rather than every render
+    pdf.Optimization.from_env()
+    # with a queue, renders run on `renderknecht worker` processes instead of in request threads
+    jobs = queue.open_queue()
+    cache = render_cache.shared_cache()
 
-    @app.route("/pdf/<pad_id>")
-    def render_pad_pdf(pad_id: str) -> flask.Response:
+    def render(
+        markdown: str, output_format: str, draft: bool, cancelled: Callable[[], bool] | None = None
+    ) -> bytes:
+        if jobs is not None:
+            return jobs.render(markdown, output_format, draft=draft, cancelled=cancelled)
+        supervisor = process.Supervisor(cancelled=cancelled)
+        return pandoc.render_markdown(markdown, output_format, draft=draft, supervisor=supervisor)
+
+    # with a queue, as many renders are submitted at once as there are workers to take them
+    workers = jobs if jobs is not None and scheduler.follows_workers() else None
+    capacity = scheduler.worker_capacity(workers) if workers is not None else bulk.render_capacity()
+    # interactive renders go first, and within a priority, clients (or pads) get their fair share
+    renders = scheduler.RenderScheduler(capacity)
+    renders.export_metrics()
+    fairness = scheduler.fairness()
+
+    def render_scheduled(
+        markdown: str,
+        output_format: str,
+        draft: bool,
+        cancelled: Callable[[], bool] | None = None,
+        priority: scheduler.Priority = scheduler.Priority.INTERACTIVE,
+        flow: str = "",
+    ) -> bytes:
+        with renders.slot(priority, flow, scheduler.estimate_cost(markdown), cancelled):
+            return render(markdown, output_format, draft, cancelled)
+
+    def render_cached(
+        markdown: str,
+        output_format: str,
+        draft: bool,
+        cancelled: Callable[[], bool] | None = None,
+        priority: scheduler.Priority = scheduler.Priority.INTERACTIVE,
+        flow: str = "",
+    ) -> bytes:
+        key = pandoc.render_cache_key(markdown, output_format, draft)
+        rendered = cache.get(key) if cache is not None else None
+        if rendered is None:
+            rendered = render_scheduled(markdown, output_format, draft, cancelled, priority, flow)
+            if cache is not None:
+                cache.put(key, rendered)
+        return rendered
+
+    # limits how many pads bulk exports render at once, across all exports
+    bulk_slots = scheduler.Slots(capacity)
+
+    def resize(capacity: int) -> None:
+        renders.resize(capacity)
+        bulk_slots.resize(capacity)
+
+    if workers is not None:
+        scheduler.track_workers(workers, resize)
+
+    # with RENDERKNECHT_WARMUP, /readyz reports ready once the canary document has been rendered
+    readiness = warmup.Readiness()
+    if warmup.enabled():
+        readiness.start(render)
+    else:
+        readiness.set_ready()
+
+    prerenderer = prerender.from_env(
+        functools.partial(render_scheduled, priority=scheduler.Priority.BACKGROUND, flow="prerender")
+    )
+    if prerenderer is not None:
+        prerenderer.start()
+    webhook_token = prerender.webhook_token()
+
+    def render_pad(pad_id: str, output_format: str, draft: bool = False) -> flask.Response:
         rsp: httpx.Response | None = None
-        tmp_files: pandoc.TemporaryFiles = []
         try:
-            rsp = httpx.get(f"http://app:3000/{pad_id}/download")
+            rsp = httpx.get(f"{hedgedoc.base_url()}/{pad_id}/download")
             rsp.raise_for_status()
 
-            pdf = pandoc.render_markdown(rsp.text, tmp_files)
-            response = flask.make_response(pdf, 200)
-            response.headers["Content-Type"] = "application/pdf"
+            if prerenderer is not None:
+                prerenderer.watch(pad_id)
+            rendered = render_cached(
+                rsp.text,
+                output_format,
+                draft,
+                _client_disconnected(flask.request.environ),
+                flow=pad_id if fairness == "pad" else _client_id(flask.request),
+            )
+            response = flask.make_response(rendered, 200)
+            response.headers["Content-Type"] = _CONTENT_TYPES[output_format]
             return response
         except subprocess.CalledProcessError as e:
             app.logger.error(f"exitcode = {e.returncode}; {e.output} {e.stderr}")
@@ -40,24 +162,113 @@ def create_app() -> Flask:
 </html>""",
                 500,
             )
+        except subprocess.TimeoutExpired as e:
+            app.logger.error(f"render of {pad_id} timed out after {e.timeout}s")
+            return _json_error(
+                504, "timeout", f"Rendering took longer than {e.timeout:g} seconds.", timeout=e.timeout
+            )
+        except process.RenderCancelledError:
+            app.logger.info(f"render of {pad_id} cancelled, client disconnected")
+            # nginx' "client closed request"; nobody is listening anymore
+            return _json_error(499, "cancelled", "The render was cancelled.")
+        except (queue.QueueError, queue.WorkerLostError) as e:
+            app.logger.error(f"render of {pad_id} failed: {e}")
+            return _json_error(503, "unavailable", str(e))
+        except scratch.ScratchSpaceError as e:
+            app.logger.error(str(e))
+            return flask.make_response(str(e), 507)
         except httpx.HTTPStatusError:
             if not rsp:
                 return flask.make_response("Could not obtain response from app.", 500)
             return flask.make_response(rsp.text, rsp.status_code)
-        finally:
-            for f in tmp_files:
-                try:
-                    if not f.closed:
-                        f.close()
-                    os.remove(f.name)
-                except OSError as e:
-                    app.logger.warning(f"Could not delete {f.name}: {e}")
+
+    @app.route("/pdf/<pad_id>")
+    def render_pad_pdf(pad_id: str) -> flask.Response:
+        draft = flask.request.args.get("draft", "0").lower() in _TRUTHY
+        return render_pad(pad_id, "pdf", draft=draft)
+
+    @app.route("/preview/<pad_id>")
+    def render_pad_preview(pad_id: str) -> flask.Response:
+        return render_pad(pad_id, "html")
+
+    @app.route("/prerender/<pad_id>", methods=["POST"])
+    def prerender_pad(pad_id: str) -> flask.Response:
+        # webhook for pad changes; the pad is rendered once it was left alone for a while
+        if prerenderer is None or webhook_token is None:
+            return _json_error(404, "disabled", "Pre-rendering is not enabled.")
+        authorization = flask.request.headers.get("Authorization", "")
+        if not hmac.compare_digest(authorization.encode(), f"Bearer {webhook_token}".encode()):
+            return _json_error(403, "forbidden", "Missing or wrong webhook token.")
+        if not prerenderer.notify(pad_id):
+            return _json_error(429, "busy", "Too many pads are waiting to be pre-rendered.")
+        return flask.make_response("", 202)
+
+    def bulk_export(pad_ids: list[str]) -> flask.Response:
+        output_format = flask.request.args.get("format", "pdf")
+        if output_format not in _CONTENT_TYPES:
+            return _json_error(400, "format", f"Unsupported format: {output_format}")
+        if not pad_ids:
+            return _json_error(400, "pads", "No pads given.")
+        if len(pad_ids) > bulk.MAX_PADS:
+            return _json_error(400, "pads", f"At most {bulk.MAX_PADS} pads can be exported at once.")
+        draft = flask.request.args.get("draft", "0").lower() in _TRUTHY
+        # an export is a single flow, whichever fairness is configured
+        render_batch = functools.partial(
+            render_cached, priority=scheduler.Priority.BATCH, flow=_client_id(flask.request)
+        )
+
+        def archive() -> Iterator[bytes]:
+            client = hedgedoc.HedgeDocClient()
+            try:
+                yield from bulk.stream_archive(
+                    pad_ids, client.download, render_batch, bulk_slots, output_format, draft, renders.capacity
+                )
+            finally:
+                client.close()
+
+        return flask.Response(
+            archive(),
+            mimetype="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="renderknecht.zip"'},
+        )
+
+    @app.route("/bulk", methods=["GET", "POST"])
+    def render_bulk() -> flask.Response:
+        # ?pads=id1,id2 or {"pads": [...]} or ?tag=<HedgeDoc tag> (needs HEDGEDOC_COOKIE)
+        if flask.request.is_json:
+            pad_ids = [str(pad_id) for pad_id in (flask.request.get_json(silent=True) or {}).get("pads", [])]
+        elif tag := flask.request.args.get("tag"):
+            client = hedgedoc.HedgeDocClient()
+            if not client.authenticated:
+                return _json_error(400, "tag", "Exporting by tag needs HEDGEDOC_COOKIE.")
+            try:
+                pad_ids = [entry["id"] for entry in client.history() if tag in entry.get("tags", [])]
+            except httpx.HTTPError as e:
+                return _json_error(502, "hedgedoc", f"Could not fetch the HedgeDoc history: {e}")
+            finally:
+                client.close()
+        else:
+            pad_ids = [pad_id for pad_id in flask.request.args.get("pads", "").split(",") if pad_id]
+        return bulk_export(list(dict.fromkeys(pad_ids)))
+
+    @app.route("/bulk/<index_pad_id>")
+    def render_bulk_index(index_pad_id: str) -> flask.Response:
+        # exports every pad the index pad links to
+        rsp: httpx.Response | None = None
+        try:
+            rsp = httpx.get(f"{hedgedoc.base_url()}/{index_pad_id}/download")
+            rsp.raise_for_status()
+        except httpx.HTTPStatusError:
+            if not rsp:
+                return flask.make_response("Could not obtain response from app.", 500)
+            return flask.make_response(rsp.text, rsp.status_code)
+        return bulk_export(bulk.pad_ids_from_index(rsp.text))
 
     @app.route("/hugo/<pad_id>")
     def render_pad_hugo(pad_id: str) -> flask.Response:
         rsp: httpx.Response | None = None
         try:
-            rsp = httpx.get(f"http://app:3000/{pad_id}/download")
+            rsp = httpx.get(f"{hedgedoc.base_url()}/{pad_id}/download")
             rsp.raise_for_status()
         except httpx.HTTPStatusError:
             if not rsp:
@@ -71,4 +282,62 @@ def create_app() -> Flask:
         response.headers["Content-Type"] = "text/plain; charset=utf-8"
         return response
 
+    @app.route("/hugo/<pad_id>/bundle")
+    def render_pad_hugo_bundle(pad_id: str) -> flask.Response:
+        # ?format=tar|tgz|zip; the archive holds <pad_id>/index.md and the files it links to
+        archive_format = flask.request.args.get("format", "tar")
+        if archive_format not in archive.FORMATS:
+            return _json_error(400, "format", f"Unsupported archive format: {archive_format}")
+        client = hedgedoc.HedgeDocClient()
+        try:
+            try:
+                markdown = client.download(pad_id)
+            except httpx.HTTPStatusError as e:
+                return flask.make_response(e.response.text, e.response.status_code)
+            except httpx.HTTPError:
+                return flask.make_response("Could not obtain response from app.", 500)
+            files = hugo.prepare_bundle(markdown, lambda name: hugo.find_upload(name, client))
+        except subprocess.CalledProcessError as e:
+            app.logger.error(f"diagram of {pad_id} failed: exitcode = {e.returncode}; {e.stderr}")
+            stderr = e.stderr.decode(errors="replace") if isinstance(e.stderr, bytes) else str(e.stderr or "")
+            return _json_error(
+                500, "diagram", f"Rendering a diagram failed with exit code {e.returncode}.", stderr=stderr
+            )
+        except subprocess.TimeoutExpired as e:
+            app.logger.error(f"diagram of {pad_id} timed out after {e.timeout}s")
+            return _json_error(
+                504,
+                "timeout",
+                f"Rendering a diagram took longer than {e.timeout:g} seconds.",
+                timeout=e.timeout,
+            )
+        except (httpx.HTTPError, RuntimeError) as e:
+            # the PlantUML server failed, or the local PlantUML or Graphviz is missing or crashed
+            app.logger.error(f"diagram of {pad_id} failed: {e}")
+            return _json_error(502, "diagram", f"Rendering a diagram failed: {e}")
+        finally:
+            client.close()
+        members = [(f"{pad_id}/{name}", content) for name, content in files.items()]
+        return flask.Response(
+            archive.stream_archive(members, archive_format),
+            mimetype=archive.FORMATS[archive_format],
+            headers={"Content-Disposition": f'attachment; filename="{pad_id}.{archive_format}"'},
+        )
+
+    @app.route("/readyz")
+    def ready() -> flask.Response:
+        if not readiness.ready.is_set():
+            return _json_error(503, "warming up", readiness.error or "The warm-up has not finished yet.")
+        response = flask.make_response(
+            json.dumps({"status": "ready", "warmup_seconds": readiness.seconds}), 200
+        )
+        response.headers["Content-Type"] = "application/json"
+        return response
+
+    @app.route("/metrics")
+    def metrics_endpoint() -> flask.Response:
+        response = flask.make_response(metrics.REGISTRY.exposition(), 200)
+        response.headers["Content-Type"] = metrics.CONTENT_TYPE
+        return response
+
     return app
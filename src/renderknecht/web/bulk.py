@@ -0,0 +1,175 @@
+import concurrent.futures
+import contextlib
+import functools
+import json
+import logging
+import os
+import queue
+import re
+import subprocess
+import threading
+import time
+import urllib.parse
+import zipfile
+from collections.abc import Callable, Iterator
+
+import yaml
+
+from ..util import archive as archive_util
+from ..util import hedgedoc, process
+
+# how many pads a single archive may contain
+MAX_PADS = 200
+# how many pads are downloaded at once
+_FETCH_CONCURRENCY = 8
+
+# links to other pads: [text](/id), [text](https://hedgedoc/id), [text](/s/id#section); groups 1: origin, 2: id
+_PAD_LINK_PATTERN = re.compile(r"\]\((https?://[^/\s)]+)?/(?:s/)?([\w-]+)(?:[#?][^)\s]*)?\)")
+_TITLE_PATTERN = re.compile(r"^#\s+(.+?)\s*#*\s*$", re.MULTILINE)
+_FRONT_MATTER_PATTERN = re.compile(r"^---\s*\n(.*?)\n(?:---|\.\.\.)\s*$", re.DOTALL | re.MULTILINE)
+
+_EXTENSIONS = {"pdf": "pdf", "html": "html"}
+
+Fetch = Callable[[str], str]
+Render = Callable[[str, str, bool, Callable[[], bool]], bytes]
+
+
+def render_capacity() -> int:
+    """Return how many renders may run at once, from RENDERKNECHT_RENDER_CONCURRENCY (default: CPU count)."""
+    return int(os.environ.get("RENDERKNECHT_RENDER_CONCURRENCY", 0)) or os.cpu_count() or 1
+
+
+def pad_ids_from_index(markdown: str, base_url: str | None = None) -> list[str]:
+    """Return the ids of the pads an index pad links to, in order and without duplicates.
+
+    Only relative links and links to the HedgeDoc at ``base_url`` (default:
+    :func:`~renderknecht.util.hedgedoc.base_url`) count; links to other sites are ignored.
+    """
+    origin = urllib.parse.urlsplit(base_url or hedgedoc.base_url()).netloc.lower()
+    pad_ids = (
+        pad_id
+        for link_origin, pad_id in _PAD_LINK_PATTERN.findall(markdown)
+        if not link_origin or urllib.parse.urlsplit(link_origin).netloc.lower() == origin
+    )
+    return list(dict.fromkeys(pad_ids))
+
+
+def document_title(markdown: str) -> str | None:
+    """Return the title of a document: the ``title`` of its front matter, or its first heading."""
+    if match := _FRONT_MATTER_PATTERN.match(markdown):
+        try:
+            metadata = yaml.safe_load(match.group(1))
+        except yaml.YAMLError:
+            metadata = None
+        if isinstance(metadata, dict) and metadata.get("title"):
+            return str(metadata["title"])
+    if match := _TITLE_PATTERN.search(markdown):
+        return match.group(1)
+    return None
+
+
+def _file_name(title: str | None, pad_id: str, extension: str, taken: set[str]) -> str:
+    stem = re.sub(r"[^\w.-]+", "-", title or "").strip("-.")[:80] or pad_id
+    name = f"{stem}.{extension}"
+    if name in taken:
+        name = f"{stem}-{pad_id}.{extension}"
+    taken.add(name)
+    return name
+
+
+def _error_entry(e: Exception) -> dict:
+    if isinstance(e, subprocess.CalledProcessError):
+        stderr = (e.stderr or b"").decode(errors="replace") if isinstance(e.stderr, bytes) else str(e.stderr)
+        return {"error": "render", "message": f"exit code {e.returncode}", "stderr": stderr[-4000:]}
+    if isinstance(e, subprocess.TimeoutExpired):
+        return {"error": "timeout", "message": f"rendering took longer than {e.timeout:g} seconds"}
+    return {"error": type(e).__name__, "message": str(e)}
+
+
+def stream_archive(
+    pad_ids: list[str],
+    fetch: Fetch,
+    render: Render,
+    slots: contextlib.AbstractContextManager,
+    output_format: str = "pdf",
+    draft: bool = False,
+    capacity: int | None = None,
+) -> Iterator[bytes]:
+    """Render pads and stream a ZIP archive of them.
+
+    Pads are downloaded concurrently and handed to a separate pool of
+    ``capacity`` threads (default: :func:`render_capacity`), which render them
+    as render ``slots`` become free, so slow downloads never hold up renders.  Each document is
+    added to the archive, and sent, as soon as it is finished, so the archive
+    is never held in memory as a whole.  The archive ends with
+    ``manifest.json``, listing every pad with its file or error.  When the
+    client goes away, the generator is closed and the remaining renders are
+    cancelled.
+    """
+    cancelled = threading.Event()
+    # one future per pad, once its download failed or its render finished
+    finished: queue.SimpleQueue[tuple[str, concurrent.futures.Future]] = queue.SimpleQueue()
+
+    def render_pad(markdown: str) -> tuple[str | None, bytes]:
+        with slots:
+            if cancelled.is_set():
+                raise process.RenderCancelledError("archive cancelled")
+            return document_title(markdown), render(markdown, output_format, draft, cancelled.is_set)
+
+    def fetched(pad_id: str, future: concurrent.futures.Future) -> None:
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            finished.put((pad_id, future))
+            return
+        try:
+            rendered = renderers.submit(render_pad, future.result())
+        except RuntimeError:
+            # the archive was closed meanwhile
+            return
+        rendered.add_done_callback(lambda rendered: finished.put((pad_id, rendered)))
+
+    pipe = archive_util.ChunkPipe()
+    archive = zipfile.ZipFile(pipe, "w")
+    manifest: list[dict] = []
+    taken: set[str] = {"manifest.json"}
+    started = time.monotonic()
+    fetchers = concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(len(pad_ids), _FETCH_CONCURRENCY) or 1, thread_name_prefix="bulk-fetch"
+    )
+    renderers = concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(len(pad_ids), capacity or render_capacity()) or 1, thread_name_prefix="bulk-render"
+    )
+    try:
+        for pad_id in pad_ids:
+            fetchers.submit(fetch, pad_id).add_done_callback(functools.partial(fetched, pad_id))
+        for _ in pad_ids:
+            pad_id, future = finished.get()
+            try:
+                title, document = future.result()
+            except Exception as e:
+                logging.warning("Bulk export of pad %s failed: %s", pad_id, e)
+                manifest.append({"pad": pad_id, "status": "failed", **_error_entry(e)})
+                continue
+            name = _file_name(title, pad_id, _EXTENSIONS[output_format], taken)
+            # PDFs are compressed already
+            compression = zipfile.ZIP_STORED if output_format == "pdf" else zipfile.ZIP_DEFLATED
+            archive.writestr(name, document, compress_type=compression)
+            manifest.append({"pad": pad_id, "status": "ok", "file": name, "title": title})
+            yield pipe.drain()
+
+        order = {pad_id: index for index, pad_id in enumerate(pad_ids)}
+        manifest.sort(key=lambda entry: order[entry["pad"]])
+        summary = {
+            "format": output_format,
+            "draft": draft,
+            "seconds": round(time.monotonic() - started, 1),
+            "pads": manifest,
+        }
+        archive.writestr("manifest.json", json.dumps(summary, indent=2), compress_type=zipfile.ZIP_DEFLATED)
+        archive.close()
+        yield pipe.drain()
+    finally:
+        cancelled.set()
+        fetchers.shutdown(wait=False, cancel_futures=True)
+        renderers.shutdown(wait=False, cancel_futures=True)
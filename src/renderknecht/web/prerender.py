@@ -0,0 +1,250 @@
+import contextlib
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable
+
+import httpx
+
+from ..renderers import pandoc
+from ..util import hedgedoc, render_cache
+
+_DEFAULT_POLL_INTERVAL = 30.0
+_DEFAULT_QUIET_PERIOD = 60.0
+_DEFAULT_RATE = 6.0
+# pads announced through notify() that may wait for their render at once
+_MAX_PENDING = 1000
+# how many of the most recently visited pads of the history are watched
+_HISTORY_LIMIT = 50
+# pads opened through renderknecht are watched for a day
+_WATCH_FOR = 24 * 60 * 60
+# nice value of the pre-render thread and of the pandoc/LaTeX processes it starts
+_NICENESS = 19
+
+Render = Callable[[str, str, bool], bytes]
+
+
+def _render_in_process(markdown: str, output_format: str, draft: bool) -> bytes:
+    return pandoc.render_markdown(markdown, output_format, draft=draft)
+
+
+class _RateLimiter:
+    """Token bucket allowing ``rate`` renders per minute, in bursts of up to ``rate``."""
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+
+    def acquire(self) -> bool:
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate / 60)
+        self._updated = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class PrerenderService:
+    """Renders recently edited pads in the background, so that opening their PDF hits the render cache.
+
+    Pads come from two sources: :meth:`notify`, e.g. called by a webhook, and
+    polling, which watches the pads of the HedgeDoc history (with a session
+    cookie) and the pads recently opened through renderknecht for a changed
+    ``updatetime``.  A pad is rendered once it was left alone for
+    ``quiet_period`` seconds, so pads still being edited are not rendered
+    on every keystroke, and at most ``rate`` pads are rendered per minute.
+    Renders run in a thread of their own at the lowest CPU priority.
+
+    :param client: HedgeDoc to watch.
+    :param cache: Cache to render into.
+    :param render: Renders Markdown to an output format; defaults to rendering in-process.
+    :param poll_interval: Seconds between polls; 0 disables polling.
+    :param quiet_period: Seconds a pad must be unchanged before it is rendered.
+    :param rate: Maximum renders per minute.
+    :param output_formats: Formats to pre-render.
+    :param max_pending: Maximum number of pads waiting for their render.
+    """
+
+    def __init__(
+        self,
+        client: hedgedoc.HedgeDocClient,
+        cache: render_cache.RenderCache,
+        render: Render | None = None,
+        poll_interval: float = _DEFAULT_POLL_INTERVAL,
+        quiet_period: float = _DEFAULT_QUIET_PERIOD,
+        rate: float = _DEFAULT_RATE,
+        output_formats: tuple[str, ...] = ("pdf",),
+        max_pending: int = _MAX_PENDING,
+    ) -> None:
+        self.client = client
+        self.cache = cache
+        self.render = render or _render_in_process
+        self.poll_interval = poll_interval
+        self.quiet_period = quiet_period
+        self.output_formats = output_formats
+        self.max_pending = max_pending
+        self.stop_event = threading.Event()
+        self._limiter = _RateLimiter(rate)
+        self._lock = threading.Lock()
+        # pad id -> time it becomes due for rendering
+        self._pending: dict[str, float] = {}
+        # pad id -> last seen updatetime
+        self._seen: dict[str, str] = {}
+        # pad id -> time it was last opened through renderknecht
+        self._watched: dict[str, float] = {}
+        self._thread: threading.Thread | None = None
+
+    def notify(self, pad_id: str) -> bool:
+        """Schedule a pad that was just changed; further changes push the render back.
+
+        :returns: False if ``max_pending`` pads are waiting already and the pad is not among them.
+        """
+        with self._lock:
+            if pad_id not in self._pending and len(self._pending) >= self.max_pending:
+                return False
+            self._pending[pad_id] = time.time() + self.quiet_period
+            return True
+
+    def watch(self, pad_id: str) -> None:
+        """Watch a pad for changes, e.g. because somebody opened its PDF."""
+        with self._lock:
+            self._watched[pad_id] = time.time()
+
+    def _candidates(self) -> set[str]:
+        now = time.time()
+        with self._lock:
+            for pad_id, opened in list(self._watched.items()):
+                if now - opened > _WATCH_FOR:
+                    del self._watched[pad_id]
+            candidates = set(self._watched)
+        try:
+            candidates.update(entry["id"] for entry in self.client.history()[:_HISTORY_LIMIT])
+        except (httpx.HTTPError, ValueError) as e:
+            logging.warning("Could not fetch the HedgeDoc history: %s", e)
+        return candidates
+
+    def poll(self) -> None:
+        """Schedule the watched pads whose ``updatetime`` changed since the last poll."""
+        for pad_id in self._candidates():
+            try:
+                updated = self.client.info(pad_id)["updatetime"]
+            except (httpx.HTTPError, ValueError, KeyError) as e:
+                logging.debug("Could not fetch info of pad %s: %s", pad_id, e)
+                continue
+            with self._lock:
+                previous = self._seen.get(pad_id)
+                self._seen[pad_id] = updated
+                if previous is None or previous == updated:
+                    # first sight: whatever was edited before was rendered on demand, if at all
+                    continue
+                self._pending[pad_id] = hedgedoc.parse_time(updated) + self.quiet_period
+
+    def run_pending(self) -> int:
+        """Render the pads that are due, as far as the rate limit allows.
+
+        :returns: The number of rendered pads.
+        """
+        now = time.time()
+        with self._lock:
+            due = sorted((when, pad_id) for pad_id, when in self._pending.items() if when <= now)
+        rendered = 0
+        for _, pad_id in due:
+            with self._lock:
+                if self._pending.get(pad_id, now + 1) > now:
+                    # changed again in the meantime
+                    continue
+                if self.stop_event.is_set() or not self._limiter.acquire():
+                    break
+                del self._pending[pad_id]
+            if self.prerender(pad_id):
+                rendered += 1
+        return rendered
+
+    def prerender(self, pad_id: str) -> bool:
+        """Render a pad into the cache unless it is cached already.
+
+        :returns: Whether the pad was rendered.
+        """
+        try:
+            markdown = self.client.download(pad_id)
+        except httpx.HTTPError as e:
+            logging.warning("Could not download pad %s for pre-rendering: %s", pad_id, e)
+            return False
+        rendered = False
+        for output_format in self.output_formats:
+            key = pandoc.render_cache_key(markdown, output_format)
+            if key in self.cache:
+                continue
+            started = time.monotonic()
+            try:
+                self.cache.put(key, self.render(markdown, output_format, False))
+            except Exception as e:
+                logging.warning("Pre-rendering pad %s failed: %s", pad_id, e)
+                continue
+            logging.info(
+                "Pre-rendered %s of pad %s in %.1fs", output_format, pad_id, time.monotonic() - started
+            )
+            rendered = True
+        return rendered
+
+    def _run(self) -> None:
+        with contextlib.suppress(OSError):
+            # on Linux, this lowers the priority of this thread only, and processes it starts inherit it
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), _NICENESS)
+        next_poll = 0.0
+        while not self.stop_event.is_set():
+            try:
+                if self.poll_interval and time.monotonic() >= next_poll:
+                    next_poll = time.monotonic() + self.poll_interval
+                    self.poll()
+                self.run_pending()
+            except Exception:
+                logging.exception("Pre-rendering failed")
+            self.stop_event.wait(1.0)
+
+    def start(self) -> None:
+        """Start pre-rendering in a background thread."""
+        self._thread = threading.Thread(target=self._run, name="prerender", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread; a running render is finished first."""
+        self.stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.client.close()
+
+
+def webhook_token() -> str | None:
+    """Return the secret that callers of the pre-render webhook must present, from RENDERKNECHT_PRERENDER_TOKEN.
+
+    :returns: The token, or None if the webhook is disabled because no token is configured.
+    """
+    return os.environ.get("RENDERKNECHT_PRERENDER_TOKEN") or None
+
+
+def from_env(render: Render | None = None) -> PrerenderService | None:
+    """Create the pre-render service configured by the environment, or None if it is disabled.
+
+    RENDERKNECHT_PRERENDER enables the service, which needs the render cache
+    (RENDERKNECHT_RENDER_CACHE).  RENDERKNECHT_PRERENDER_POLL (seconds, 0
+    disables polling), RENDERKNECHT_PRERENDER_QUIET (seconds) and
+    RENDERKNECHT_PRERENDER_RATE (renders per minute) tune it.
+    """
+    if os.environ.get("RENDERKNECHT_PRERENDER", "").lower() not in ("1", "true", "yes", "on"):
+        return None
+    cache = render_cache.shared_cache()
+    if cache is None:
+        logging.warning("Pre-rendering needs the render cache; set RENDERKNECHT_RENDER_CACHE")
+        return None
+    return PrerenderService(
+        hedgedoc.HedgeDocClient(),
+        cache,
+        render,
+        poll_interval=float(os.environ.get("RENDERKNECHT_PRERENDER_POLL", _DEFAULT_POLL_INTERVAL)),
+        quiet_period=float(os.environ.get("RENDERKNECHT_PRERENDER_QUIET", _DEFAULT_QUIET_PERIOD)),
+        rate=float(os.environ.get("RENDERKNECHT_PRERENDER_RATE", _DEFAULT_RATE)),
+    )
@@ -0,0 +1,281 @@
+"""Scheduling of the renders of the web service.
+
+Interactive views, bulk exports and pre-renders share the render capacity
+of the web service.  Renders wait for a slot in three priority classes;
+within a class, every flow (a client, or a pad) gets its fair share, and
+cheap documents are not stuck behind expensive ones: waiting renders are
+ordered by start-time fair queuing, with the estimated cost of a render as
+its size.
+"""
+
+import collections
+import contextlib
+import dataclasses
+import enum
+import itertools
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable, Generator
+
+from ..queue import JobQueue
+from ..renderers import pandoc
+from ..util import metrics, process
+
+_POLL_INTERVAL = 0.25
+# a waiting render moves up one priority class per minute, so that it is not starved
+_AGING = 60.0
+# cost of a render: one unit, plus one per 10 kB of Markdown, plus two per diagram
+_COST_PER_BYTE = 1 / 10_000
+_COST_PER_DIAGRAM = 2.0
+# a worker counts while its last heartbeat is younger than this, as long as workers wait before re-queueing its job
+_WORKER_TIMEOUT = 30.0
+_WORKER_POLL_INTERVAL = 5.0
+
+_DEPTH = metrics.REGISTRY.gauge("renderknecht_render_queue_depth", "Renders waiting for a slot, by priority")
+_RUNNING = metrics.REGISTRY.gauge("renderknecht_renders_running", "Renders holding a slot, by priority")
+_WAIT = metrics.REGISTRY.summary("renderknecht_render_queue_seconds", "Time renders waited for a slot")
+
+
+class Priority(enum.IntEnum):
+    """Priority classes of renders; lower values are served first."""
+
+    INTERACTIVE = 0
+    BATCH = 1
+    BACKGROUND = 2
+
+
+def estimate_cost(markdown: str) -> float:
+    """Estimate the relative cost of rendering a document from its size and number of diagrams."""
+    return (
+        1.0
+        + len(markdown) * _COST_PER_BYTE
+        + len(pandoc.DIAGRAM_PATTERN.findall(markdown)) * _COST_PER_DIAGRAM
+    )
+
+
+def fairness() -> str:
+    """Return what interactive renders are shared fairly between, from RENDERKNECHT_SCHEDULER_FAIRNESS.
+
+    :returns: ``client`` (default) or ``pad``.
+    :raises ValueError: for other values.
+    """
+    value = os.environ.get("RENDERKNECHT_SCHEDULER_FAIRNESS", "client")
+    if value not in ("client", "pad"):
+        raise ValueError(f"RENDERKNECHT_SCHEDULER_FAIRNESS must be client or pad, not {value!r}")
+    return value
+
+
+def follows_workers() -> bool:
+    """Tell whether, with a queue, the render capacity follows the number of workers.
+
+    It does unless RENDERKNECHT_RENDER_CONCURRENCY sets the capacity.
+    """
+    return not int(os.environ.get("RENDERKNECHT_RENDER_CONCURRENCY", 0))
+
+
+def worker_capacity(jobs: JobQueue) -> int:
+    """Return the number of live workers of ``jobs``, but at least one."""
+    cutoff = time.time() - _WORKER_TIMEOUT
+    return max(sum(heartbeat >= cutoff for heartbeat in jobs.workers().values()), 1)
+
+
+def track_workers(
+    jobs: JobQueue,
+    resize: Callable[[int], None],
+    interval: float = _WORKER_POLL_INTERVAL,
+    stop: threading.Event | None = None,
+) -> threading.Thread:
+    """Call ``resize`` with the :func:`worker_capacity` of ``jobs`` every ``interval`` seconds.
+
+    :param stop: Stops tracking once set.
+    :returns: The daemon thread doing so.
+    """
+    stop = stop or threading.Event()
+
+    def track() -> None:
+        while not stop.wait(interval):
+            try:
+                resize(worker_capacity(jobs))
+            except Exception as e:
+                logging.warning("Could not count the render workers: %s", e)
+
+    thread = threading.Thread(target=track, name="track-workers", daemon=True)
+    thread.start()
+    return thread
+
+
+class Slots:
+    """A semaphore whose number of slots can change, e.g. with the number of workers.
+
+    :param capacity: Number of slots.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self._used = 0
+        self._condition = threading.Condition()
+
+    def resize(self, capacity: int) -> None:
+        """Change the number of slots; holders of a slot keep it."""
+        with self._condition:
+            self.capacity = capacity
+            self._condition.notify_all()
+
+    def __enter__(self) -> None:
+        with self._condition:
+            self._condition.wait_for(lambda: self._used < self.capacity)
+            self._used += 1
+
+    def __exit__(self, *exc_info: object) -> None:
+        with self._condition:
+            self._used -= 1
+            self._condition.notify_all()
+
+
+@dataclasses.dataclass
+class _Ticket:
+    priority: Priority
+    flow: str
+    start: float
+    finish: float
+    enqueued: float
+    sequence: int
+    # finish tag of the flow before this render
+    previous: float | None = None
+    granted: bool = False
+
+
+class RenderScheduler:
+    """Hands out ``capacity`` render slots by priority, fairly between flows.
+
+    Classes are served strictly by priority, but a render that waited for
+    ``aging`` seconds competes as if it were one class higher.  When there is
+    more than one slot, batch and background renders leave one slot free for
+    interactive renders.  Within a class, every flow has a virtual clock that
+    advances by the cost of its renders, and the render that would finish
+    first on its flow's clock is served next: a client rendering large
+    documents does not hold up others, and small documents overtake large
+    ones.
+
+    :param capacity: Number of renders running at once.
+    :param aging: Seconds of waiting that raise a render by one priority class.
+    """
+
+    def __init__(self, capacity: int, aging: float = _AGING) -> None:
+        self.capacity = capacity
+        self.aging = aging
+        self._condition = threading.Condition()
+        self._waiting: list[_Ticket] = []
+        self._running: collections.Counter[Priority] = collections.Counter()
+        # virtual time of every class: the start tag of the last render it dispatched
+        self._clock: dict[Priority, float] = collections.defaultdict(float)
+        # finish tag of the last render of every flow
+        self._finish: dict[tuple[Priority, str], float] = {}
+        self._sequence = itertools.count()
+
+    def resize(self, capacity: int) -> None:
+        """Change the number of slots; running renders keep theirs."""
+        with self._condition:
+            self.capacity = capacity
+            self._dispatch()
+
+    def depth(self, priority: Priority) -> int:
+        """Return the number of renders of a class waiting for a slot."""
+        with self._condition:
+            return sum(ticket.priority is priority for ticket in self._waiting)
+
+    def running(self, priority: Priority) -> int:
+        """Return the number of renders of a class holding a slot."""
+        with self._condition:
+            return self._running[priority]
+
+    def _rank(self, ticket: _Ticket, now: float) -> tuple[int, float, int]:
+        promoted = int((now - ticket.enqueued) // self.aging) if self.aging > 0 else 0
+        return max(ticket.priority - promoted, 0), ticket.finish, ticket.sequence
+
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        while self._waiting and sum(self._running.values()) < self.capacity:
+            reserved = self.capacity > 1 and (
+                sum(self._running.values()) - self._running[Priority.INTERACTIVE] >= self.capacity - 1
+            )
+            candidates = [
+                ticket for ticket in self._waiting if not reserved or ticket.priority is Priority.INTERACTIVE
+            ]
+            if not candidates:
+                return
+            ticket = min(candidates, key=lambda ticket: self._rank(ticket, now))
+            self._waiting.remove(ticket)
+            ticket.granted = True
+            self._running[ticket.priority] += 1
+            self._clock[ticket.priority] = max(self._clock[ticket.priority], ticket.start)
+            if not any(waiting.priority is ticket.priority for waiting in self._waiting):
+                # all flows of the class are idle; their tags no longer matter
+                for key in [key for key in self._finish if key[0] is ticket.priority]:
+                    if self._finish[key] <= self._clock[ticket.priority]:
+                        del self._finish[key]
+            self._condition.notify_all()
+
+    def _enqueue(self, priority: Priority, flow: str, cost: float) -> _Ticket:
+        previous = self._finish.get((priority, flow))
+        start = max(self._clock[priority], previous or 0.0)
+        ticket = _Ticket(
+            priority, flow, start, start + cost, time.monotonic(), next(self._sequence), previous
+        )
+        self._finish[(priority, flow)] = ticket.finish
+        self._waiting.append(ticket)
+        self._dispatch()
+        return ticket
+
+    def _withdraw(self, ticket: _Ticket) -> None:
+        # a cancelled render does not count against its flow, unless later renders were queued behind it
+        key = (ticket.priority, ticket.flow)
+        if self._finish.get(key) == ticket.finish:
+            if ticket.previous is None:
+                del self._finish[key]
+            else:
+                self._finish[key] = ticket.previous
+
+    @contextlib.contextmanager
+    def slot(
+        self,
+        priority: Priority,
+        flow: str,
+        cost: float = 1.0,
+        cancelled: Callable[[], bool] | None = None,
+    ) -> Generator[None]:
+        """Wait for a render slot and hold it for the duration of the block.
+
+        :param priority: Priority class of the render.
+        :param flow: Whom the render is for, e.g. a client address or a pad ID.
+        :param cost: Estimated cost of the render (see :func:`estimate_cost`).
+        :param cancelled: Polled while waiting; the wait is given up once it returns True.
+        :raises process.RenderCancelledError: if the render is cancelled while waiting.
+        """
+        with self._condition:
+            ticket = self._enqueue(priority, flow, cost)
+            while not ticket.granted:
+                if cancelled is not None and cancelled():
+                    self._waiting.remove(ticket)
+                    self._withdraw(ticket)
+                    raise process.RenderCancelledError("cancelled while waiting for a render slot")
+                self._condition.wait(_POLL_INTERVAL)
+        _WAIT.observe(time.monotonic() - ticket.enqueued, priority=priority.name.lower())
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._running[priority] -= 1
+                self._dispatch()
+
+    def export_metrics(self) -> None:
+        """Expose the queue depth and running renders of every class in the metrics."""
+        for priority in Priority:
+            _DEPTH.set_function(
+                lambda priority=priority: self.depth(priority), priority=priority.name.lower()
+            )
+            _RUNNING.set_function(
+                lambda priority=priority: self.running(priority), priority=priority.name.lower()
+            )
@@ -0,0 +1,20 @@
+import os
+from collections.abc import Iterator
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def provide_env() -> Iterator[None]:
+    """Restore the environment after every test."""
+    orig_env = os.environ.copy()
+    yield
+    os.environ.clear()
+    os.environ.update(orig_env)
+
+
+@pytest.fixture
+def no_preamble(provide_env: None) -> None:
+    """Render without the preamble and authors of the developer's configuration."""
+    os.environ["PREAMBLE_YAML"] = "/dev/null"
+    os.environ["AUTHORS_YAML"] = "/dev/null"
@@ -1,10 +1,15 @@
 import importlib.resources
+import shutil
+import subprocess
+from pathlib import Path
 
 import pytest
 
 from renderknecht.util.pandoc_wrapper import determine_pandoc_arguments
 
 _CSL_PATH = str(importlib.resources.files("renderknecht") / "resources" / "ieee.csl")
+_DATA = Path(__file__).parent / "data"
+_LUA_FILTER_PATH = str(importlib.resources.files("renderknecht") / "resources" / "latex-environment.lua")
 
 
 def test_determine_pandoc_arguments_none() -> None:
@@ -25,8 +30,8 @@ def test_determine_pandoc_arguments_none() -> None:
         "--citeproc",
         "--csl",
         _CSL_PATH,
-        "--filter",
-        "pandoc-latex-environment",
+        "--lua-filter",
+        _LUA_FILTER_PATH,
     ]
 
 
@@ -60,8 +65,8 @@ def test_determine_pandoc_arguments_toc() -> None:
         "--citeproc",
         "--csl",
         _CSL_PATH,
-        "--filter",
-        "pandoc-latex-environment",
+        "--lua-filter",
+        _LUA_FILTER_PATH,
         "--number-sections",
         "--toc",
     ]
@@ -75,3 +80,59 @@ def test_determine_pandoc_arguments_crossref() -> None:
     # eisvogel only loads \usepackage{listings} when this variable is set
     listings_idx = args.index("listings=true")
     assert args[listings_idx - 1] == "-M"
+
+
+def test_determine_pandoc_arguments_html() -> None:
+    args = determine_pandoc_arguments({"pandoc-options": ["toc"]}, "html")
+    assert args[args.index("-t") + 1] == "html5"
+    assert "--embed-resources" in args
+    assert "eisvogel" not in args
+    assert "--lua-filter" not in args
+    assert "--citeproc" in args
+    assert "--toc" in args
+
+
+def test_determine_pandoc_arguments_draft() -> None:
+    args = determine_pandoc_arguments({"pandoc-options": ["toc"]}, draft=True, latex_environments=False)
+    assert args[args.index("-t") + 1] == "latex"
+    assert "--toc" not in args
+    assert "--number-sections" in args
+    assert "--lua-filter" not in args
+    assert args[args.index("titlepage=false") - 1] == "-M"
+    assert args[args.index("--include-in-header") + 1].endswith("draft.tex")
+
+
+@pytest.mark.skipif(shutil.which("pandoc") is None, reason="pandoc is not installed")
+def test_latex_environment_lua_filter() -> None:
+    markdown = """---
+pandoc-latex-environment:
+  info-box: [info]
+---
+::: {.info #note title="Read *this*"}
+Hello.
+:::
+
+::: other
+Untouched.
+:::
+"""
+    process = subprocess.run(
+        ["pandoc", "-t", "latex", "--lua-filter", _LUA_FILTER_PATH],  # noqa: S607
+        input=markdown.encode(),
+        capture_output=True,
+        check=True,
+    )
+    assert process.stdout.decode() == (
+        "\\begin{info-box}{Read \\emph{this}}\n\\label{note}\nHello.\n\\end{info-box}\n\nUntouched.\n"
+    )
+
+
+@pytest.mark.skipif(shutil.which("pandoc") is None, reason="pandoc is not installed")
+def test_latex_environment_lua_filter_matches_python_filter() -> None:
+    # the expected output is that of the pandoc-latex-environment Python filter 1.2.1.0 with pandoc 3.9
+    process = subprocess.run(
+        ["pandoc", "-t", "latex", "--lua-filter", _LUA_FILTER_PATH, str(_DATA / "latex-environment.md")],  # noqa: S607
+        capture_output=True,
+        check=True,
+    )
+    assert process.stdout.decode() == (_DATA / "latex-environment.tex").read_text()
@@ -0,0 +1,57 @@
+import json
+import os
+from pathlib import Path
+
+from renderknecht.util import bibliography
+
+
+def test_cited_keys() -> None:
+    markdown = "See [@doe2020, p. 3; -@roe:2021] and @{weird key}. Mail me@example.com. @last."
+    assert bibliography.cited_keys(markdown) == {"doe2020", "roe:2021", "weird key", "last"}
+
+
+def test_filter_inline_references() -> None:
+    metadata = {
+        "references": [{"id": "cited"}, {"id": "uncited"}, {"id": "listed"}],
+        "nocite": "@listed",
+    }
+    result = bibliography.filter_references(metadata, "As shown in [@cited].")
+    assert result is not None
+    assert result["references"] == [{"id": "cited"}, {"id": "listed"}]
+    assert len(metadata["references"]) == 3
+
+
+def test_filter_keeps_everything_for_nocite_all() -> None:
+    metadata = {"references": [{"id": "a"}, {"id": "b"}], "nocite": "@*"}
+    assert bibliography.filter_references(metadata, "No citations.") == metadata
+
+
+def test_filter_external_bibliography(tmp_path: Path) -> None:
+    library = tmp_path / "library.json"
+    library.write_text(json.dumps([{"id": f"key{i}", "title": f"Work {i}"} for i in range(1000)]))
+    os.environ["WORK_DIR"] = str(tmp_path)
+    scratch_dir = tmp_path / "scratch"
+    scratch_dir.mkdir()
+
+    result = bibliography.filter_references(
+        {"bibliography": ["library.json", "missing.bib"]}, "[@key7; @key42]", scratch_dir
+    )
+
+    assert result is not None
+    filtered, remaining = result["bibliography"]
+    assert remaining == "missing.bib"
+    assert json.loads(Path(filtered).read_text()) == [
+        {"id": "key7", "title": "Work 7"},
+        {"id": "key42", "title": "Work 42"},
+    ]
+
+
+def test_load_bibliography_cached_until_modified(tmp_path: Path) -> None:
+    library = tmp_path / "library.yaml"
+    library.write_text("references:\n- id: a\n")
+    first = bibliography.load_bibliography(library)
+    assert bibliography.load_bibliography(library) is first
+
+    library.write_text("references:\n- id: a\n- id: b\n")
+    os.utime(library, ns=(0, 0))
+    assert bibliography.load_bibliography(library) == [{"id": "a"}, {"id": "b"}]
@@ -0,0 +1,113 @@
+import io
+import json
+import os
+import subprocess
+import threading
+import zipfile
+from collections.abc import Callable
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from renderknecht.web import bulk, create_app
+
+
+@pytest.fixture(autouse=True)
+def scratch_root(no_preamble: None, tmp_path: Path) -> None:
+    os.environ["RENDERKNECHT_SCRATCH_DIR"] = str(tmp_path)
+
+
+PADS = {
+    "intro": "---\ntitle: Introduction\n---\nHello",
+    "usage": "# Usage\n\nRun it.",
+    "broken": "# Broken",
+}
+
+
+def fake_render(markdown: str, output_format: str, draft: bool, cancelled: Callable[[], bool]) -> bytes:
+    if "Broken" in markdown:
+        raise subprocess.CalledProcessError(43, "pandoc", b"", b"Error producing PDF.")
+    return f"%PDF {markdown}".encode()
+
+
+def test_pad_ids_from_index() -> None:
+    index = """# Release 1.0
+
+- [Introduction](/intro)
+- [Usage](https://pad.example.com/usage#install)
+- [Published](/s/published)
+- [Again](/intro)
+- ![Logo](/uploads/upload_logo.png)
+- [Docs](https://docs.example.com/usage#install)
+- [External](https://example.com/some/page)
+"""
+    assert bulk.pad_ids_from_index(index, "https://pad.example.com") == ["intro", "usage", "published"]
+    os.environ["HEDGEDOC_URL"] = "https://PAD.example.com/"
+    assert bulk.pad_ids_from_index(index) == ["intro", "usage", "published"]
+    os.environ["HEDGEDOC_URL"] = "https://docs.example.com"
+    assert bulk.pad_ids_from_index(index) == ["intro", "published", "usage"]
+
+
+def test_document_title() -> None:
+    assert bulk.document_title(PADS["intro"]) == "Introduction"
+    assert bulk.document_title(PADS["usage"]) == "Usage"
+    assert bulk.document_title("no title") is None
+
+
+def test_stream_archive() -> None:
+    chunks = list(
+        bulk.stream_archive(
+            ["intro", "usage", "broken"], PADS.__getitem__, fake_render, threading.Semaphore(2)
+        )
+    )
+    assert len(chunks) == 3  # one per rendered document, one for the manifest
+
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+    assert sorted(archive.namelist()) == ["Introduction.pdf", "Usage.pdf", "manifest.json"]
+    assert archive.read("Usage.pdf") == b"%PDF # Usage\n\nRun it."
+
+    manifest = json.loads(archive.read("manifest.json"))
+    assert [entry["pad"] for entry in manifest["pads"]] == ["intro", "usage", "broken"]
+    assert manifest["pads"][2]["status"] == "failed"
+    assert manifest["pads"][2]["stderr"] == "Error producing PDF."
+
+
+def test_stream_archive_renders_up_to_capacity() -> None:
+    # more renders than downloads run at once; each render waits for all others to start
+    os.environ["RENDERKNECHT_RENDER_CONCURRENCY"] = "10"
+    pad_ids = [f"pad-{index}" for index in range(10)]
+    barrier = threading.Barrier(len(pad_ids), timeout=5)
+
+    def render(markdown: str, output_format: str, draft: bool, cancelled: Callable[[], bool]) -> bytes:
+        barrier.wait()
+        return markdown.encode()
+
+    chunks = list(bulk.stream_archive(pad_ids, lambda pad_id: f"# {pad_id}", render, threading.Semaphore(10)))
+    manifest = json.loads(zipfile.ZipFile(io.BytesIO(b"".join(chunks))).read("manifest.json"))
+    assert [entry["status"] for entry in manifest["pads"]] == ["ok"] * len(pad_ids)
+
+
+def test_stream_archive_reports_missing_pads() -> None:
+    chunks = list(bulk.stream_archive(["missing"], PADS.__getitem__, fake_render, threading.Semaphore(1)))
+    manifest = json.loads(zipfile.ZipFile(io.BytesIO(b"".join(chunks))).read("manifest.json"))
+    assert manifest["pads"] == [
+        {"pad": "missing", "status": "failed", "error": "KeyError", "message": "'missing'"}
+    ]
+
+
+@patch("renderknecht.web.pandoc.render_markdown")
+@patch("renderknecht.util.hedgedoc.HedgeDocClient.download")
+def test_bulk_endpoint(download: MagicMock, render_markdown: MagicMock) -> None:
+    download.side_effect = PADS.__getitem__
+    render_markdown.side_effect = lambda markdown, output_format, draft, supervisor: markdown.encode()
+    client = create_app().test_client()
+
+    response = client.get("/bulk?pads=intro,usage&format=html")
+    assert response.status_code == 200
+    assert response.mimetype == "application/zip"
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert sorted(archive.namelist()) == ["Introduction.html", "Usage.html", "manifest.json"]
+
+    assert client.get("/bulk").status_code == 400
+    assert client.get("/bulk?pads=intro&format=docx").status_code == 400
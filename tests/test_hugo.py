@@ -0,0 +1,162 @@
+import io
+import subprocess
+import tarfile
+import zipfile
+from collections.abc import Iterator
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import httpx
+import pytest
+
+from renderknecht.renderers import hugo
+from renderknecht.util import archive
+from renderknecht.web import create_app
+
+_PAD = """---
+title: Hello
+---
+
+![Logo](/uploads/logo.png) and ![Missing](https://pad.example.org/uploads/missing.png)
+
+```graphviz [A graph|width=30%]
+digraph { a -> b }
+```
+"""
+
+
+pytestmark = pytest.mark.usefixtures("no_preamble")
+
+
+@pytest.fixture
+def uploads(tmp_path: Path) -> Iterator[Path]:
+    (tmp_path / "logo.png").write_bytes(b"PNG")
+    with patch("renderknecht.renderers.pandoc._UPLOADS_DIR", tmp_path):
+        yield tmp_path
+
+
+_TABLE = "| a | b |\n|---|---|\n| 1 | 2 |\n"
+_ALIGNED_TABLE = "| Left | Right |\n|:-----|------:|\n| 1    | 2     |\n"
+
+
+@pytest.mark.parametrize(
+    ("markdown", "expected"),
+    [
+        (
+            f"{_TABLE}\nTable: Numbers\n",
+            f'{{{{< table title="Numbers" >}}}}\n{_TABLE}\n{{{{< /table >}}}}\n',
+        ),
+        (
+            f"{_TABLE}\nTable:Numbers  ",
+            f'{{{{< table title="Numbers" >}}}}\n{_TABLE}\n{{{{< /table >}}}}',
+        ),
+        (
+            f'# Heading\n\nIntro.\n\n{_ALIGNED_TABLE}\nTable: The "best" numbers\n\nMore text.\n',
+            f"# Heading\n\nIntro.\n\n"
+            f'{{{{< table title="The "best" numbers" >}}}}\n{_ALIGNED_TABLE}\n{{{{< /table >}}}}\n\n'
+            "More text.\n",
+        ),
+        (
+            f"{_TABLE}\nTable: One\n\nText.\n\n{_ALIGNED_TABLE}\nTable: Two\n",
+            f'{{{{< table title="One" >}}}}\n{_TABLE}\n{{{{< /table >}}}}\n\nText.\n\n'
+            f'{{{{< table title="Two" >}}}}\n{_ALIGNED_TABLE}\n{{{{< /table >}}}}\n',
+        ),
+        (f"{_TABLE}\nText.\n", f"{_TABLE}\nText.\n"),
+    ],
+)
+def test_transform_markdown_tables(markdown: str, expected: str) -> None:
+    assert hugo.transform_markdown_tables(markdown) == expected
+
+
+def test_transform_markdown_tables_keeps_uncaptioned_tables() -> None:
+    # the caption of the second table belongs to it, not to the first one with the text in between
+    markdown = f"{_TABLE}\nText.\n\n{_ALIGNED_TABLE}\nTable: Two\n"
+    assert hugo.transform_markdown_tables(markdown) == (
+        f'{_TABLE}\nText.\n\n{{{{< table title="Two" >}}}}\n{_ALIGNED_TABLE}\n{{{{< /table >}}}}\n'
+    )
+    # many tables without captions used to take exponential time
+    uncaptioned = f"{_TABLE}\nText.\n\n" * 30
+    assert hugo.transform_markdown_tables(uncaptioned) == uncaptioned
+
+
+@patch("renderknecht.renderers.pandoc.render_diagram", return_value="<svg/>")
+def test_prepare_bundle_links_files_relatively(render_diagram: MagicMock, uploads: Path) -> None:
+    files = hugo.prepare_bundle(_PAD, hugo.find_upload)
+
+    assert list(files)[0] == "index.md"
+    assert isinstance(index_md := files["index.md"], bytes)
+    index = index_md.decode()
+    svg = next(name for name in files if name.endswith(".svg"))
+    assert svg.startswith("graphviz-")
+    assert files[svg] == b"<svg/>"
+    assert f"![A graph]({svg}){{ width=30% }}" in index
+    assert "![Logo](logo.png)" in index
+    assert files["logo.png"] == uploads / "logo.png"
+    # uploads that cannot be found keep their link
+    assert "https://pad.example.org/uploads/missing.png" in index
+    render_diagram.assert_called_once_with("graphviz", "digraph { a -> b }\n")
+
+
+@pytest.mark.parametrize("archive_format", ["tar", "tgz", "zip"])
+def test_stream_archive_round_trip(archive_format: str, tmp_path: Path) -> None:
+    (tmp_path / "logo.png").write_bytes(b"PNG")
+    members: list[archive.ArchiveMember] = [
+        ("pad/index.md", b"# Hello"),
+        ("pad/logo.png", tmp_path / "logo.png"),
+    ]
+    data = b"".join(archive.stream_archive(members, archive_format))
+
+    if archive_format == "zip":
+        with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+            contents = {name: zip_file.read(name) for name in zip_file.namelist()}
+    else:
+        contents = {}
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar_file:
+            for member in tar_file.getmembers():
+                assert (extracted := tar_file.extractfile(member)) is not None
+                contents[member.name] = extracted.read()
+    assert contents == {"pad/index.md": b"# Hello", "pad/logo.png": b"PNG"}
+
+
+@patch("renderknecht.renderers.pandoc.render_diagram", return_value="<svg/>")
+@patch("renderknecht.util.hedgedoc.HedgeDocClient")
+def test_bundle_endpoint(client_class: MagicMock, render_diagram: MagicMock, uploads: Path) -> None:
+    client_class.return_value.download.return_value = _PAD
+    client_class.return_value.upload.return_value = b"remote"
+    client = create_app().test_client()
+
+    response = client.get("/hugo/notes/bundle?format=zip")
+    assert response.status_code == 200
+    assert response.mimetype == "application/zip"
+    assert 'filename="notes.zip"' in response.headers["Content-Disposition"]
+    with zipfile.ZipFile(io.BytesIO(response.data)) as zip_file:
+        names = zip_file.namelist()
+        assert zip_file.read("notes/missing.png") == b"remote"
+    assert names[0] == "notes/index.md"
+    assert "notes/logo.png" in names
+    client_class.return_value.upload.assert_called_once_with("missing.png")
+
+    assert client.get("/hugo/notes/bundle?format=rar").status_code == 400
+
+
+@pytest.mark.parametrize(
+    ("error", "status"),
+    [
+        (subprocess.CalledProcessError(1, "dot", b"", b"syntax error"), 500),
+        (subprocess.TimeoutExpired("plantuml", 10), 504),
+        (httpx.HTTPStatusError("", request=MagicMock(), response=MagicMock(status_code=400)), 502),
+    ],
+)
+@patch("renderknecht.renderers.pandoc.render_diagram")
+@patch("renderknecht.util.hedgedoc.HedgeDocClient")
+def test_bundle_endpoint_reports_diagram_errors(
+    client_class: MagicMock, render_diagram: MagicMock, uploads: Path, error: Exception, status: int
+) -> None:
+    client_class.return_value.download.return_value = _PAD
+    render_diagram.side_effect = error
+
+    response = create_app().test_client().get("/hugo/notes/bundle")
+    assert response.status_code == status
+    assert (body := response.json) is not None
+    assert body["error"] in ("diagram", "timeout")
+    client_class.return_value.close.assert_called_once()
@@ -0,0 +1,144 @@
+import os
+import threading
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from renderknecht.renderers import pandoc
+from renderknecht.util import image_cache
+
+_PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256))
+
+
+class StubImageHost:
+    """Serves images with an ETag and configurable caching headers, counting the requests."""
+
+    def __init__(self) -> None:
+        self.images: dict[str, bytes] = {"/logo.png": _PNG, "/large.png": _PNG * 64}
+        self.cache_control = "max-age=3600"
+        self.failing = False
+        self.requests: list[tuple[str, str | None]] = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:  # noqa: N802 (http.server API)
+                stub.requests.append((self.path, self.headers.get("If-None-Match")))
+                if stub.failing:
+                    return self._send(503, {}, b"")
+                if self.path == "/moved.png":
+                    return self._send(302, {"Location": "http://localhost.invalid/logo.png"}, b"")
+                if self.path not in stub.images:
+                    return self._send(404, {"Content-Type": "text/plain"}, b"Not found")
+                etag = f'"{len(stub.images[self.path])}"'
+                headers = {"ETag": etag, "Cache-Control": stub.cache_control, "Content-Type": "image/png"}
+                if self.headers.get("If-None-Match") == etag:
+                    return self._send(304, headers, b"")
+                return self._send(200, headers, stub.images[self.path])
+
+            def _send(self, status: int, headers: dict[str, str], body: bytes) -> None:
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: object) -> None:  # noqa: A002 (http.server API)
+                pass
+
+        return Handler
+
+
+@pytest.fixture
+def stub() -> Iterator[StubImageHost]:
+    stub = StubImageHost()
+    stub.thread.start()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
+
+
+@pytest.fixture
+def cache(tmp_path: Path) -> Iterator[image_cache.ImageCache]:
+    cache = image_cache.ImageCache(tmp_path / "images", max_image_size=1024, allow=["127.0.0.1"])
+    yield cache
+    cache.close()
+
+
+def test_mirror_images(stub: StubImageHost, cache: image_cache.ImageCache, tmp_path: Path) -> None:
+    markdown = (
+        f"![Logo]({stub.url}/logo.png){{width=50%}}\n\n"
+        f'<img src="{stub.url}/logo.png" alt="Logo">\n\n'
+        f"![Again](<{stub.url}/logo.png>)\n"
+    )
+    render_dir = tmp_path / "render"
+    render_dir.mkdir()
+
+    mirrored = image_cache.mirror_images(markdown, cache, render_dir)
+
+    cached = next((cache.directory / "objects").glob("*.png"))
+    path = render_dir / cached.name
+    assert path.read_bytes() == _PNG
+    assert mirrored == (
+        f'![Logo]({path}){{width=50%}}\n\n<img src="{path}" alt="Logo">\n\n![Again](<{path}>)\n'
+    )
+    assert stub.requests == [("/logo.png", None)]
+    # fresh according to Cache-Control
+    assert image_cache.mirror_images(markdown, cache, render_dir) == mirrored
+    assert len(stub.requests) == 1
+
+    # evicting the image does not take it away from the render
+    cached.unlink()
+    assert path.read_bytes() == _PNG
+
+
+def test_revalidates_stale_images(stub: StubImageHost, cache: image_cache.ImageCache) -> None:
+    stub.cache_control = "no-cache"
+    path = cache.fetch(f"{stub.url}/logo.png")
+
+    assert cache.fetch(f"{stub.url}/logo.png") == path
+    assert stub.requests == [("/logo.png", None), ("/logo.png", f'"{len(_PNG)}"')]
+
+    stub.failing = True
+    assert cache.fetch(f"{stub.url}/logo.png") == path
+
+
+def test_refuses_images(stub: StubImageHost, cache: image_cache.ImageCache, tmp_path: Path) -> None:
+    markdown = (
+        f"![Large]({stub.url}/large.png)\n"
+        "![Elsewhere](http://localhost.invalid/logo.png)\n"
+        f"![Moved]({stub.url}/moved.png)\n"
+        f"![Missing]({stub.url}/missing.png)\n"
+        '<img alt="Other" src="http://localhost.invalid/other.png" width="10">\n'
+    )
+
+    assert image_cache.mirror_images(markdown, cache, tmp_path) == (
+        f"[Large]({stub.url}/large.png)\n"
+        "[Elsewhere](http://localhost.invalid/logo.png)\n"
+        f"[Moved]({stub.url}/moved.png)\n"
+        f"[Missing]({stub.url}/missing.png)\n"
+        '<a href="http://localhost.invalid/other.png">Other</a>\n'
+    )
+    assert sorted(path for path, _ in stub.requests) == ["/large.png", "/missing.png", "/moved.png"]
+
+
+def test_prepare_markdown_mirrors_images(stub: StubImageHost, tmp_path: Path) -> None:
+    os.environ["PREAMBLE_YAML"] = "/dev/null"
+    os.environ["AUTHORS_YAML"] = "/dev/null"
+    markdown = f"![Logo]({stub.url}/logo.png)\n"
+
+    os.environ.pop("RENDERKNECHT_IMAGE_CACHE", None)
+    assert pandoc.mirror_remote_images(markdown, tmp_path) == markdown
+
+    os.environ["RENDERKNECHT_IMAGE_CACHE"] = str(tmp_path / "images")
+    prepared, _ = pandoc.prepare_markdown(markdown, tmp_path)
+    cached = next((tmp_path / "images" / "objects").glob("*.png"))
+    assert prepared == f"![Logo]({tmp_path / cached.name})\n"
+    assert not pandoc._REMOTE_IMAGE_PATTERN.search(prepared)
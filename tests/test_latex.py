@@ -0,0 +1,166 @@
+import io
+import re
+import sys
+from pathlib import Path
+
+import pytest
+
+from renderknecht.util import latex
+
+pikepdf = pytest.importorskip("pikepdf")
+
+_DOCUMENT = rb"""\documentclass{article}
+\begin{document}
+\maketitle
+\tableofcontents
+\section{One}\label{one}
+See section \ref{three}.
+\subsection{One.a}
+\hypertarget{two}{%
+\section{Two}\label{two}}
+\section{Three}\label{three}
+\end{document}
+"""
+
+# Stands in for pdflatex: typesets a front matter of two pages (three once the TOC
+# exists), then the body, where sections share a page until a \clearpage or the
+# start of an included chunk.  Chunks continue the page numbers of the chunk before,
+# and the auxiliary files are written as LaTeX would.
+_FAKE_LATEX = r"""
+import pathlib, re
+import pikepdf
+
+main = pathlib.Path("document.tex").read_text()
+names = re.findall(r"\\include\{([^}]*)\}", main)
+only = re.search(r"\\includeonly\{([^}]*)\}", main)
+included = names if only is None else [name for name in only.group(1).split(",") if name]
+toc = pathlib.Path("document.toc")
+front = 3 if toc.exists() else 2
+marker = r"\gdef\renderknechtbodypage{%d}" % (front + 1)
+pathlib.Path("document.aux").write_text(marker + "".join(r"\@input{%s.aux}" % name for name in names))
+
+document = pikepdf.new()
+for _ in range(front):
+    document.add_blank_page()
+destinations = {}
+
+
+def typeset(text, page):
+    pages = [[]]
+    for command, title in re.findall(r"\\(clearpage|section)(?:\{([^}]*)\})?", text):
+        if command == "section":
+            pages[-1].append(title)
+        elif pages[-1]:
+            pages.append([])
+    entries = []
+    for titles in filter(None, pages):
+        page += 1
+        document.add_blank_page()
+        for title in titles:
+            destinations["section." + title] = len(document.pages) - 1
+            entries.append(r"\contentsline {section}{%s}{%d}{section.%s}" % (title, page, title))
+    return page, entries
+
+
+page = front
+entries = []
+if not names:
+    page, entries = typeset(main.split(r"\begin{document}")[1], page)
+for name in names:
+    aux = pathlib.Path(name + ".aux")
+    if name in included:
+        page, chunk_entries = typeset(pathlib.Path(name + ".tex").read_text(), page)
+        lines = [r"\@writefile{toc}{%s}" % entry for entry in chunk_entries]
+        lines.append(r"\setcounter{page}{%d}" % (page + 1))
+        aux.write_text("\n".join(lines))
+    else:
+        page = int(re.search(r"\\setcounter\{page\}\{(\d+)\}", aux.read_text()).group(1)) - 1
+    entries += re.findall(r"\\contentsline .*\}(?=\}$)", aux.read_text(), re.MULTILINE)
+toc.write_text("\n".join(entries))
+
+tree = pikepdf.NameTree.new(document)
+for destination, index in destinations.items():
+    tree[destination] = pikepdf.Array([document.pages[index].obj, pikepdf.Name.Fit])
+document.Root.Names = pikepdf.Dictionary(Dests=tree.obj)
+document.save("document.pdf")
+print("Output written on document.pdf (%d pages, 1 bytes)." % len(document.pages))
+"""
+
+
+@pytest.fixture
+def fake_latex(tmp_path: Path) -> str:
+    script = tmp_path / "fake-latex"
+    script.write_text(f"#!{sys.executable}\n{_FAKE_LATEX}")
+    script.chmod(0o755)
+    return str(script)
+
+
+def test_split_document() -> None:
+    split = latex.split_document(_DOCUMENT, 2)
+
+    assert split is not None
+    assert split.front == b"\n\\maketitle\n\\tableofcontents\n"
+    assert len(split.chunks) == 2
+    assert split.chunks[0].startswith(b"\\section{One}")
+    assert b"\\subsection{One.a}" in split.chunks[0]
+    # no page break between the sections of a chunk
+    assert b"\\subsection{One.a}\n\\hypertarget{two}{%\n\\section{Two}" in split.chunks[0]
+    assert split.chunks[1].startswith(b"\\section{Three}")
+
+    document = split.document(include_only=["chunk-2"])
+    assert document.startswith(b"\\documentclass{article}\n\\includeonly{chunk-2}\n\\begin{document}")
+    assert b"\\include{chunk-1}\n\\include{chunk-2}\n\\end{document}" in document
+
+
+def test_split_document_needs_two_sections() -> None:
+    assert latex.split_document(b"\\begin{document}\n\\section{One}\n\\end{document}", 4) is None
+    assert latex.split_document(_DOCUMENT, 1) is None
+
+
+def test_shift_pages() -> None:
+    aux = (
+        b"\\newlabel{three}{{3}{5}{Three}{section.3}{}}\n"
+        b"\\@writefile{toc}{\\contentsline {section}{\\numberline {3}Three}{5}{section.3}}\n"
+        b"\\@writefile{toc}{\\contentsline {section}{Roman}{iv}{section.4}}\n"
+        b"\\setcounter{page}{6}\n"
+        b"\\setcounter{section}{3}\n"
+    )
+    assert latex.shift_pages(aux, 2) == (
+        b"\\newlabel{three}{{3}{7}{Three}{section.3}{}}\n"
+        b"\\@writefile{toc}{\\contentsline {section}{\\numberline {3}Three}{7}{section.3}}\n"
+        b"\\@writefile{toc}{\\contentsline {section}{Roman}{iv}{section.4}}\n"
+        b"\\setcounter{page}{8}\n"
+        b"\\setcounter{section}{3}\n"
+    )
+
+
+def test_run_latex_parallel(fake_latex: str, tmp_path: Path) -> None:
+    work_dir = tmp_path / "latex"
+    result = latex.run_latex_parallel(_DOCUMENT, 2, engine=fake_latex, work_dir=work_dir)
+
+    with pikepdf.open(io.BytesIO(result)) as document:
+        pages = [page.obj.objgen for page in document.pages]
+        destinations = {
+            name: pages.index(destination[0].objgen)
+            for name, destination in pikepdf.NameTree(document.Root.Names.Dests).items()
+        }
+    # three pages of front matter, then a page per chunk, whose sections share it
+    assert len(pages) == 5
+    assert destinations == {"section.One": 3, "section.Two": 3, "section.Three": 4}
+    # the TOC grew by a page after the first pass, so the recorded page numbers moved on
+    toc = (work_dir / "chunk-2" / "document.toc").read_text()
+    assert re.findall(r"\{(\d+)\}\{section", toc) == ["4", "4", "5"]
+
+
+def test_run_latex_parallel_keeps_the_pages_of_the_serial_render(fake_latex: str, tmp_path: Path) -> None:
+    # the chunk boundary falls on a page break of the document
+    tex = (
+        b"\\documentclass{article}\n\\begin{document}\n\\tableofcontents\n"
+        b"\\section{One}\nText.\n\\section{Two}\nText.\n\\clearpage\n"
+        b"\\section{Three}\nText.\n\\section{Four}\nText.\n\\end{document}\n"
+    )
+    serial = latex.run_latex(tex, passes=3, engine=fake_latex, work_dir=tmp_path / "serial")
+    parallel = latex.run_latex_parallel(tex, 2, engine=fake_latex, work_dir=tmp_path / "parallel")
+
+    with pikepdf.open(io.BytesIO(serial)) as serial_document, pikepdf.open(io.BytesIO(parallel)) as document:
+        assert len(document.pages) == len(serial_document.pages) == 5
@@ -0,0 +1,78 @@
+import math
+import os
+import random
+
+import httpx
+import pytest
+
+from renderknecht import loadtest
+
+pytestmark = pytest.mark.usefixtures("no_preamble")
+
+
+def test_parse_mix() -> None:
+    assert loadtest.parse_mix("pdf=8, hugo=2,preview") == {"pdf": 8.0, "hugo": 2.0, "preview": 1.0}
+    with pytest.raises(ValueError, match="docx"):
+        loadtest.parse_mix("docx=1")
+    with pytest.raises(ValueError, match="empty"):
+        loadtest.parse_mix("pdf=0")
+
+
+def test_plan() -> None:
+    requests = loadtest.plan(["a", "b"], {"pdf": 1, "hugo": 1}, 0.5, 200, random.Random(1))  # noqa: S311
+
+    unique = [pad_id for _, pad_id in requests if pad_id.startswith("unique-")]
+    assert 60 < len(unique) < 140
+    assert len(set(unique)) == len(unique)
+    assert {endpoint for endpoint, _ in requests} == {"pdf", "hugo"}
+
+
+def test_summarize() -> None:
+    results = [loadtest.Result("pdf", 200, seconds / 100) for seconds in range(1, 101)]
+    results += [loadtest.Result("hugo", 502, 1.0), loadtest.Result("hugo", 0, 2.0)]
+
+    summary = loadtest.summarize(results, 10.0)
+
+    assert list(summary) == ["hugo", "pdf", "all"]
+    assert summary["pdf"]["p50"] == 0.5
+    assert summary["pdf"]["p95"] == 0.95
+    assert summary["pdf"]["p99"] == 0.99
+    assert summary["pdf"]["error_rate"] == 0.0
+    assert summary["hugo"]["error_rate"] == 1.0
+    assert summary["all"]["throughput"] == 10.2
+
+
+def test_summarize_without_results() -> None:
+    summary = loadtest.summarize([], 0.0)
+
+    assert list(summary) == ["all"]
+    assert summary["all"]["requests"] == 0
+    assert summary["all"]["error_rate"] == 0.0
+    assert summary["all"]["throughput"] == 0.0
+    assert math.isnan(summary["all"]["p99"])
+    assert "nan" in loadtest.format_report(summary, {}, 0.0)
+
+
+def test_stub_hedgedoc() -> None:
+    stub = loadtest.StubHedgeDoc({"pad": "# Pad\n"})
+    stub.start()
+    try:
+        assert httpx.get(f"{stub.url}/pad/download").text == "# Pad\n"
+        assert httpx.get(f"{stub.url}/unique-7/download").text == "# Pad\n\n<!-- unique-7 -->\n"
+        assert httpx.get(f"{stub.url}/other/download").status_code == 404
+    finally:
+        stub.stop()
+
+
+def test_run() -> None:
+    corpus = loadtest.synthetic_corpus(4, 3)
+    mix = {"pdf": 2.0, "preview": 1.0, "hugo": 1.0}
+
+    report = loadtest.run(corpus, mix, 12, 3, unique=0.5, stub_pandoc=(0.0, 0.0), seed=1)
+
+    summary = report["summary"]
+    assert summary["all"]["requests"] == 12
+    assert summary["all"]["errors"] == 0
+    assert summary["all"]["p99"] >= summary["all"]["p50"] > 0
+    if os.path.exists("/proc/self/statm"):
+        assert report["peak_rss"]["web"] > 0
@@ -0,0 +1,31 @@
+from renderknecht.util import metrics
+from renderknecht.web import create_app
+
+
+def test_exposition() -> None:
+    registry = metrics.Registry()
+    registry.counter("renders", "Renders").inc(output_format="pdf")
+    registry.counter("renders", "Renders").inc(2, output_format="pdf")
+    registry.gauge("depth", "Queue depth").set_function(lambda: 3, priority='a"b')
+    registry.summary("seconds", "Render time").observe(1.5)
+
+    assert registry.exposition() == (
+        "# HELP renders Renders\n"
+        "# TYPE renders counter\n"
+        'renders_total{output_format="pdf"} 3.0\n'
+        "# HELP depth Queue depth\n"
+        "# TYPE depth gauge\n"
+        'depth{priority="a\\"b"} 3.0\n'
+        "# HELP seconds Render time\n"
+        "# TYPE seconds summary\n"
+        "seconds_count 1.0\n"
+        "seconds_sum 1.5\n"
+    )
+
+
+def test_metrics_endpoint() -> None:
+    metrics.REGISTRY.counter("renderknecht_test_requests", "Test").inc()
+    response = create_app().test_client().get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    assert "renderknecht_test_requests_total 1.0" in response.text
@@ -1,6 +1,6 @@
 import datetime
 import os
-from collections.abc import Iterator
+import re
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
@@ -14,62 +14,55 @@ _CREATOR_BLOCK = (
 )
 
 
+def embedded_svgs(markdown: str, directory: Path) -> list[str]:
+    svgs = re.findall(r"\]\(([^)]*\.svg)\)", markdown)
+    assert all(Path(svg).parent == directory and Path(svg).exists() for svg in svgs)
+    return svgs
+
+
 @pytest.fixture(scope="session", autouse=True)
 def configure_yaml() -> None:
     yaml.configure()
 
 
-@pytest.fixture(scope="function", autouse=True)
-def provide_env() -> Iterator[None]:
-    orig_env = os.environ.copy()
-    yield
-    os.environ.clear()
-    os.environ.update(orig_env)
-
-
-def test_augment_yaml_preamble_injects_pdfcreator(monkeypatch: pytest.MonkeyPatch) -> None:
+def test_augment_yaml_preamble_injects_pdfcreator(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
     """Creator \\hypersetup block is always appended to header-includes."""
     monkeypatch.setattr(
         pandoc, "_CREATOR", "renderknecht testhash (https://github.com/Embedded-Focus/renderknecht/)"
     )
     os.environ["PREAMBLE_YAML"] = "/dev/null"
-    tmp_files: pandoc.TemporaryFiles = []
-    _, metadata = pandoc.prepare_markdown("---\ntitle: test\n---\n", tmp_files)
+    _, metadata = pandoc.prepare_markdown("---\ntitle: test\n---\n", tmp_path)
     assert metadata is not None
     header_includes = metadata.get("header-includes", [])
     assert any("pdfcreator" in entry for entry in header_includes)
     assert any("renderknecht testhash" in entry for entry in header_includes)
 
 
-def test_embed_images_skips_rewrite_when_not_mounted() -> None:
-    tmp_files: pandoc.TemporaryFiles = []
-    markdown, metadata = pandoc.prepare_markdown("some text", tmp_files)
+def test_embed_images_skips_rewrite_when_not_mounted(tmp_path: Path) -> None:
+    markdown, metadata = pandoc.prepare_markdown("some text", tmp_path)
     assert markdown == "some text"
     assert not metadata
-    assert not tmp_files
+    assert not any(tmp_path.iterdir())
 
 
 def test_embed_images_rewrites_uploads_url(tmp_path: Path) -> None:
     with patch("renderknecht.renderers.pandoc._UPLOADS_DIR", tmp_path):
-        tmp_files: pandoc.TemporaryFiles = []
         markdown, metadata = pandoc.prepare_markdown(
             "foo https://hedgedoc.example.com/uploads/image.png bar",
-            tmp_files,
+            tmp_path,
         )
     assert markdown == f"foo {tmp_path}/image.png bar"
     assert not metadata
-    assert not tmp_files
+    assert not any(tmp_path.iterdir())
 
 
-def test_embed_graphviz_empty() -> None:
-    tmp_files: pandoc.TemporaryFiles = []
-    markdown = pandoc.embed_diagrams("""Hello, World!""", tmp_files)
+def test_embed_graphviz_empty(tmp_path: Path) -> None:
+    markdown = pandoc.embed_diagrams("""Hello, World!""", tmp_path)
     assert markdown == "Hello, World!"
-    assert not tmp_files
+    assert not any(tmp_path.iterdir())
 
 
-def test_embed_graphviz() -> None:
-    tmp_files: pandoc.TemporaryFiles = []
+def test_embed_graphviz(tmp_path: Path) -> None:
     result = pandoc.embed_diagrams(
         """Hello,
 ```graphviz
@@ -90,44 +83,45 @@ digraph G {
 ```
 o.m.g.
 """,
-        tmp_files,
+        tmp_path,
     )
+    svgs = embedded_svgs(result, tmp_path)
     assert (
         result
         == f"""Hello,
 
-![]({tmp_files[0].name})
+![]({svgs[0]})
 
 
-![]({tmp_files[1].name})
+![]({svgs[1]})
 o.m.g.
 """
     )
 
 
-def test_embed_graphviz_caption() -> None:
-    tmp_files: pandoc.TemporaryFiles = []
+def test_embed_graphviz_caption(tmp_path: Path) -> None:
     result = pandoc.embed_diagrams(
         """Hello,
 ```graphviz [asdf]
 digraph "the holy hand grenade" { rankdir=LR; 1 -> 2 -> 3 -> lob }
 ```
 """,
-        tmp_files,
+        tmp_path,
     )
 
+    svgs = embedded_svgs(result, tmp_path)
     assert (
         result
         == f"""Hello,
 
-![asdf]({tmp_files[0].name})
+![asdf]({svgs[0]})
 """
     )
 
 
+@patch("renderknecht.renderers.pandoc.plantuml.shared_pipe", return_value=None)
 @patch("renderknecht.renderers.pandoc.httpx.get")
-def test_embed_plantuml(get: MagicMock) -> None:
-    tmp_files: pandoc.TemporaryFiles = []
+def test_embed_plantuml(get: MagicMock, shared_pipe: MagicMock, tmp_path: Path) -> None:
     response = get.return_value
     response.text = "I am a little teapot"
 
@@ -136,21 +130,22 @@ def test_embed_plantuml(get: MagicMock) -> None:
 ```plantuml [qwer]
 ```
 """,
-        tmp_files,
+        tmp_path,
     )
 
+    svgs = embedded_svgs(result, tmp_path)
     assert (
         result
         == f"""Hello,
 
-![qwer]({tmp_files[0].name})
+![qwer]({svgs[0]})
 """
     )
 
 
+@patch("renderknecht.renderers.pandoc.plantuml.shared_pipe", return_value=None)
 @patch("renderknecht.renderers.pandoc.httpx.get")
-def test_embed_plantuml_with_formatting(get: MagicMock) -> None:
-    tmp_files: pandoc.TemporaryFiles = []
+def test_embed_plantuml_with_formatting(get: MagicMock, shared_pipe: MagicMock, tmp_path: Path) -> None:
     response = get.return_value
     response.text = "I am a little teapot"
 
@@ -159,38 +154,37 @@ def test_embed_plantuml_with_formatting(get: MagicMock) -> None:
 ```plantuml [qwer|height=90%]
 ```
 """,
-        tmp_files,
+        tmp_path,
     )
 
+    svgs = embedded_svgs(result, tmp_path)
     assert (
         result
         == f"""Hello,
 
-![qwer]({tmp_files[0].name}){{ height=90% }}
+![qwer]({svgs[0]}){{ height=90% }}
 """
     )
 
 
-def test_extract_yaml_metadata() -> None:
+def test_extract_yaml_metadata(tmp_path: Path) -> None:
     os.environ["PREAMBLE_YAML"] = "/dev/null"
-    tmp_files: pandoc.TemporaryFiles = []
     markdown, metadata = pandoc.prepare_markdown(
         """---
 ---
 # Hello, World!
 """,
-        tmp_files,
+        tmp_path,
     )
 
     assert "# Hello, World!" in markdown
     assert "pdfcreator" in markdown
     assert metadata == {"header-includes": [_CREATOR_BLOCK]}
-    assert not tmp_files
+    assert not any(tmp_path.iterdir())
 
 
-def test_extract_yaml_metadata_multiline_string() -> None:
+def test_extract_yaml_metadata_multiline_string(tmp_path: Path) -> None:
     os.environ["PREAMBLE_YAML"] = "/dev/null"
-    tmp_files: pandoc.TemporaryFiles = []
     markdown, metadata = pandoc.prepare_markdown(
         """---
 header-includes:
@@ -202,7 +196,7 @@ header-includes:
 ---
 # Hello, World!
 """,
-        tmp_files,
+        tmp_path,
     )
 
     assert "usepackage{pdflscape}" in markdown
@@ -214,11 +208,10 @@ header-includes:
             _CREATOR_BLOCK,
         ]
     }
-    assert not tmp_files
+    assert not any(tmp_path.iterdir())
 
 
-def test_extract_yaml_metadata_with_preamble() -> None:
-    tmp_files: pandoc.TemporaryFiles = []
+def test_extract_yaml_metadata_with_preamble(tmp_path: Path) -> None:
     markdown, metadata = pandoc.prepare_markdown(
         """---
 author:
@@ -229,7 +222,7 @@ author:
 
 # Hello, World!
 """,
-        tmp_files,
+        tmp_path,
     )
 
     assert "titlepage-logo: " in markdown
@@ -261,11 +254,10 @@ author:
         "titlepage-text-color": "010326",
     }
     assert metadata["date"] == datetime.date.today().isoformat()
-    assert not tmp_files
+    assert not any(tmp_path.iterdir())
 
 
-def test_extract_yaml_metadata_with_preamble_has_less_priority() -> None:
-    tmp_files: pandoc.TemporaryFiles = []
+def test_extract_yaml_metadata_with_preamble_has_less_priority(tmp_path: Path) -> None:
     markdown, metadata = pandoc.prepare_markdown(
         """---
 titlepage: false
@@ -277,7 +269,7 @@ author:
 
 # Hello, World!
 """,
-        tmp_files,
+        tmp_path,
     )
 
     assert "titlepage-logo: " in markdown
@@ -309,49 +301,46 @@ author:
         "titlepage-text-color": "010326",
     }
     assert metadata["date"] == datetime.date.today().isoformat()
-    assert not tmp_files
+    assert not any(tmp_path.iterdir())
 
 
-def test_date_today_sentinel_replaced() -> None:
+def test_date_today_sentinel_replaced(tmp_path: Path) -> None:
     """'today' in the date field is replaced with the current ISO date."""
     os.environ["PREAMBLE_YAML"] = "/dev/null"
-    tmp_files: pandoc.TemporaryFiles = []
     _, metadata = pandoc.prepare_markdown(
         """---
 date: today
 ---
 # Hello
 """,
-        tmp_files,
+        tmp_path,
     )
     assert metadata is not None
     assert metadata["date"] == datetime.date.today().isoformat()
 
 
-def test_date_today_sentinel_case_insensitive() -> None:
+def test_date_today_sentinel_case_insensitive(tmp_path: Path) -> None:
     """'TODAY' and 'Today' are also replaced."""
     os.environ["PREAMBLE_YAML"] = "/dev/null"
     for value in ("TODAY", "Today", "toDay"):
-        tmp_files: pandoc.TemporaryFiles = []
         _, metadata = pandoc.prepare_markdown(
             f"---\ndate: {value}\n---\n",
-            tmp_files,
+            tmp_path,
         )
         assert metadata is not None
         assert metadata["date"] == datetime.date.today().isoformat(), f"failed for date: {value}"
 
 
-def test_date_literal_not_replaced() -> None:
+def test_date_literal_not_replaced(tmp_path: Path) -> None:
     """A literal date string is passed through unchanged."""
     os.environ["PREAMBLE_YAML"] = "/dev/null"
-    tmp_files: pandoc.TemporaryFiles = []
     _, metadata = pandoc.prepare_markdown(
         """---
 date: "2025-01-15"
 ---
 # Hello
 """,
-        tmp_files,
+        tmp_path,
     )
     assert metadata is not None
     assert metadata["date"] == "2025-01-15"
@@ -364,23 +353,21 @@ def test_titlepage_logo_resolved_from_resources_dir(tmp_path: Path) -> None:
     os.environ["RESOURCES_DIR"] = str(tmp_path)
     os.environ["PREAMBLE_YAML"] = "/dev/null"
 
-    tmp_files: pandoc.TemporaryFiles = []
     _, metadata = pandoc.prepare_markdown(
         """---
 titlepage-logo: mycompany-logo.pdf
 ---
 # Hello
 """,
-        tmp_files,
+        tmp_path,
     )
 
     assert metadata is not None
     assert metadata["titlepage-logo"] == str(logo_file)
 
 
-def test_extract_yaml_metadata_toc() -> None:
+def test_extract_yaml_metadata_toc(tmp_path: Path) -> None:
     os.environ["PREAMBLE_YAML"] = "/dev/null"
-    tmp_files: pandoc.TemporaryFiles = []
     _, metadata = pandoc.prepare_markdown(
         """---
 pandoc-options:
@@ -391,11 +378,45 @@ toc-own-page: true
 ---
 # Hello, World!
 """,
-        tmp_files,
+        tmp_path,
     )
     assert metadata == {
         "pandoc-options": ["something", "else", "toc"],
         "toc-own-page": True,
         "header-includes": [_CREATOR_BLOCK],
     }
-    assert not tmp_files
+    assert not any(tmp_path.iterdir())
+
+
+def test_uses_latex_environments() -> None:
+    metadata = {"pandoc-latex-environment": {"info-box": ["info"], "tcolorbox": ["box", "fancy"]}}
+    assert pandoc.uses_latex_environments("::: info\nHello\n:::\n", metadata)
+    assert pandoc.uses_latex_environments("- item\n\n  ::: info\n  Hello\n  :::\n", metadata)
+    assert pandoc.uses_latex_environments("::::: {.info #note}\nHello\n:::::\n", metadata)
+    assert pandoc.uses_latex_environments('<div class="fancy box">Hello</div>', metadata)
+    assert pandoc.uses_latex_environments("<div id=note class=info>Hello</div>", metadata)
+    assert pandoc.uses_latex_environments("<DIV CLASS='box fancy'>Hello</DIV>", metadata)
+    assert pandoc.uses_latex_environments('::: {class="info"}\nHello\n:::\n', metadata)
+    assert pandoc.uses_latex_environments("::: {#note class=info}\nHello\n:::\n", metadata)
+    assert pandoc.uses_latex_environments('::: {.fancy class="box"}\nHello\n:::\n', metadata)
+    assert not pandoc.uses_latex_environments("<div data-class=info>Hello</div>", metadata)
+    assert not pandoc.uses_latex_environments("::: {.box}\nHello\n:::\n", metadata)
+    assert not pandoc.uses_latex_environments("::: warning\nHello\n:::\n", metadata)
+    assert not pandoc.uses_latex_environments("::: info\nHello\n:::\n", None)
+
+
+@patch("renderknecht.renderers.pandoc.latex.run_latex")
+@patch("renderknecht.util.process.subprocess.Popen")
+def test_render_markdown_draft_runs_single_latex_pass(popen: MagicMock, run_latex: MagicMock) -> None:
+    os.environ["PREAMBLE_YAML"] = "/dev/null"
+    popen.return_value.communicate.return_value = (b"\\documentclass{article}", b"")
+    popen.return_value.returncode = 0
+    run_latex.return_value = b"%PDF-draft"
+
+    assert pandoc.render_markdown("# Hello", draft=True) == b"%PDF-draft"
+
+    command = popen.call_args[0][0]
+    assert command[command.index("-t") + 1] == "latex"
+    assert "--lua-filter" not in command
+    assert run_latex.call_args[0] == (b"\\documentclass{article}",)
+    assert run_latex.call_args[1]["passes"] == 1
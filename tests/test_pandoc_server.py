@@ -0,0 +1,116 @@
+import base64
+import json
+import os
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import httpx
+import pytest
+
+from renderknecht.renderers import pandoc
+from renderknecht.util import pandoc_server, yaml
+from renderknecht.util.pandoc_wrapper import determine_pandoc_server_parameters
+
+
+@pytest.fixture(autouse=True)
+def eisvogel_template(tmp_path: Path) -> None:
+    templates = tmp_path / "data" / "pandoc" / "templates"
+    templates.mkdir(parents=True)
+    (templates / "eisvogel.latex").write_text("$body$")
+    os.environ["XDG_DATA_HOME"] = str(tmp_path / "data")
+    os.environ["PREAMBLE_YAML"] = "/dev/null"
+
+
+def test_server_parameters() -> None:
+    request = determine_pandoc_server_parameters({"pandoc-options": ["toc"]}, latex_environments=False)
+    assert request is not None
+    parameters, files = request
+    assert parameters["to"] == "latex"
+    assert parameters["template"] == "$body$"
+    assert parameters["table-of-contents"] is True
+    assert parameters["csl"] == "ieee.csl"
+    assert files["ieee.csl"].name == "ieee.csl"
+
+
+def test_server_parameters_draft() -> None:
+    request = determine_pandoc_server_parameters(None, draft=True, latex_environments=False)
+    assert request is not None
+    parameters, files = request
+    assert parameters["variables"] == {"titlepage": False}
+    assert parameters["include-in-header"] == ["draft.tex"]
+    assert "draft.tex" in files
+
+
+def test_server_parameters_need_subprocess() -> None:
+    assert (
+        determine_pandoc_server_parameters({"pandoc-options": ["crossref"]}, latex_environments=False) is None
+    )
+    assert determine_pandoc_server_parameters(None, latex_environments=True) is None
+    assert (
+        determine_pandoc_server_parameters({"bibliography": "missing.bib"}, latex_environments=False) is None
+    )
+
+
+def test_convert_sends_files(tmp_path: Path) -> None:
+    csl = tmp_path / "style.csl"
+    csl.write_text("<style/>")
+    requests: list[dict] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(json.loads(request.content))
+        return httpx.Response(
+            200, json={"output": "\\documentclass{article}", "base64": False, "messages": []}
+        )
+
+    server = pandoc_server.PandocServer("http://pandoc.invalid")
+    server._client = httpx.Client(transport=httpx.MockTransport(handler))
+    try:
+        assert server.convert("# Hello", {"to": "latex"}, {"ieee.csl": csl}) == "\\documentclass{article}"
+    finally:
+        server.close()
+
+    assert requests[0]["text"] == "# Hello"
+    assert requests[0]["to"] == "latex"
+    assert base64.b64decode(requests[0]["files"]["ieee.csl"]) == b"<style/>"
+
+
+@patch("renderknecht.renderers.pandoc.latex.run_latex")
+@patch("renderknecht.renderers.pandoc.pandoc_server.shared_server")
+def test_render_markdown_uses_server(shared_server: MagicMock, run_latex: MagicMock) -> None:
+    shared_server.return_value.convert.return_value = "\\documentclass{article}"
+    run_latex.return_value = b"%PDF"
+    converted = pandoc._CONVERSIONS.value(backend="server")
+
+    assert pandoc.render_markdown("# Hello") == b"%PDF"
+    assert pandoc._CONVERSIONS.value(backend="server") == converted + 1
+    assert run_latex.call_args[0][0] == b"\\documentclass{article}"
+    assert run_latex.call_args[1]["passes"] == 3
+
+
+@patch("renderknecht.util.process.subprocess.Popen")
+@patch("renderknecht.renderers.pandoc.pandoc_server.shared_server")
+def test_render_markdown_falls_back_to_subprocess(shared_server: MagicMock, popen: MagicMock) -> None:
+    shared_server.return_value.convert.side_effect = pandoc_server.PandocServerError("unsupported")
+    popen.return_value.communicate.return_value = (b"%PDF", b"")
+    popen.return_value.returncode = 0
+    failed = pandoc._CONVERSIONS.value(backend="pandoc", reason="error")
+
+    assert pandoc.render_markdown("# Hello") == b"%PDF"
+    assert popen.call_args[0][0][0] == "pandoc"
+    assert pandoc._CONVERSIONS.value(backend="pandoc", reason="error") == failed + 1
+
+
+@patch("renderknecht.util.process.subprocess.Popen")
+@patch("renderknecht.renderers.pandoc.pandoc_server.shared_server")
+def test_render_markdown_counts_documents_the_server_cannot_convert(
+    shared_server: MagicMock, popen: MagicMock
+) -> None:
+    popen.return_value.communicate.return_value = (b"%PDF", b"")
+    popen.return_value.returncode = 0
+    os.environ["PREAMBLE_YAML"] = str(pandoc._resource_path("preamble.yaml"))
+    yaml.configure()
+    skipped = pandoc._CONVERSIONS.value(backend="pandoc", reason="latex-environments")
+
+    assert pandoc.render_markdown("---\ntitle: Notes\n---\n::: info\nNote.\n:::\n") == b"%PDF"
+    shared_server.return_value.convert.assert_not_called()
+    assert pandoc._CONVERSIONS.value(backend="pandoc", reason="latex-environments") == skipped + 1
@@ -0,0 +1,88 @@
+import io
+import os
+import zlib
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from renderknecht.queue import worker
+from renderknecht.util import metrics, pdf
+from renderknecht.web import create_app
+
+pikepdf = pytest.importorskip("pikepdf")
+
+
+def make_pdf(pages: int) -> bytes:
+    """Return a PDF showing the same image on every page, embedded once per page."""
+    document = pikepdf.new()
+    data = zlib.compress(bytes(range(256)) * 64)
+    for _ in range(pages):
+        page = document.add_blank_page()
+        image = document.make_stream(
+            data,
+            Type=pikepdf.Name.XObject,
+            Subtype=pikepdf.Name.Image,
+            Width=128,
+            Height=128,
+            ColorSpace=pikepdf.Name.DeviceGray,
+            BitsPerComponent=8,
+            Filter=pikepdf.Name.FlateDecode,
+        )
+        page.Resources = pikepdf.Dictionary(XObject=pikepdf.Dictionary(Im0=image))
+        page.Contents = document.make_stream(b"q 128 0 0 128 0 0 cm /Im0 Do Q")
+    output = io.BytesIO()
+    document.save(output)
+    return output.getvalue()
+
+
+def test_optimization_from_env() -> None:
+    os.environ.pop("RENDERKNECHT_PDF_OPTIMIZE", None)
+    assert not pdf.Optimization.from_env().enabled
+
+    os.environ["RENDERKNECHT_PDF_OPTIMIZE"] = "linearize, compress"
+    assert pdf.Optimization.from_env() == pdf.Optimization(compress=True, linearize=True)
+
+    os.environ["RENDERKNECHT_PDF_OPTIMIZE"] = "all"
+    assert pdf.Optimization.from_env() == pdf.Optimization(True, True, True)
+
+    os.environ["RENDERKNECHT_PDF_OPTIMIZE"] = "shrink"
+    with pytest.raises(ValueError, match="shrink"):
+        pdf.Optimization.from_env()
+
+
+def test_unknown_steps_fail_start_up(tmp_path: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    os.environ["RENDERKNECHT_PDF_OPTIMIZE"] = "shrink"
+    os.environ["RENDERKNECHT_SCRATCH_DIR"] = str(tmp_path / "scratch")
+    os.environ.pop("RENDERKNECHT_QUEUE", None)
+    with pytest.raises(ValueError, match="shrink"):
+        create_app()
+    with pytest.raises(SystemExit):
+        worker.main(["--queue", f"sqlite:///{tmp_path / 'queue.db'}"])
+    assert "shrink" in capsys.readouterr().err
+
+
+def test_deduplicates_and_linearizes() -> None:
+    original = make_pdf(3)
+    optimized = pdf.optimize(original, pdf.Optimization(True, True, True))
+
+    assert len(optimized) < len(original)
+    with pikepdf.open(io.BytesIO(optimized)) as document:
+        assert document.is_linearized
+        assert len({page.Resources.XObject.Im0.objgen for page in document.pages}) == 1
+
+
+def test_postprocess_records_metrics() -> None:
+    size = metrics.REGISTRY.summary("renderknecht_pdf_postprocess_bytes", "")
+    count = size.count(stage="output")
+    original = make_pdf(2)
+
+    optimized = pdf.postprocess(original, pdf.Optimization(deduplicate=True))
+    assert size.count(stage="output") == count + 1
+    assert "renderknecht_pdf_postprocess_seconds_count" in metrics.REGISTRY.exposition()
+    assert len(optimized) < len(original)
+
+
+@patch("renderknecht.util.pdf.optimize", side_effect=RuntimeError("broken"))
+def test_postprocess_failure_keeps_pdf(optimize: MagicMock) -> None:
+    assert pdf.postprocess(b"%PDF", pdf.Optimization(compress=True)) == b"%PDF"
@@ -0,0 +1,103 @@
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from renderknecht.renderers import pandoc
+from renderknecht.util import plantuml, process
+
+# Mimics `plantuml -pipe -pipedelimitor <delimiter>`: one SVG per diagram, each followed by the delimiter.
+_FAKE_PLANTUML = """\
+import os
+import sys
+import time
+
+delimiter = sys.argv[sys.argv.index("-pipedelimitor") + 1]
+diagram = []
+for line in sys.stdin:
+    diagram.append(line)
+    if line.startswith("@enduml"):
+        body = "".join(diagram[1:-1]).strip()
+        if body == "hang":
+            time.sleep(60)
+        print(f"<svg pid='{os.getpid()}'>{body}</svg>")
+        print(delimiter, flush=True)
+        diagram = []
+"""
+
+
+@pytest.fixture()
+def fake_plantuml(tmp_path: Path) -> list[str]:
+    script = tmp_path / "plantuml.py"
+    script.write_text(_FAKE_PLANTUML)
+    return [sys.executable, str(script)]
+
+
+def test_pipe_renders_many_diagrams_with_one_process(fake_plantuml: list[str]) -> None:
+    pipe = plantuml.PlantUMLPipe(fake_plantuml)
+    try:
+        first = pipe.render("Alice -> Bob")
+        second = pipe.render("@startuml\nBob -> Alice\n@enduml")
+    finally:
+        pipe.close()
+
+    assert first.endswith(">Alice -> Bob</svg>\n")
+    assert second.endswith(">Bob -> Alice</svg>\n")
+    pid = first.split("'")[1]
+    assert f"pid='{pid}'" in second
+
+
+def test_pipe_restarts_after_close(fake_plantuml: list[str]) -> None:
+    pipe = plantuml.PlantUMLPipe(fake_plantuml)
+    try:
+        assert "A" in pipe.render("A")
+        pipe.close()
+        assert "B" in pipe.render("B")
+    finally:
+        pipe.close()
+
+
+def test_pipe_closes_unterminated_diagrams(fake_plantuml: list[str]) -> None:
+    pipe = plantuml.PlantUMLPipe(fake_plantuml)
+    try:
+        assert pipe.render("@startuml\nA -> B").endswith(">A -> B</svg>\n")
+    finally:
+        pipe.close()
+
+
+def test_pipe_kills_hung_process(fake_plantuml: list[str]) -> None:
+    pipe = plantuml.PlantUMLPipe(fake_plantuml)
+    try:
+        first = pipe.render("A")
+        started = time.monotonic()
+        with pytest.raises(subprocess.TimeoutExpired):
+            pipe.render("hang", process.Supervisor(process.Limits(timeout=0.5)))
+        assert time.monotonic() - started < 5
+        with pytest.raises(process.RenderCancelledError):
+            pipe.render("hang", process.Supervisor(process.Limits(), cancelled=lambda: True))
+        # a new process takes over
+        second = pipe.render("B")
+    finally:
+        pipe.close()
+
+    assert second.endswith(">B</svg>\n")
+    assert first.split("'")[1] != second.split("'")[1]
+
+
+def test_plantuml_command_from_env() -> None:
+    os.environ["PLANTUML_COMMAND"] = "java -jar '/opt/plant uml.jar'"
+    assert plantuml.plantuml_command() == ["java", "-jar", "/opt/plant uml.jar"]
+
+
+@patch("renderknecht.renderers.pandoc.httpx.get")
+def test_render_plantuml_prefers_configured_server(get: MagicMock, fake_plantuml: list[str]) -> None:
+    os.environ["PLANTUML_COMMAND"] = " ".join(fake_plantuml)
+    os.environ["PLANTUML_SERVER"] = "http://example.com:8080/"
+    get.return_value.text = "<svg/>"
+
+    assert pandoc.render_plantuml("A -> B") == "<svg/>"
+    assert get.call_args[0][0].startswith("http://example.com:8080/svg/")
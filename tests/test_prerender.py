@@ -0,0 +1,215 @@
+import datetime
+import json
+import os
+import threading
+import time
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from renderknecht.renderers import pandoc
+from renderknecht.util import hedgedoc, render_cache
+from renderknecht.web import create_app, prerender
+
+
+class StubHedgeDoc:
+    """Serves the parts of the HedgeDoc API the pre-render service uses."""
+
+    def __init__(self) -> None:
+        self.pads: dict[str, tuple[str, str]] = {}
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def edit(self, pad_id: str, markdown: str, updated: float | None = None) -> None:
+        when = datetime.datetime.fromtimestamp(updated or time.time(), datetime.UTC)
+        self.pads[pad_id] = (markdown, when.isoformat(timespec="milliseconds").replace("+00:00", "Z"))
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:  # noqa: N802 (http.server API)
+                if self.path == "/history":
+                    if "connect.sid=session" not in self.headers.get("Cookie", ""):
+                        return self._send(403, "text/plain", b"Forbidden")
+                    history = [{"id": pad_id, "text": pad_id, "time": 0, "tags": []} for pad_id in stub.pads]
+                    return self._send(200, "application/json", json.dumps({"history": history}).encode())
+                _, pad_id, action = self.path.split("/")
+                if pad_id not in stub.pads:
+                    return self._send(404, "text/plain", b"Not found")
+                markdown, updated = stub.pads[pad_id]
+                if action == "download":
+                    return self._send(200, "text/markdown", markdown.encode())
+                info = {"title": pad_id, "createtime": updated, "updatetime": updated}
+                return self._send(200, "application/json", json.dumps(info).encode())
+
+            def _send(self, status: int, content_type: str, body: bytes) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: object) -> None:  # noqa: A002 (http.server API)
+                pass
+
+        return Handler
+
+
+@pytest.fixture
+def stub() -> Iterator[StubHedgeDoc]:
+    stub = StubHedgeDoc()
+    stub.thread.start()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
+
+
+pytestmark = pytest.mark.usefixtures("no_preamble")
+
+
+def make_service(
+    stub: StubHedgeDoc,
+    tmp_path: Path,
+    quiet_period: float = 60,
+    rate: float = 6,
+    max_pending: int = 1000,
+) -> tuple[prerender.PrerenderService, list]:
+    renders: list[str] = []
+
+    def render(markdown: str, output_format: str, draft: bool) -> bytes:
+        renders.append(markdown)
+        return f"%PDF {markdown}".encode()
+
+    client = hedgedoc.HedgeDocClient(stub.url, cookie="session")
+    cache = render_cache.RenderCache(tmp_path / "cache")
+    service = prerender.PrerenderService(
+        client, cache, render, quiet_period=quiet_period, rate=rate, max_pending=max_pending
+    )
+    return service, renders
+
+
+def test_poll_renders_changed_pads_into_cache(stub: StubHedgeDoc, tmp_path: Path) -> None:
+    stub.edit("notes", "# Draft", time.time() - 10)
+    service, renders = make_service(stub, tmp_path, quiet_period=0)
+
+    service.poll()  # first sight
+    assert service.run_pending() == 0
+
+    stub.edit("notes", "# Final", time.time() - 5)
+    service.poll()
+    assert service.run_pending() == 1
+    assert renders == ["# Final"]
+    assert service.cache.get(pandoc.render_cache_key("# Final")) == b"%PDF # Final"
+
+    # unchanged pads are not rendered again
+    service.poll()
+    assert service.run_pending() == 0
+
+
+def test_pads_being_edited_are_debounced(stub: StubHedgeDoc, tmp_path: Path) -> None:
+    stub.edit("notes", "# Draft", time.time() - 10)
+    service, renders = make_service(stub, tmp_path, quiet_period=60)
+    service.poll()
+
+    stub.edit("notes", "# Still typing", time.time() - 5)
+    service.poll()
+    assert service.run_pending() == 0
+    assert renders == []
+
+
+def test_webhook_debounces_and_rate_limits(stub: StubHedgeDoc, tmp_path: Path) -> None:
+    for pad_id in ("a", "b", "c"):
+        stub.edit(pad_id, f"# {pad_id}")
+    service, renders = make_service(stub, tmp_path, quiet_period=0.2, rate=2)
+
+    for pad_id in ("a", "b", "c"):
+        service.notify(pad_id)
+    assert service.run_pending() == 0
+
+    time.sleep(0.3)
+    assert service.run_pending() == 2
+    assert service.run_pending() == 0
+    assert len(renders) == 2
+
+
+def test_pending_pads_are_capped(stub: StubHedgeDoc, tmp_path: Path) -> None:
+    service, _ = make_service(stub, tmp_path, max_pending=2)
+
+    assert service.notify("a")
+    assert service.notify("b")
+    assert not service.notify("c")
+    # pads that are waiting already can still be pushed back
+    assert service.notify("a")
+
+
+def test_cached_pads_are_skipped(stub: StubHedgeDoc, tmp_path: Path) -> None:
+    stub.edit("notes", "# Hello")
+    service, renders = make_service(stub, tmp_path)
+    service.cache.put(pandoc.render_cache_key("# Hello"), b"%PDF")
+
+    assert not service.prerender("notes")
+    assert renders == []
+
+
+def test_history_needs_session_cookie(stub: StubHedgeDoc) -> None:
+    stub.edit("notes", "# Hello")
+    assert hedgedoc.HedgeDocClient(stub.url, cookie="").history() == []
+    assert [entry["id"] for entry in hedgedoc.HedgeDocClient(stub.url, cookie="session").history()] == [
+        "notes"
+    ]
+
+
+@patch("renderknecht.web.pandoc.render_markdown")
+def test_webhook_endpoint_and_cache_hit(
+    render_markdown: MagicMock, stub: StubHedgeDoc, tmp_path: Path
+) -> None:
+    render_markdown.return_value = b"%PDF"
+    stub.edit("notes", "# Hello")
+    os.environ.update(
+        {
+            "HEDGEDOC_URL": stub.url,
+            "RENDERKNECHT_RENDER_CACHE": str(tmp_path / "cache"),
+            "RENDERKNECHT_PRERENDER": "1",
+            "RENDERKNECHT_PRERENDER_POLL": "0",
+            "RENDERKNECHT_PRERENDER_QUIET": "0",
+            "RENDERKNECHT_PRERENDER_TOKEN": "secret",
+            "RENDERKNECHT_SCRATCH_DIR": str(tmp_path / "scratch"),
+        }
+    )
+    client = create_app().test_client()
+
+    assert client.post("/prerender/notes").status_code == 403
+    assert client.post("/prerender/notes", headers={"Authorization": "Bearer wrong"}).status_code == 403
+    assert not render_markdown.called
+    assert client.post("/prerender/notes", headers={"Authorization": "Bearer secret"}).status_code == 202
+    for _ in range(50):
+        if render_markdown.called:
+            break
+        time.sleep(0.1)
+    assert render_markdown.call_count == 1
+
+    response = client.get("/pdf/notes")
+    assert response.status_code == 200
+    assert response.data == b"%PDF"
+    assert render_markdown.call_count == 1
+
+
+def test_webhook_needs_token(stub: StubHedgeDoc, tmp_path: Path) -> None:
+    os.environ.update(
+        {
+            "HEDGEDOC_URL": stub.url,
+            "RENDERKNECHT_RENDER_CACHE": str(tmp_path / "cache"),
+            "RENDERKNECHT_PRERENDER": "1",
+            "RENDERKNECHT_PRERENDER_POLL": "0",
+            "RENDERKNECHT_SCRATCH_DIR": str(tmp_path / "scratch"),
+        }
+    )
+    os.environ.pop("RENDERKNECHT_PRERENDER_TOKEN", None)
+    client = create_app().test_client()
+
+    assert client.post("/prerender/notes", headers={"Authorization": "Bearer "}).status_code == 404
@@ -0,0 +1,97 @@
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from renderknecht.util import process
+
+
+def test_run_captures_output() -> None:
+    supervisor = process.Supervisor(process.Limits())
+    result = supervisor.run(
+        [sys.executable, "-c", "import sys; sys.stdout.write(sys.stdin.read())"], input=b"hi"
+    )
+    assert result.stdout == b"hi"
+
+
+def test_run_feeds_input_to_slow_process() -> None:
+    # outlives several polls of the supervisor
+    supervisor = process.Supervisor(process.Limits())
+    result = supervisor.run(
+        [sys.executable, "-c", "import sys, time; time.sleep(0.6); sys.stdout.write(sys.stdin.read())"],
+        input=b"hi",
+    )
+    assert result.stdout == b"hi"
+
+
+def test_run_raises_on_failure() -> None:
+    supervisor = process.Supervisor(process.Limits())
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        supervisor.run([sys.executable, "-c", "import sys; sys.stderr.write('boom'); sys.exit(3)"])
+    assert e.value.returncode == 3
+    assert e.value.stderr == b"boom"
+
+
+def test_timeout_kills_process_tree(tmp_path: Path) -> None:
+    pid_file = tmp_path / "child.pid"
+    script = (
+        "import subprocess, sys, time\n"
+        "child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])\n"
+        f"open({str(pid_file)!r}, 'w').write(str(child.pid))\n"
+        "time.sleep(60)\n"
+    )
+    supervisor = process.Supervisor(process.Limits(timeout=1.0))
+
+    started = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        supervisor.run([sys.executable, "-c", script])
+    assert time.monotonic() - started < 10
+
+    child = int(pid_file.read_text())
+    for _ in range(20):
+        try:
+            os.kill(child, 0)
+        except ProcessLookupError:
+            break
+        time.sleep(0.1)
+    else:
+        pytest.fail("child process survived the timeout")
+
+
+def test_cancel_callback() -> None:
+    started = time.monotonic()
+    supervisor = process.Supervisor(process.Limits(), cancelled=lambda: time.monotonic() - started > 0.5)
+    with pytest.raises(process.RenderCancelledError):
+        supervisor.run([sys.executable, "-c", "import time; time.sleep(60)"])
+    assert time.monotonic() - started < 10
+
+    # a cancelled render stays cancelled
+    with pytest.raises(process.RenderCancelledError):
+        supervisor.check()
+
+
+def test_cpu_limit() -> None:
+    supervisor = process.Supervisor(process.Limits(timeout=30.0, cpu=1))
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        supervisor.run([sys.executable, "-c", "while True: pass"])
+    assert e.value.returncode < 0
+
+
+def test_limits_apply_before_command_starts() -> None:
+    supervisor = process.Supervisor(process.Limits(cpu=5, memory=2**32))
+    result = supervisor.run(
+        [sys.executable, "-c", "import resource; print(resource.getrlimit(resource.RLIMIT_CPU)[0])"]
+    )
+    assert result.stdout.strip() == b"5"
+
+
+def test_limits_from_env(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("RENDERKNECHT_RENDER_TIMEOUT", "0")
+    monkeypatch.setenv("RENDERKNECHT_RENDER_MEMORY_LIMIT", "1073741824")
+    limits = process.Limits.from_env()
+    assert limits.timeout is None
+    assert limits.cpu is None
+    assert limits.memory == 1073741824
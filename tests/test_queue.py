@@ -0,0 +1,207 @@
+import subprocess
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from renderknecht import queue
+from renderknecht.queue.worker import Worker
+from renderknecht.util import process
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def jobs(request: pytest.FixtureRequest, tmp_path: Path) -> Iterator[queue.JobQueue]:
+    jobs: queue.JobQueue
+    if request.param == "sqlite":
+        jobs = queue.SQLiteQueue(tmp_path / "queue.db")
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        from renderknecht.queue.redis_queue import RedisQueue
+
+        jobs = RedisQueue(fakeredis.FakeRedis())
+    yield jobs
+    jobs.close()
+
+
+def test_open_queue(tmp_path: Path) -> None:
+    assert queue.open_queue("") is None
+    opened = queue.open_queue(f"sqlite://{tmp_path}/queue.db")
+    assert isinstance(opened, queue.SQLiteQueue)
+    opened.close()
+    with pytest.raises(queue.QueueError):
+        queue.open_queue("amqp://broker")
+
+
+def test_claim_in_submission_order(jobs: queue.JobQueue) -> None:
+    first = jobs.submit(queue.Job("# First"))
+    second = jobs.submit(queue.Job("# Second", "html", draft=True))
+
+    job = jobs.claim("worker-1")
+    assert job is not None
+    assert (job.id, job.status, job.worker, job.attempts) == (first, queue.JobStatus.RUNNING, "worker-1", 1)
+    job = jobs.claim("worker-2")
+    assert job is not None
+    assert (job.id, job.output_format, job.draft) == (second, "html", True)
+    assert jobs.claim("worker-3") is None
+
+
+def test_complete_and_fetch_result(jobs: queue.JobQueue) -> None:
+    job_id = jobs.submit(queue.Job("# Hello"))
+    jobs.claim("worker")
+    jobs.complete(job_id, b"%PDF")
+
+    job = jobs.wait(job_id, timeout=1)
+    assert job.status is queue.JobStatus.DONE
+    assert jobs.result(job_id) == b"%PDF"
+
+    jobs.discard(job_id)
+    assert jobs.get(job_id) is None
+    assert jobs.result(job_id) is None
+
+
+def test_cancelled_job_is_not_claimed(jobs: queue.JobQueue) -> None:
+    job_id = jobs.submit(queue.Job("# Hello"))
+    jobs.cancel(job_id)
+    assert jobs.claim("worker") is None
+    # a worker finishing a cancelled job does not resurrect it
+    jobs.complete(job_id, b"%PDF")
+    job = jobs.get(job_id)
+    assert job is not None
+    assert job.status is queue.JobStatus.CANCELLED
+
+
+def test_cancelling_running_job_releases_it_from_worker() -> None:
+    fakeredis = pytest.importorskip("fakeredis")
+    from renderknecht.queue.redis_queue import RedisQueue, _processing_key
+
+    client = fakeredis.FakeRedis()
+    jobs = RedisQueue(client)
+    job_id = jobs.submit(queue.Job("# Hello"))
+    assert jobs.claim("worker") is not None
+
+    jobs.cancel(job_id)
+    jobs.complete(job_id, b"%PDF")
+    assert client.llen(_processing_key("worker")) == 0
+    assert jobs.requeue_stale(max_age=60) == []
+
+
+def test_jobs_of_dead_workers_are_requeued(jobs: queue.JobQueue) -> None:
+    jobs.register_worker("alive")
+    jobs.register_worker("dead")
+    job_id = jobs.submit(queue.Job("# Hello"))
+    jobs.claim("dead")
+
+    time.sleep(0.2)
+    jobs.heartbeat("alive")
+    assert jobs.requeue_stale(max_age=0.1) == [job_id]
+    assert set(jobs.workers()) == {"alive"}
+
+    job = jobs.claim("alive")
+    assert job is not None
+    assert (job.id, job.attempts) == (job_id, 2)
+
+
+def test_jobs_of_unregistered_workers_are_requeued(jobs: queue.JobQueue) -> None:
+    job_id = jobs.submit(queue.Job("# Hello"))
+    assert jobs.claim("vanished") is not None
+
+    assert jobs.requeue_stale(max_age=60) == [job_id]
+    job = jobs.claim("worker")
+    assert job is not None
+    assert (job.id, job.worker, job.attempts) == (job_id, "worker", 2)
+
+
+def test_purge_finished_jobs(jobs: queue.JobQueue) -> None:
+    done = jobs.submit(queue.Job("# Done"))
+    jobs.claim("worker")
+    jobs.complete(done, b"%PDF")
+    cancelled = jobs.submit(queue.Job("# Cancelled"))
+    jobs.cancel(cancelled)
+    queued = jobs.submit(queue.Job("# Queued"))
+
+    assert jobs.purge(max_age=60) == 0
+    time.sleep(0.1)
+    assert jobs.purge(max_age=0.05) == 2
+    assert jobs.get(done) is None and jobs.result(done) is None
+    assert jobs.get(cancelled) is None
+    assert jobs.get(queued) is not None
+
+
+def test_job_fails_after_max_attempts(jobs: queue.JobQueue) -> None:
+    job_id = jobs.submit(queue.Job("# Crashes every worker"))
+    for attempt in range(queue.MAX_ATTEMPTS):
+        worker_id = f"worker-{attempt}"
+        jobs.register_worker(worker_id)
+        assert jobs.claim(worker_id) is not None
+        jobs.unregister_worker(worker_id)
+
+    job = jobs.get(job_id)
+    assert job is not None and job.error is not None
+    assert job.status is queue.JobStatus.FAILED
+    with pytest.raises(queue.WorkerLostError):
+        queue.raise_error(job.error)
+
+
+def test_errors_round_trip() -> None:
+    error = subprocess.CalledProcessError(43, "pandoc", b"", b"Error producing PDF.")
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        queue.raise_error(queue.describe_error(error))
+    assert (e.value.returncode, e.value.stderr) == (43, b"Error producing PDF.")
+
+    with pytest.raises(subprocess.TimeoutExpired):
+        queue.raise_error(queue.describe_error(subprocess.TimeoutExpired("pdflatex", 600)))
+
+
+@patch("renderknecht.queue.worker.pandoc.render_markdown")
+def test_worker_renders_submitted_jobs(render_markdown: MagicMock, jobs: queue.JobQueue) -> None:
+    render_markdown.side_effect = lambda markdown, output_format, draft, supervisor: markdown.encode()
+    worker = Worker(jobs, "worker", heartbeat_interval=0.1)
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    try:
+        assert jobs.render("# Hello", "html") == b"# Hello"
+    finally:
+        worker.stop.set()
+        thread.join()
+    assert jobs.workers() == {}
+
+
+@patch("renderknecht.queue.worker.pandoc.render_markdown")
+def test_worker_reports_errors(render_markdown: MagicMock, jobs: queue.JobQueue) -> None:
+    render_markdown.side_effect = subprocess.CalledProcessError(43, "pandoc", b"", b"Error producing PDF.")
+    job_id = jobs.submit(queue.Job("# Hello"))
+    worker = Worker(jobs, "worker")
+    job = jobs.claim("worker")
+    assert job is not None
+    worker.process(job)
+
+    job = jobs.get(job_id)
+    assert job is not None and job.error is not None
+    with pytest.raises(subprocess.CalledProcessError):
+        queue.raise_error(job.error)
+
+
+@patch("renderknecht.queue.worker.pandoc.render_markdown")
+def test_cancelling_job_cancels_render(render_markdown: MagicMock, jobs: queue.JobQueue) -> None:
+    def render(markdown: str, output_format: str, draft: bool, supervisor: process.Supervisor) -> bytes:
+        while True:
+            supervisor.check()
+            time.sleep(0.05)
+
+    render_markdown.side_effect = render
+    worker = Worker(jobs, "worker", heartbeat_interval=0.1)
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    try:
+        with pytest.raises(process.RenderCancelledError):
+            started = time.monotonic()
+            jobs.render("# Hello", cancelled=lambda: time.monotonic() - started > 0.3)
+        # the worker gives up the render and takes the next job
+        render_markdown.side_effect = lambda markdown, output_format, draft, supervisor: b"%PDF"
+        assert jobs.render("# Next") == b"%PDF"
+    finally:
+        worker.stop.set()
+        thread.join()
@@ -0,0 +1,68 @@
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from renderknecht.renderers import pandoc
+from renderknecht.util import render_cache
+
+pytestmark = pytest.mark.usefixtures("no_preamble")
+
+
+def test_get_and_put(tmp_path: Path) -> None:
+    cache = render_cache.RenderCache(tmp_path)
+    assert cache.get("key") is None
+    cache.put("key", b"%PDF")
+    assert "key" in cache
+    assert cache.get("key") == b"%PDF"
+
+
+def test_evicts_least_recently_used(tmp_path: Path) -> None:
+    cache = render_cache.RenderCache(tmp_path, max_size=10)
+    cache.put("old", b"x" * 4)
+    cache.put("used", b"x" * 4)
+    past = time.time() - 60
+    os.utime(tmp_path / "old", (past, past))
+    os.utime(tmp_path / "used", (past, past))
+    cache.get("used")
+
+    cache.put("new", b"x" * 4)
+    assert "old" not in cache
+    assert "used" in cache
+    assert "new" in cache
+
+
+def test_shared_cache_disabled_by_default() -> None:
+    os.environ.pop("RENDERKNECHT_RENDER_CACHE", None)
+    assert render_cache.shared_cache() is None
+
+
+def test_key_covers_format_and_preamble(tmp_path: Path) -> None:
+    key = pandoc.render_cache_key("# Hello")
+    assert key == pandoc.render_cache_key("# Hello", "pdf")
+    assert key != pandoc.render_cache_key("# Hello", "html")
+    assert key != pandoc.render_cache_key("# Hello", draft=True)
+    assert key != pandoc.render_cache_key("# Hello!")
+
+    preamble = tmp_path / "preamble.yaml"
+    preamble.write_text("lang: de\n")
+    os.environ["PREAMBLE_YAML"] = str(preamble)
+    assert key != pandoc.render_cache_key("# Hello")
+
+
+def test_key_covers_referenced_files(tmp_path: Path) -> None:
+    os.environ["WORK_DIR"] = str(tmp_path)
+    (tmp_path / "refs.bib").write_text("@book{a, title={A}}\n")
+    (tmp_path / "figure.png").write_bytes(b"PNG")
+    markdown = (
+        "---\nbibliography: refs.bib\n---\n\n![Figure](figure.png) ![Remote](https://example.org/a.png)\n"
+    )
+    assert pandoc.referenced_files(markdown) == {tmp_path / "refs.bib", tmp_path / "figure.png"}
+
+    key = pandoc.render_cache_key(markdown)
+    assert key == pandoc.render_cache_key(markdown)
+    (tmp_path / "refs.bib").write_text("@book{a, title={B}}\n")
+    assert (bib_key := pandoc.render_cache_key(markdown)) != key
+    os.utime(tmp_path / "figure.png", ns=(0, 0))
+    assert pandoc.render_cache_key(markdown) != bib_key
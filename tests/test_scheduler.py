@@ -0,0 +1,272 @@
+import os
+import threading
+import time
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from renderknecht import loadtest, queue
+from renderknecht.util import metrics, process
+from renderknecht.web import create_app, scheduler
+
+Priority = scheduler.Priority
+
+
+def waiting(renders: scheduler.RenderScheduler) -> int:
+    return sum(renders.depth(priority) for priority in Priority)
+
+
+def run_in_order(
+    renders: scheduler.RenderScheduler, requests: list[tuple[str, Priority, str, float]]
+) -> list[str]:
+    """Queue renders behind a running one, one after the other, and return the order they got their slot in."""
+    order: list[str] = []
+    blocker = threading.Event()
+
+    def hold() -> None:
+        with renders.slot(Priority.INTERACTIVE, "blocker"):
+            blocker.wait()
+
+    def render(name: str, priority: Priority, flow: str, cost: float) -> None:
+        with renders.slot(priority, flow, cost):
+            order.append(name)
+
+    threads = [threading.Thread(target=hold)]
+    threads[0].start()
+    for number, request in enumerate(requests):
+        threads.append(threading.Thread(target=render, args=request))
+        threads[-1].start()
+        while waiting(renders) < number + 1:
+            time.sleep(0.01)
+    blocker.set()
+    for thread in threads:
+        thread.join()
+    return order
+
+
+def test_serves_by_priority() -> None:
+    renders = scheduler.RenderScheduler(1)
+    order = run_in_order(
+        renders,
+        [
+            ("prerender", Priority.BACKGROUND, "prerender", 1),
+            ("export", Priority.BATCH, "a", 1),
+            ("view", Priority.INTERACTIVE, "b", 1),
+        ],
+    )
+    assert order == ["view", "export", "prerender"]
+
+
+def test_shares_fairly_between_flows() -> None:
+    renders = scheduler.RenderScheduler(1)
+    order = run_in_order(
+        renders,
+        [
+            ("a1", Priority.INTERACTIVE, "a", 1),
+            ("a2", Priority.INTERACTIVE, "a", 1),
+            ("a3", Priority.INTERACTIVE, "a", 1),
+            ("b1", Priority.INTERACTIVE, "b", 1),
+        ],
+    )
+    assert order == ["a1", "b1", "a2", "a3"]
+
+
+def test_cheap_renders_overtake_expensive_ones() -> None:
+    renders = scheduler.RenderScheduler(1)
+    order = run_in_order(
+        renders,
+        [
+            ("book", Priority.INTERACTIVE, "a", 50),
+            ("memo", Priority.INTERACTIVE, "b", 1),
+        ],
+    )
+    assert order == ["memo", "book"]
+
+
+def test_waiting_renders_age() -> None:
+    renders = scheduler.RenderScheduler(1, aging=0.05)
+    order: list[str] = []
+
+    def render(name: str, priority: Priority) -> None:
+        with renders.slot(priority, name):
+            order.append(name)
+
+    with renders.slot(Priority.INTERACTIVE, "blocker"):
+        threads = [threading.Thread(target=render, args=("export", Priority.BATCH))]
+        threads[0].start()
+        time.sleep(0.1)
+        threads.append(threading.Thread(target=render, args=("view", Priority.INTERACTIVE)))
+        threads[1].start()
+        while waiting(renders) < 2:
+            time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+    # the export waited long enough to count as interactive
+    assert order == ["export", "view"]
+
+
+def test_keeps_a_slot_for_interactive_renders() -> None:
+    renders = scheduler.RenderScheduler(2)
+    granted = threading.Event()
+
+    with renders.slot(Priority.BATCH, "a"):
+
+        def export() -> None:
+            with renders.slot(Priority.BATCH, "a"):
+                granted.set()
+
+        thread = threading.Thread(target=export)
+        thread.start()
+        while renders.depth(Priority.BATCH) < 1:
+            time.sleep(0.01)
+        assert not granted.is_set()
+        with renders.slot(Priority.INTERACTIVE, "b"):
+            assert renders.running(Priority.INTERACTIVE) == 1
+    thread.join()
+    assert granted.is_set()
+
+
+def test_cancel_while_waiting() -> None:
+    renders = scheduler.RenderScheduler(1)
+    with renders.slot(Priority.INTERACTIVE, "a"):
+        with (
+            pytest.raises(process.RenderCancelledError),
+            renders.slot(Priority.INTERACTIVE, "b", cancelled=lambda: True),
+        ):
+            pass
+        assert renders.depth(Priority.INTERACTIVE) == 0
+    assert renders.running(Priority.INTERACTIVE) == 0
+
+
+def test_cancelled_renders_do_not_count_against_their_flow() -> None:
+    renders = scheduler.RenderScheduler(1)
+    with (
+        renders.slot(Priority.INTERACTIVE, "a"),
+        pytest.raises(process.RenderCancelledError),
+        renders.slot(Priority.INTERACTIVE, "b", 100, cancelled=lambda: True),
+    ):
+        pass
+    order = run_in_order(
+        renders, [("a1", Priority.INTERACTIVE, "a", 2), ("b1", Priority.INTERACTIVE, "b", 1)]
+    )
+    assert order == ["b1", "a1"]
+
+
+def test_resize_grants_waiting_renders() -> None:
+    renders = scheduler.RenderScheduler(1)
+    granted = threading.Event()
+
+    def render() -> None:
+        with renders.slot(Priority.INTERACTIVE, "b"):
+            granted.set()
+
+    with renders.slot(Priority.INTERACTIVE, "a"):
+        thread = threading.Thread(target=render)
+        thread.start()
+        while waiting(renders) < 1:
+            time.sleep(0.01)
+        renders.resize(2)
+        assert granted.wait(5)
+    thread.join()
+
+
+def test_slots_resize() -> None:
+    slots = scheduler.Slots(1)
+    entered = threading.Event()
+
+    def enter() -> None:
+        with slots:
+            entered.set()
+
+    with slots:
+        thread = threading.Thread(target=enter)
+        thread.start()
+        assert not entered.wait(0.1)
+        slots.resize(2)
+        assert entered.wait(5)
+    thread.join()
+
+
+def test_worker_capacity(tmp_path: Path) -> None:
+    jobs = queue.SQLiteQueue(tmp_path / "queue.db")
+    try:
+        assert scheduler.worker_capacity(jobs) == 1
+        for number in range(3):
+            jobs.register_worker(f"worker-{number}")
+        assert scheduler.worker_capacity(jobs) == 3
+
+        resized: list[int] = []
+        stop = threading.Event()
+        tracker = scheduler.track_workers(jobs, resized.append, interval=0.01, stop=stop)
+        jobs.register_worker("worker-3")
+        for _ in range(500):
+            if resized and resized[-1] == 4:
+                break
+            time.sleep(0.01)
+        stop.set()
+        tracker.join()
+        assert resized[-1] == 4
+    finally:
+        jobs.close()
+
+
+@pytest.mark.parametrize(("concurrency", "capacity"), [(None, 3), ("2", 2)])
+def test_app_sizes_renders_by_workers(tmp_path: Path, concurrency: str | None, capacity: int) -> None:
+    jobs = queue.SQLiteQueue(tmp_path / "queue.db")
+    for number in range(3):
+        jobs.register_worker(f"worker-{number}")
+    jobs.close()
+    os.environ["RENDERKNECHT_QUEUE"] = f"sqlite://{tmp_path}/queue.db"
+    if concurrency is None:
+        os.environ.pop("RENDERKNECHT_RENDER_CONCURRENCY", None)
+    else:
+        os.environ["RENDERKNECHT_RENDER_CONCURRENCY"] = concurrency
+
+    with patch("renderknecht.web.scheduler.RenderScheduler", wraps=scheduler.RenderScheduler) as renders:
+        create_app()
+    renders.assert_called_once_with(capacity)
+
+
+def test_estimate_cost() -> None:
+    memo = "# Memo\n\nShort.\n"
+    diagram = "```plantuml\nAlice -> Bob\n```\n"
+    assert scheduler.estimate_cost(memo) < scheduler.estimate_cost(memo * 1000)
+    assert scheduler.estimate_cost(memo + diagram) > scheduler.estimate_cost(memo + "x" * len(diagram))
+
+
+def test_fairness_from_env() -> None:
+    os.environ.pop("RENDERKNECHT_SCHEDULER_FAIRNESS", None)
+    assert scheduler.fairness() == "client"
+    os.environ["RENDERKNECHT_SCHEDULER_FAIRNESS"] = "pad"
+    assert scheduler.fairness() == "pad"
+    os.environ["RENDERKNECHT_SCHEDULER_FAIRNESS"] = "user"
+    with pytest.raises(ValueError, match="user"):
+        scheduler.fairness()
+
+
+def test_queue_depth_metrics() -> None:
+    renders = scheduler.RenderScheduler(1)
+    renders.export_metrics()
+    with renders.slot(Priority.BATCH, "a"):
+        exposition = metrics.REGISTRY.exposition()
+    assert 'renderknecht_render_queue_depth{priority="interactive"} 0.0' in exposition
+    assert 'renderknecht_renders_running{priority="batch"} 1.0' in exposition
+
+
+@patch("renderknecht.renderers.pandoc.render_markdown", return_value=b"%PDF")
+def test_app_schedules_renders(render_markdown: MagicMock) -> None:
+    wait = metrics.REGISTRY.summary("renderknecht_render_queue_seconds", "")
+    count = wait.count(priority="interactive")
+    stub = loadtest.StubHedgeDoc({"pad": "# Pad\n"})
+    stub.start()
+    os.environ["HEDGEDOC_URL"] = stub.url
+    os.environ.pop("RENDERKNECHT_QUEUE", None)
+    os.environ.pop("RENDERKNECHT_RENDER_CACHE", None)
+    try:
+        response = create_app().test_client().get("/pdf/pad", headers={"X-Forwarded-For": "10.0.0.1"})
+    finally:
+        stub.stop()
+
+    assert response.data == b"%PDF"
+    assert wait.count(priority="interactive") == count + 1
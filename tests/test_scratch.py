@@ -0,0 +1,73 @@
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from renderknecht.util import process, scratch
+
+
+@pytest.fixture(autouse=True)
+def scratch_root(tmp_path: Path) -> Path:
+    os.environ["RENDERKNECHT_SCRATCH_DIR"] = str(tmp_path)
+    return tmp_path
+
+
+def test_scratch_dir_removed_on_success(scratch_root: Path) -> None:
+    with scratch.scratch_dir() as work_dir:
+        (work_dir.path / "diagram.svg").write_text("<svg/>")
+        assert work_dir.path.parent == scratch_root
+    assert not work_dir.path.exists()
+
+
+def test_scratch_dir_removed_on_failure() -> None:
+    with pytest.raises(RuntimeError), scratch.scratch_dir() as work_dir:
+        (work_dir.path / "diagram.svg").write_text("<svg/>")
+        raise RuntimeError("render failed")
+    assert not work_dir.path.exists()
+
+
+def test_scratch_dir_limit() -> None:
+    with scratch.scratch_dir(limit=10) as work_dir:
+        (work_dir.path / "small").write_bytes(b"x" * 10)
+        work_dir.check()
+        (work_dir.path / "large").write_bytes(b"x" * 10)
+        with pytest.raises(scratch.ScratchSpaceError):
+            work_dir.check()
+
+
+def test_sweep_stale_removes_orphans_only(scratch_root: Path) -> None:
+    process = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True)
+    dead_pid = int(process.stdout)
+    orphan = scratch_root / f"render-{dead_pid}-abc"
+    orphan.mkdir()
+    (orphan / "document.tex").write_text("\\relax")
+    unrelated = scratch_root / "something-else"
+    unrelated.mkdir()
+
+    with scratch.scratch_dir() as work_dir:
+        assert scratch.sweep_stale() == 1
+        assert work_dir.path.exists()
+
+    assert not orphan.exists()
+    assert unrelated.exists()
+
+
+def test_supervisor_enforces_limit_while_process_runs() -> None:
+    with scratch.scratch_dir(limit=1024 * 1024) as work_dir:
+        supervisor = process.Supervisor(process.Limits(timeout=30))
+        supervisor.checks.append(work_dir.check)
+        # writes into a temporary directory of its own, like pandoc running LaTeX
+        script = (
+            "import tempfile, time\n"
+            "with tempfile.TemporaryDirectory() as directory:\n"
+            "    with open(f'{directory}/runaway.log', 'wb') as fh:\n"
+            "        while True:\n"
+            "            fh.write(b'x' * 65536); fh.flush(); time.sleep(0.01)\n"
+        )
+        started = time.monotonic()
+        with pytest.raises(scratch.ScratchSpaceError):
+            supervisor.run([sys.executable, "-c", script], env={**os.environ, "TMPDIR": str(work_dir.path)})
+        assert time.monotonic() - started < 10
@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from renderknecht import warmup
+from renderknecht.renderers import pandoc
+from renderknecht.util import yaml
+from renderknecht.web import create_app
+
+pytestmark = pytest.mark.usefixtures("no_preamble")
+
+
+@patch("renderknecht.renderers.pandoc.render_diagram", return_value="<svg/>")
+def test_canary_covers_the_toolchain(render_diagram: MagicMock, tmp_path: Path) -> None:
+    os.environ["PREAMBLE_YAML"] = str(pandoc._resource_path("preamble.yaml"))
+    yaml.configure()
+    markdown, metadata = pandoc.prepare_markdown(warmup.canary(), tmp_path)
+
+    assert metadata is not None
+    assert {"crossref", "toc"} <= set(metadata["pandoc-options"])
+    assert "@knuth1984" in markdown
+    assert pandoc.uses_latex_environments(markdown, metadata)
+    assert {call.args[0] for call in render_diagram.call_args_list} == {"graphviz", "plantuml"}
+
+
+@patch("renderknecht.warmup.pandoc_server.shared_server", return_value=None)
+def test_warm_up_renders_pdf_and_preview(shared_server: MagicMock) -> None:
+    render = MagicMock(return_value=b"")
+    assert warmup.warm_up(render) >= 0
+    assert [call.args[1] for call in render.call_args_list] == ["pdf", "html"]
+
+
+@patch("renderknecht.warmup.pandoc_server.shared_server")
+def test_warm_up_primes_pandoc_server(shared_server: MagicMock) -> None:
+    render = MagicMock(return_value=b"")
+    warmup.warm_up(render)
+    assert render.call_count == 3
+    assert render.call_args_list[1].args[0] == warmup.server_canary()
+    assert "crossref" not in warmup.server_canary()
+
+
+@patch("renderknecht.renderers.pandoc.latex.run_latex", return_value=b"%PDF")
+@patch("renderknecht.util.process.subprocess.Popen")
+@patch("renderknecht.renderers.pandoc.render_diagram", return_value="<svg/>")
+@patch("renderknecht.util.pandoc_server.shared_server")
+def test_server_canary_is_converted_by_pandoc_server(
+    shared_server: MagicMock,
+    render_diagram: MagicMock,
+    popen: MagicMock,
+    run_latex: MagicMock,
+    tmp_path: Path,
+) -> None:
+    templates = tmp_path / "pandoc" / "templates"
+    templates.mkdir(parents=True)
+    (templates / "eisvogel.latex").write_text("$body$")
+    os.environ["XDG_DATA_HOME"] = str(tmp_path)
+    shared_server.return_value.convert.return_value = "\\documentclass{article}"
+    popen.return_value.communicate.return_value = (b"%PDF", b"")
+    popen.return_value.returncode = 0
+    os.environ["PREAMBLE_YAML"] = str(pandoc._resource_path("preamble.yaml"))
+    yaml.configure()
+
+    warmup.warm_up()
+    shared_server.return_value.convert.assert_called_once()
+    assert "::: info" not in shared_server.return_value.convert.call_args[0][0]
+    run_latex.assert_called_once()
+
+
+def test_readiness_retries_failed_warm_up() -> None:
+    render = MagicMock(side_effect=[RuntimeError("no fonts"), b"", b"", b"", b""])
+    readiness = warmup.Readiness(retry_interval=0)
+    with patch("renderknecht.warmup.pandoc_server.shared_server", return_value=None):
+        readiness.warm_up(render)
+    assert readiness.ready.is_set()
+    assert readiness.error is None
+    assert render.call_count == 3
+
+
+@patch("renderknecht.warmup.pandoc_server.shared_server", return_value=None)
+@patch("renderknecht.web.pandoc.render_markdown")
+def test_readyz_waits_for_warm_up(render_markdown: MagicMock, shared_server: MagicMock) -> None:
+    release = threading.Event()
+    render_markdown.side_effect = lambda *args, **kwargs: release.wait(5) and b"%PDF"
+    os.environ["RENDERKNECHT_WARMUP"] = "1"
+    client = create_app().test_client()
+
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json is not None
+    assert response.json["error"] == "warming up"
+
+    release.set()
+    for _ in range(50):
+        if client.get("/readyz").status_code == 200:
+            break
+        time.sleep(0.1)
+    response = client.get("/readyz")
+    assert response.status_code == 200
+    assert response.json is not None
+    assert response.json["status"] == "ready"
+    assert render_markdown.call_count == 2
+
+
+def test_readyz_without_warm_up() -> None:
+    os.environ.pop("RENDERKNECHT_WARMUP", None)
+    assert create_app().test_client().get("/readyz").status_code == 200